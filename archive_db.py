@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# Job de arquivamento do histórico; agendar diariamente (ex.: cron às 02:00)
+#   python archive_db.py --dias-retencao 0
+# Também apaga as Idempotency-Key expiradas (tabela idempotency_keys), que
+# de outra forma crescem uma linha por POST/PUT com o cabeçalho.
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import argparse
+from datetime import date, timedelta
+
+from src.main import app
+from src.utils.archive import archive_history
+from src.utils.idempotency import purge_expired_keys
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Move slots e agendamentos passados para as tabelas de arquivo e remove as Idempotency-Key expiradas'
+    )
+    parser.add_argument('--dias-retencao', type=int, default=0,
+                        help='Quantos dias antes de hoje manter nas tabelas ativas')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+
+    cutoff = date.today() - timedelta(days=args.dias_retencao)
+
+    with app.app_context():
+        result = archive_history(cutoff=cutoff, batch_size=args.batch_size)
+        chaves = purge_expired_keys()
+
+    print(f"Arquivados até {cutoff.isoformat()}: "
+          f"{result['appointments']} agendamentos, {result['slots']} slots")
+    print(f"Idempotency-Key expiradas removidas: {chaves}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Compara o servidor Flask com threads (werkzeug) e a API ASGI (uvicorn)
+com muitos clientes lentos simultâneos, como na abertura de uma campanha
+em redes móveis: cada cliente abre a conexão, envia os cabeçalhos,
+demora --lento segundos para enviar o corpo e espera a resposta.
+
+Uso:
+    pip install -r requirements-async.txt
+    python populate_db.py
+    python benchmarks/async_bench.py --clientes 2000 --lento 2
+
+Os servidores rodam em subprocessos; o número de threads e a memória
+de cada um são lidos de /proc (Linux).
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'threaded': [sys.executable, '-c',
+                 'import sys; from werkzeug.serving import run_simple; from src.main import app; '
+                 'run_simple("127.0.0.1", int(sys.argv[1]), app, threaded=True)'],
+    'asgi': [sys.executable, '-m', 'uvicorn', 'src.asgi:app', '--host', '127.0.0.1',
+             '--log-level', 'warning', '--backlog', '4096', '--port'],
+}
+
+def pick_targets(count, seed):
+    """Pares (ubs_id, service_id) com slots, para variar as consultas"""
+    from src.main import app
+    from src.models.database import db, Slot
+    with app.app_context():
+        pairs = db.session.execute(db.select(Slot.ubs_id, Slot.service_id).distinct().limit(500)).all()
+    random.Random(seed).shuffle(pairs)
+    return [pairs[i % len(pairs)] for i in range(count)]
+
+def proc_status(pid):
+    status = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.strip()
+    return int(status['Threads']), int(status['VmRSS'].split()[0]) // 1024
+
+async def slow_client(port, target, delay, latencies, errors):
+    body = json.dumps({'ubs_id': target[0], 'service_id': target[1]}).encode()
+    head = (
+        'POST /api/appointments/available-dates HTTP/1.1\r\n'
+        f'Host: 127.0.0.1:{port}\r\n'
+        'Content-Type: application/json\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        'Connection: close\r\n\r\n'
+    ).encode()
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(head)
+        await writer.drain()
+        await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        start = time.perf_counter()
+        writer.write(body)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), timeout=120)
+        latencies.append(time.perf_counter() - start)
+        writer.close()
+        if not response.startswith(b'HTTP/1.1 200') and not response.startswith(b'HTTP/1.0 200'):
+            errors.append(response[:40])
+    except Exception as e:
+        errors.append(repr(e)[:60])
+
+async def run_clients(port, targets, delay, ramp, pid):
+    latencies, errors = [], []
+    peak = {'threads': 0, 'rss_mb': 0}
+    done = asyncio.Event()
+
+    async def sample():
+        while not done.is_set():
+            threads, rss = proc_status(pid)
+            peak['threads'] = max(peak['threads'], threads)
+            peak['rss_mb'] = max(peak['rss_mb'], rss)
+            await asyncio.sleep(0.1)
+
+    sampler = asyncio.create_task(sample())
+    start = time.perf_counter()
+    tasks = []
+    for i, target in enumerate(targets):
+        tasks.append(asyncio.create_task(slow_client(port, target, delay, latencies, errors)))
+        if ramp and i % 100 == 99:
+            await asyncio.sleep(ramp)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    done.set()
+    await sampler
+
+    latencies.sort()
+    pct = lambda p: round(latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000, 1) if latencies else None
+    return {
+        'ok': len(targets) - len(errors),
+        'erros': len(errors),
+        'exemplo_erro': errors[0] if errors else None,
+        'duracao_s': round(elapsed, 2),
+        'p50_ms': pct(50),
+        'p99_ms': pct(99),
+        'threads_pico': peak['threads'],
+        'rss_pico_mb': peak['rss_mb'],
+    }
+
+def wait_ready(port, timeout=60):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Servidor não respondeu na porta {port}')
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor com threads x API ASGI com clientes lentos')
+    parser.add_argument('--clientes', type=int, default=1000)
+    parser.add_argument('--lento', type=float, default=2.0,
+                        help='Segundos (em média) que cada cliente leva para enviar o corpo')
+    parser.add_argument('--rampa', type=float, default=0.05,
+                        help='Pausa a cada 100 conexões abertas')
+    parser.add_argument('--servidores', default='threaded,asgi')
+    parser.add_argument('--porta', type=int, default=5055)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    targets = pick_targets(args.clientes, args.seed)
+    results = {}
+    for i, name in enumerate(args.servidores.split(',')):
+        port = args.porta + i
+        server = subprocess.Popen(SERVERS[name] + [str(port)], cwd=ROOT,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(port)
+            results[name] = asyncio.run(run_clients(port, targets, args.lento, args.rampa, server.pid))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        print(f'{name:9} {json.dumps(results[name], ensure_ascii=False)}')
+
+    print(json.dumps(results, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
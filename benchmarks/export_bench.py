@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Compara a listagem JSON de /api/admin/appointments com a exportação
+streaming de /api/admin/export (CSV gzip e Parquet) no mesmo período.
+
+Uso:
+    python populate_db.py --usuarios 200000 --agendamentos 1000000 --cidades-extras 50 --ubs-por-cidade 20
+    python benchmarks/export_bench.py --dias 30
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import time
+from datetime import date, timedelta
+
+from src.main import app
+from src.utils import export
+
+def run(client, url):
+    start = time.perf_counter()
+    response = client.get(url)
+    size = 0
+    for chunk in response.response:
+        size += len(chunk)
+    response.close()
+    return response.status_code, time.perf_counter() - start, size
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da exportação de agendamentos')
+    parser.add_argument('--dias', type=int, default=30, help='Tamanho do período exportado')
+    parser.add_argument('--sem-json', action='store_true', help='Pula a listagem JSON (lenta em bases grandes)')
+    args = parser.parse_args()
+
+    data_inicio = date.today()
+    data_fim = data_inicio + timedelta(days=args.dias)
+    period = f'data_inicio={data_inicio.isoformat()}&data_fim={data_fim.isoformat()}'
+
+    cases = []
+    if not args.sem_json:
+        cases.append(('json', f'/api/admin/appointments?{period}'))
+    cases.append(('csv.gz', f'/api/admin/export?formato=csv&{period}'))
+    if export.pa is not None:
+        cases.append(('parquet', f'/api/admin/export?formato=parquet&{period}'))
+
+    client = app.test_client()
+    results = {}
+    for name, url in cases:
+        status, elapsed, size = run(client, url)
+        results[name] = {'status': status, 'segundos': round(elapsed, 2), 'mb': round(size / 1024 / 1024, 1)}
+        print(f'{name:8} {status} {elapsed:7.2f}s {size / 1024 / 1024:8.1f} MB')
+
+    if 'json' in results:
+        for name in results:
+            if name != 'json':
+                print(f"{name}: {results['json']['segundos'] / max(results[name]['segundos'], 1e-9):.1f}x mais rápido que JSON")
+
+    print(json.dumps(results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Compara as chaves VARCHAR(36) com UUID4 aleatório (schema antigo) com os
+ids compactos de 16 bytes ordenados pelo tempo (CompactId/generate_uuid):
+tamanho das tabelas e índices, tempo de inserção e das junções usadas em
+get_user_appointments e na listagem do admin.
+
+Uso:
+    python benchmarks/keys.py --usuarios 1000000 --agendamentos 5000000
+
+Cada schema é gravado num banco SQLite próprio em --dir; os tamanhos vêm
+da tabela virtual dbstat.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import random
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+
+from src.models.database import CompactId, generate_uuid
+
+SCHEMAS = {
+    'uuid36': (lambda: sa.String(36), lambda: str(uuid.uuid4())),
+    'compacto': (CompactId, generate_uuid),
+}
+
+BATCH = 10000
+
+def build_tables(key_type):
+    metadata = sa.MetaData()
+    users = sa.Table(
+        'users', metadata,
+        sa.Column('id', key_type(), primary_key=True),
+        sa.Column('cpf', sa.String(11), nullable=False),
+        sa.Column('nome_completo', sa.String(255))
+    )
+    ubs = sa.Table(
+        'ubs', metadata,
+        sa.Column('id', key_type(), primary_key=True),
+        sa.Column('nome', sa.String(255), nullable=False)
+    )
+    appointments = sa.Table(
+        'appointments', metadata,
+        sa.Column('id', key_type(), primary_key=True),
+        sa.Column('user_id', key_type(), sa.ForeignKey('users.id'), nullable=False, index=True),
+        sa.Column('ubs_id', key_type(), sa.ForeignKey('ubs.id'), nullable=False),
+        sa.Column('data_agendamento', sa.Date, nullable=False),
+        sa.Column('status', sa.String(20)),
+        sa.Index('ix_appointments_ubs_data', 'ubs_id', 'data_agendamento')
+    )
+    return metadata, users, ubs, appointments
+
+def timed_insert(engine, table, rows_iter):
+    start = time.perf_counter()
+    batch = []
+    with engine.begin() as conn:
+        for row in rows_iter:
+            batch.append(row)
+            if len(batch) == BATCH:
+                conn.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(table.insert(), batch)
+    return time.perf_counter() - start
+
+def sizes(engine):
+    with engine.connect() as conn:
+        rows = conn.execute(sa.text('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name')).all()
+    return {name: round(size / 1024 / 1024, 1) for name, size in rows if not name.startswith('sqlite_schema')}
+
+def time_queries(engine, statement, params):
+    start = time.perf_counter()
+    total = 0
+    with engine.connect() as conn:
+        for values in params:
+            total += len(conn.execute(statement, values).all())
+    elapsed = time.perf_counter() - start
+    return {'ms_por_consulta': round(elapsed / len(params) * 1000, 3), 'linhas': total}
+
+def run(name, args, directory):
+    key_type, new_id = SCHEMAS[name]
+    path = os.path.join(directory, f'keys_{name}.db')
+    if os.path.exists(path):
+        os.remove(path)
+    engine = sa.create_engine(f'sqlite:///{path}')
+    metadata, users, ubs, appointments = build_tables(key_type)
+    metadata.create_all(engine)
+
+    rng = random.Random(args.seed)
+    ubs_ids = [new_id() for _ in range(args.ubs)]
+    user_ids = [new_id() for _ in range(args.usuarios)]
+    inicio = date.today()
+
+    timed_insert(engine, ubs, ({'id': ubs_id, 'nome': f'UBS {i}'} for i, ubs_id in enumerate(ubs_ids)))
+    users_s = timed_insert(engine, users, (
+        {'id': user_id, 'cpf': f'{i:011d}', 'nome_completo': f'Usuário {i}'}
+        for i, user_id in enumerate(user_ids)
+    ))
+    appointments_s = timed_insert(engine, appointments, (
+        {
+            'id': new_id(),
+            'user_id': user_ids[rng.randrange(args.usuarios)],
+            'ubs_id': ubs_ids[rng.randrange(args.ubs)],
+            'data_agendamento': inicio + timedelta(days=rng.randrange(args.dias)),
+            'status': 'Confirmado'
+        }
+        for _ in range(args.agendamentos)
+    ))
+
+    by_user = (
+        sa.select(appointments.c.id, appointments.c.data_agendamento, ubs.c.nome)
+        .join(ubs, appointments.c.ubs_id == ubs.c.id)
+        .where(appointments.c.user_id == sa.bindparam('user_id', type_=key_type()))
+    )
+    by_ubs_day = (
+        sa.select(appointments.c.id, users.c.nome_completo, users.c.cpf)
+        .join(users, appointments.c.user_id == users.c.id)
+        .where(
+            appointments.c.ubs_id == sa.bindparam('ubs_id', type_=key_type()),
+            appointments.c.data_agendamento == sa.bindparam('data')
+        )
+    )
+    query_rng = random.Random(args.seed + 1)
+    result = {
+        'insercao_usuarios_s': round(users_s, 2),
+        'insercao_agendamentos_s': round(appointments_s, 2),
+        'agendamentos_por_s': round(args.agendamentos / appointments_s),
+        'consulta_por_usuario': time_queries(engine, by_user, [
+            {'user_id': user_ids[query_rng.randrange(args.usuarios)]} for _ in range(args.consultas)
+        ]),
+        'consulta_por_ubs_e_dia': time_queries(engine, by_ubs_day, [
+            {'ubs_id': ubs_ids[query_rng.randrange(args.ubs)],
+             'data': inicio + timedelta(days=query_rng.randrange(args.dias))}
+            for _ in range(args.consultas)
+        ]),
+        'tamanhos_mb': sizes(engine),
+        'arquivo_mb': round(os.path.getsize(path) / 1024 / 1024, 1),
+    }
+    engine.dispose()
+    if not args.manter:
+        os.remove(path)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de chaves VARCHAR(36) x ids compactos')
+    parser.add_argument('--usuarios', type=int, default=200000)
+    parser.add_argument('--agendamentos', type=int, default=1000000)
+    parser.add_argument('--ubs', type=int, default=2000)
+    parser.add_argument('--dias', type=int, default=60)
+    parser.add_argument('--consultas', type=int, default=2000)
+    parser.add_argument('--schemas', default='uuid36,compacto')
+    parser.add_argument('--dir', default=tempfile.gettempdir())
+    parser.add_argument('--manter', action='store_true', help='Não apaga os bancos gerados')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.schemas.split(','):
+        results[name] = run(name, args, args.dir)
+        print(f'{name:9} {json.dumps(results[name], ensure_ascii=False)}')
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Teste de carga simulando a abertura de uma campanha de vacinação.
+
+Cada cidadão virtual percorre o fluxo completo do app:
+login -> cidades -> UBS -> serviços -> datas disponíveis -> agendamento
+
+Uso:
+    python populate_db.py --cidades-extras 20 --ubs-por-cidade 50 --dias 60
+    python benchmarks/load_test.py --cidadaos 2000 --concorrencia 50
+
+Por padrão o app é servido em uma thread deste processo (servidor werkzeug
+com threads), usando o banco de DATABASE_URL ou o SQLite de desenvolvimento.
+Com --url o teste usa um servidor já em execução; nesse caso DATABASE_URL
+deve apontar para o mesmo banco para a verificação de overbooking.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import http.client
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from sqlalchemy import select, func, and_
+
+from src.main import app
+from src.models.database import db, Slot, Appointment
+from src.utils.cpf_validator import generate_cpf
+
+ENDPOINTS = ['login', 'cities', 'ubs', 'services', 'available-dates', 'create']
+
+class Stats:
+    """Latências e erros por endpoint, compartilhados entre as threads"""
+
+    def __init__(self):
+        self.latencies = {name: [] for name in ENDPOINTS}
+        self.errors = {name: 0 for name in ENDPOINTS}
+        self.bookings = 0
+        self.rejected = 0
+        self.no_vacancy = 0
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed, ok):
+        with self._lock:
+            self.latencies[name].append(elapsed)
+            if not ok:
+                self.errors[name] += 1
+
+    def count(self, attr):
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + 1)
+
+class Client:
+    """Conexão HTTP keep-alive de um cidadão virtual"""
+
+    def __init__(self, base_url, stats):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.stats = stats
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+    def request(self, name, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        payload = json.dumps(body) if body is not None else None
+
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            status, data = response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            status, data = 0, b''
+        elapsed = time.perf_counter() - start
+
+        # 400 em /create é uma recusa de negócio (sem vaga), não uma falha
+        self.stats.record(name, elapsed, status == 200 or (name == 'create' and status == 400))
+
+        try:
+            return status, json.loads(data)
+        except ValueError:
+            return status, {}
+
+    def close(self):
+        self.conn.close()
+
+def citizen(base_url, stats, seed, datas_disputadas):
+    """Fluxo de um cidadão; retorna quando agenda ou desiste"""
+    rng = random.Random(seed)
+    client = Client(base_url, stats)
+    try:
+        nascimento = f"{rng.randint(1940, 2010)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        status, data = client.request('login', 'POST', '/api/auth/login',
+                                      {'cpf': generate_cpf(rng), 'data_nascimento': nascimento})
+        if status != 200:
+            return
+        user_id = data['user_id']
+
+        status, data = client.request('cities', 'GET', '/api/appointments/cities')
+        if not data.get('cities'):
+            return
+        city = rng.choice(data['cities'])
+
+        status, data = client.request('ubs', 'GET', f"/api/appointments/ubs/{city['id']}")
+        if not data.get('ubs'):
+            return
+        ubs = rng.choice(data['ubs'])
+
+        status, data = client.request('services', 'GET', f"/api/appointments/services/{ubs['id']}")
+        if not data.get('services'):
+            return
+        service = rng.choice(data['services'])
+
+        status, data = client.request('available-dates', 'POST', '/api/appointments/available-dates',
+                                      {'ubs_id': ubs['id'], 'service_id': service['id']})
+        dates = data.get('available_dates')
+        if not dates:
+            stats.count('no_vacancy')
+            return
+
+        # Na abertura da campanha todos disputam as primeiras datas
+        dates.sort(key=lambda d: d['data'])
+        day = rng.choice(dates[:datas_disputadas])
+        turno = rng.choice(list(day['turnos']))
+
+        status, data = client.request('create', 'POST', '/api/appointments/create', {
+            'user_id': user_id,
+            'ubs_id': ubs['id'],
+            'service_id': service['id'],
+            'data_agendamento': day['data'],
+            'turno': turno
+        })
+        stats.count('bookings' if status == 200 else 'rejected')
+    finally:
+        client.close()
+
+def start_local_server():
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+def check_overbooking():
+    """Compara os agendamentos confirmados com a capacidade de cada slot"""
+    confirmed = (
+        select(
+            Appointment.ubs_id, Appointment.service_id, Appointment.data_agendamento,
+            Appointment.turno, func.count().label('confirmados')
+        )
+        .where(Appointment.status == 'Confirmado')
+        .group_by(Appointment.ubs_id, Appointment.service_id, Appointment.data_agendamento, Appointment.turno)
+        .subquery()
+    )
+    with app.app_context():
+        rows = db.session.execute(
+            select(Slot.quantidade_total, Slot.quantidade_disponivel, confirmed.c.confirmados)
+            .join(confirmed, and_(
+                Slot.ubs_id == confirmed.c.ubs_id,
+                Slot.service_id == confirmed.c.service_id,
+                Slot.data == confirmed.c.data_agendamento,
+                Slot.turno == confirmed.c.turno
+            ))
+        ).all()
+        negative = db.session.scalar(select(func.count()).select_from(Slot).where(Slot.quantidade_disponivel < 0))
+
+    return {
+        'slots_com_agendamentos': len(rows),
+        'slots_com_overbooking': sum(1 for total, _, count in rows if count > total),
+        'agendamentos_excedentes': sum(max(0, count - total) for total, _, count in rows),
+        'slots_com_saldo_divergente': sum(1 for total, available, count in rows if available != total - count),
+        'slots_com_saldo_negativo': negative
+    }
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def build_report(stats, elapsed, cidadaos, concorrencia, overbooking):
+    endpoints = {}
+    for name in ENDPOINTS:
+        values = stats.latencies[name]
+        endpoints[name] = {
+            'requisicoes': len(values),
+            'erros': stats.errors[name],
+            'p50_ms': round(percentile(values, 50) * 1000, 2),
+            'p95_ms': round(percentile(values, 95) * 1000, 2),
+            'p99_ms': round(percentile(values, 99) * 1000, 2)
+        }
+
+    return {
+        'cidadaos': cidadaos,
+        'concorrencia': concorrencia,
+        'duracao_s': round(elapsed, 2),
+        'agendamentos': stats.bookings,
+        'agendamentos_recusados': stats.rejected,
+        'sem_vagas': stats.no_vacancy,
+        'agendamentos_por_s': round(stats.bookings / elapsed, 2) if elapsed else 0.0,
+        'endpoints': endpoints,
+        'overbooking': overbooking
+    }
+
+def print_report(report):
+    print(f"\nCidadãos: {report['cidadaos']}  concorrência: {report['concorrencia']}  "
+          f"duração: {report['duracao_s']}s")
+    print(f"Agendamentos: {report['agendamentos']} ({report['agendamentos_por_s']}/s), "
+          f"recusados: {report['agendamentos_recusados']}, sem vagas: {report['sem_vagas']}\n")
+
+    print(f"{'endpoint':<18}{'req':>8}{'erros':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, row in report['endpoints'].items():
+        print(f"{name:<18}{row['requisicoes']:>8}{row['erros']:>8}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}")
+
+    print('\nVerificação de overbooking:')
+    for key, value in report['overbooking'].items():
+        print(f"  {key}: {value}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Teste de carga do fluxo de agendamento')
+    parser.add_argument('--url', help='URL de um servidor já em execução (ex.: http://localhost:5000)')
+    parser.add_argument('--cidadaos', type=int, default=500)
+    parser.add_argument('--concorrencia', type=int, default=20)
+    parser.add_argument('--datas-disputadas', type=int, default=3,
+                        help='Quantas das primeiras datas disponíveis os cidadãos disputam')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Grava o relatório em JSON neste arquivo')
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        server, base_url = start_local_server()
+
+    stats = Stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concorrencia) as executor:
+        futures = [
+            executor.submit(citizen, base_url, stats, args.seed * 1_000_003 + i, args.datas_disputadas)
+            for i in range(args.cidadaos)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+
+    if server:
+        server.shutdown()
+
+    report = build_report(stats, elapsed, args.cidadaos, args.concorrencia, check_overbooking())
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Custo da validação das requisições (src/utils/schemas.py) e trabalho de
+banco evitado com entrada inválida.
+
+- µs por chamada de CREATE_APPOINTMENT.load, comparado com a leitura manual
+  (dict.get + strptime + parse_horario) que as rotas faziam, com o cache de
+  datas quente e frio;
+- requisições malformadas (sem corpo, JSON que não é objeto, campos
+  ausentes, tipos e datas inválidos, ids fora do formato) enviadas pelo
+  test_client: status devolvido e comandos SQL executados por requisição.
+
+Uso:
+    python benchmarks/schemas.py --chamadas 200000 --requisicoes 2000
+
+Usa o banco configurado do app (src/database/app.db por padrão); nenhuma
+das requisições malformadas grava nada.
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import json
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+
+from src.utils import schemas
+from src.utils.capacity import parse_horario
+
+def manual_load(data):
+    """Leitura que create_appointment fazia antes do schema"""
+    user_id = data.get('user_id')
+    ubs_id = data.get('ubs_id')
+    service_id = data.get('service_id')
+    data_agendamento = data.get('data_agendamento')
+    turno = data.get('turno')
+    horario = data.get('horario')
+    if not all([user_id, ubs_id, service_id, data_agendamento]) or not (turno or horario):
+        raise ValueError('Todos os campos são obrigatórios')
+    data_obj = datetime.strptime(data_agendamento, '%Y-%m-%d').date()
+    minutos = parse_horario(horario) if horario else None
+    return user_id, ubs_id, service_id, data_obj, turno, minutos
+
+def bodies(count, dias):
+    hoje = date.today()
+    return [
+        {
+            'user_id': str(uuid.uuid4()),
+            'ubs_id': str(uuid.uuid4()),
+            'service_id': str(uuid.uuid4()),
+            'data_agendamento': (hoje + timedelta(days=i % dias)).isoformat(),
+            'horario': f'{8 + i % 9:02d}:{(i % 4) * 15:02d}'
+        }
+        for i in range(count)
+    ]
+
+def time_calls(function, items):
+    start = time.perf_counter()
+    for item in items:
+        function(item)
+    return round((time.perf_counter() - start) / len(items) * 1e6, 2)
+
+def microbenchmark(args):
+    items = bodies(args.chamadas, args.dias)
+    manual = time_calls(manual_load, items)
+    schemas.parse_date.cache_clear()
+    frio = time_calls(schemas.CREATE_APPOINTMENT.load, items)
+    quente = time_calls(schemas.CREATE_APPOINTMENT.load, items)
+    return {
+        'manual_us': manual,
+        'schema_cache_frio_us': frio,
+        'schema_cache_quente_us': quente,
+        'datas_em_cache': schemas.parse_date.cache_info().currsize,
+    }
+
+# (método, url, corpo): corpo None envia a requisição sem corpo
+MALFORMED = [
+    ('POST', '/api/appointments/create', None),
+    ('POST', '/api/appointments/create', []),
+    ('POST', '/api/appointments/create', {'user_id': 'x'}),
+    ('POST', '/api/appointments/create', {
+        'user_id': str(uuid.uuid4()), 'ubs_id': str(uuid.uuid4()), 'service_id': str(uuid.uuid4()),
+        'data_agendamento': '2024-02-30', 'turno': 'Manhã'
+    }),
+    ('POST', '/api/appointments/create', {
+        'user_id': 'nao-e-um-id', 'ubs_id': str(uuid.uuid4()), 'service_id': str(uuid.uuid4()),
+        'data_agendamento': '2030-01-10', 'turno': 'Manhã'
+    }),
+    ('POST', '/api/appointments/available-dates', None),
+    ('POST', '/api/appointments/available-windows', {'ubs_id': 1, 'service_id': 2}),
+    ('POST', '/api/auth/login', None),
+    ('POST', '/api/auth/login', {'cpf': '52998224725', 'data_nascimento': '31/12/1990'}),
+    ('PUT', '/api/auth/update-user', {'nome_completo': 'Sem id'}),
+    ('PUT', '/api/appointments/cancel/123', None),
+    ('GET', '/api/appointments/user/abc', None),
+    ('GET', '/api/appointments/nearest-ubs?lat=abc&lon=1', None),
+    ('GET', '/api/appointments/search?tipo=outro', None),
+    ('POST', '/api/admin/slots', {'ubs_id': str(uuid.uuid4()), 'turno': 'Noite'}),
+]
+
+def malformed_traffic(args):
+    from src.main import app
+    from src.models.database import db
+
+    client = app.test_client()
+    statements = Counter()
+    statuses = Counter()
+
+    with app.app_context():
+        engines = {db.engine} | set(db.engines.values())
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements['total'] += 1
+
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', count)
+
+    start = time.perf_counter()
+    for i in range(args.requisicoes):
+        method, url, body = MALFORMED[i % len(MALFORMED)]
+        kwargs = {} if body is None else {'json': body}
+        response = client.open(url, method=method, **kwargs)
+        statuses[response.status_code] += 1
+    elapsed = time.perf_counter() - start
+
+    for engine in engines:
+        event.remove(engine, 'before_cursor_execute', count)
+
+    return {
+        'requisicoes': args.requisicoes,
+        'status': dict(sorted(statuses.items())),
+        'sql_por_requisicao': round(statements['total'] / args.requisicoes, 3),
+        'us_por_requisicao': round(elapsed / args.requisicoes * 1e6, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da validação das requisições')
+    parser.add_argument('--chamadas', type=int, default=100000)
+    parser.add_argument('--dias', type=int, default=60, help='Datas distintas nos corpos gerados')
+    parser.add_argument('--requisicoes', type=int, default=1500)
+    args = parser.parse_args()
+
+    results = {
+        'load': microbenchmark(args),
+        'malformadas': malformed_traffic(args),
+    }
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Extração de agendamentos para as secretarias de saúde
+#   python export_appointments.py --data-inicio 2025-01-01 --data-fim 2025-01-31 --formato parquet
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import argparse
+import time
+from datetime import datetime
+
+from src.main import app
+from src.utils import export
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta agendamentos em CSV compactado ou Parquet')
+    parser.add_argument('--data-inicio', required=True, help='AAAA-MM-DD')
+    parser.add_argument('--data-fim', required=True, help='AAAA-MM-DD')
+    parser.add_argument('--formato', choices=export.FORMATS, default='csv')
+    parser.add_argument('--colunas', help='Colunas separadas por vírgula. Disponíveis: '
+                        + ', '.join(export.COLUMNS))
+    parser.add_argument('--ubs-id')
+    parser.add_argument('--service-id')
+    parser.add_argument('--incluir-historico', action='store_true',
+                        help='Inclui os agendamentos arquivados')
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--saida', help='Arquivo de saída (padrão: agendamentos_<periodo>.<ext>)')
+    args = parser.parse_args()
+
+    data_inicio = datetime.strptime(args.data_inicio, '%Y-%m-%d').date()
+    data_fim = datetime.strptime(args.data_fim, '%Y-%m-%d').date()
+
+    try:
+        writer = export.get_writer(args.formato, export.parse_columns(args.colunas))
+    except (ValueError, RuntimeError) as e:
+        parser.error(str(e))
+
+    saida = args.saida or f'agendamentos_{data_inicio.isoformat()}_{data_fim.isoformat()}.{writer.extension}'
+
+    start = time.perf_counter()
+    total_bytes = 0
+    with app.app_context(), open(saida, 'wb') as f:
+        for data in export.export_appointments(
+            writer, data_inicio, data_fim,
+            ubs_id=args.ubs_id,
+            service_id=args.service_id,
+            incluir_historico=args.incluir_historico,
+            chunk_size=args.chunk_size
+        ):
+            f.write(data)
+            total_bytes += len(data)
+    elapsed = time.perf_counter() - start
+
+    print(f'{saida}: {writer.rows} agendamentos, {total_bytes / 1024 / 1024:.1f} MB em {elapsed:.1f}s '
+          f'({writer.rows / elapsed:.0f} linhas/s)')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# Migra um banco com chaves VARCHAR(36) para os ids compactos de 16 bytes.
+# A cópia é feita para um banco novo; depois de conferida, basta apontar
+# DATABASE_URL para ele (ou substituir o arquivo do SQLite):
+#   python migrate_keys.py --destino sqlite:///src/database/app_compacto.db
+#   python migrate_keys.py --origem postgresql://localhost/agendamento \
+#       --destino postgresql://localhost/agendamento_novo --batch-size 20000
+#
+# Os ids existentes (UUID4) são mantidos; os criados a partir daqui são
+# ordenados pelo tempo (ver generate_uuid em src/models/database.py).
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import argparse
+import json
+import time
+
+from src.main import app
+from src.utils.keys import copy_database
+
+def main():
+    parser = argparse.ArgumentParser(description='Copia o banco para o schema com ids de 16 bytes')
+    parser.add_argument('--origem', default=app.config['SQLALCHEMY_DATABASE_URI'],
+                        help='URL do banco atual (padrão: DATABASE_URL da aplicação)')
+    parser.add_argument('--destino', required=True, help='URL do banco novo, vazio')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.origem == args.destino:
+        parser.error('origem e destino devem ser bancos diferentes')
+
+    start = time.perf_counter()
+    report = copy_database(args.origem, args.destino, batch_size=args.batch_size)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f'Migração concluída em {time.perf_counter() - start:.1f}s')
+
+if __name__ == '__main__':
+    main()
@@ -1,118 +1,380 @@
 #!/usr/bin/env python3
+# Recria o banco com os dados de demonstração e, opcionalmente, volume de produção:
+#   python populate_db.py
+#   python populate_db.py --cidades-extras 500 --ubs-por-cidade 10 --servicos-extras 15 \
+#       --dias 365 --usuarios 2000000 --agendamentos 3000000 --workers 8
+#
+# Os dados gerados são determinísticos para um mesmo --seed (inclusive os ids),
+# e o volume é gerado em processos paralelos e gravado com INSERTs em lote.
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from src.models.database import db, City, UBS, Service, Admin, Slot
+from src.models.database import db, City, CityShard, UBS, Service, Admin, Slot, Appointment, User, DayCapacity, ubs_services
 from src.main import app
+from src.utils.cpf_validator import complete_cpf
+from src.utils.capacity import build_days
+from src.utils.booking_rules import rebuild_states
+from src.utils import sharding
+import argparse
+import hashlib
+import random
+import time
+import uuid
 import bcrypt
-from datetime import date, timedelta
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+
+CIDADES_DEMO = ['São Paulo', 'Rio de Janeiro', 'Belo Horizonte']
+
+SERVICOS_DEMO = [
+    ('Clínico Geral', 'Consulta médica geral'),
+    ('Dentista', 'Consulta odontológica'),
+    ('Pediatra', 'Consulta pediátrica'),
+    ('Ginecologista', 'Consulta ginecológica'),
+    ('Cardiologista', 'Consulta cardiológica'),
+]
+
+# (nome, endereço, cidade, serviços)
+UBS_DEMO = [
+    ('UBS Vila Madalena', 'Rua Harmonia, 123', 'São Paulo', ['Clínico Geral', 'Dentista', 'Pediatra']),
+    ('UBS Jardins', 'Av. Paulista, 456', 'São Paulo', ['Clínico Geral', 'Ginecologista', 'Cardiologista']),
+    ('UBS Copacabana', 'Av. Atlântica, 789', 'Rio de Janeiro', ['Clínico Geral', 'Dentista', 'Ginecologista']),
+    ('UBS Centro', 'Rua da Bahia, 321', 'Belo Horizonte', ['Clínico Geral', 'Pediatra', 'Cardiologista']),
+]
+
+# (latitude, longitude) das UBS de demonstração, na mesma ordem de UBS_DEMO
+COORDENADAS_DEMO = [(-23.5534, -46.6912), (-23.5614, -46.6559), (-22.9711, -43.1822), (-19.9191, -43.9386)]
+
+SERVICOS_EXTRAS = ['Vacinação', 'Enfermagem', 'Psicologia', 'Nutrição', 'Fisioterapia',
+                   'Oftalmologia', 'Dermatologia', 'Ortopedia', 'Pré-natal', 'Exames Laboratoriais',
+                   'Fonoaudiologia', 'Saúde Mental', 'Planejamento Familiar', 'Curativos', 'Hipertensão e Diabetes']
+
+BAIRROS = ['Centro', 'Jardim América', 'Vila Nova', 'Santa Luzia', 'São José', 'Boa Vista',
+           'Alto da Serra', 'Parque das Flores', 'Vila Esperança', 'Bela Vista']
+
+NOMES = ['Ana', 'Maria', 'João', 'José', 'Francisca', 'Antônio', 'Carlos', 'Paulo', 'Adriana', 'Juliana',
+         'Lucas', 'Marcos', 'Fernanda', 'Patrícia', 'Rafael', 'Aline', 'Bruno', 'Camila', 'Pedro', 'Sandra']
+
+SOBRENOMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira',
+              'Lima', 'Gomes', 'Costa', 'Ribeiro', 'Martins', 'Carvalho', 'Almeida', 'Lopes']
+
+TURNOS = ['Manhã', 'Tarde']
+
+# Multiplicador coprimo com 10^9: percorre todas as bases de CPF sem repetir
+CPF_MULTIPLIER = 387420489
 
 def hash_password(password):
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
-def populate_database():
+def make_id(seed, kind, key):
+    """Id determinístico (formato UUID) para a entidade kind/key"""
+    digest = hashlib.blake2b(f'{seed}:{kind}:{key}'.encode('utf-8'), digest_size=16).digest()
+    return str(uuid.UUID(bytes=digest, version=4))
+
+def _generate_users(task):
+    """Gera um lote de usuários com CPFs válidos e únicos (executa em processo separado)"""
+    seed, start, count = task
+    rng = random.Random(f'{seed}:users:{start}')
+    offset = seed * 7919 % 10**9
+    now = datetime.utcnow()
+
+    rows = []
+    for index in range(start, start + count):
+        base = f'{(index * CPF_MULTIPLIER + offset) % 10**9:09d}'
+        if base == base[0] * 9:
+            base = f'{(int(base) + 1) % 10**9:09d}'
+        rows.append({
+            'id': make_id(seed, 'user', index),
+            'cpf': complete_cpf(base),
+            'data_nascimento': date(rng.randint(1940, 2020), rng.randint(1, 12), rng.randint(1, 28)),
+            'nome_completo': f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}',
+            'celular': f'{rng.randint(11, 99)}9{rng.randint(0, 99999999):08d}',
+            'carteira_sus': f'{rng.randint(0, 10**15 - 1):015d}',
+            'created_at': now - timedelta(days=rng.randint(0, 730))
+        })
+    return rows
+
+def _generate_ubs(task):
+    """
+    Gera as UBS de um lote com suas associações, slots e agendamentos
+    (executa em processo separado). UBS com services=None são novas;
+    as demais já existem e só recebem slots.
+    """
+    seed, ubs_specs, service_ids, params = task
+    dias_uteis = [
+        params['inicio'] + timedelta(days=i)
+        for i in range(params['dias'])
+        if (params['inicio'] + timedelta(days=i)).weekday() < 5
+    ]
+    vagas = params['vagas_por_turno']
+    fill = params['ocupacao']
+    now = datetime.utcnow()
+
+    result = {'ubs': [], 'ubs_services': [], 'slots': [], 'appointments': [], 'day_capacities': []}
+    for index, ubs_id, cidade_id, services in ubs_specs:
+        rng = random.Random(f'{seed}:ubs:{index}')
+
+        if services is None:
+            # As UBS de uma cidade ficam a até ~10 km do centro dela, sorteado no território nacional
+            centro = random.Random(f'{seed}:city:{cidade_id}')
+            lat, lon = centro.uniform(-30.0, -3.0), centro.uniform(-60.0, -35.0)
+            result['ubs'].append({
+                'id': ubs_id,
+                'nome': f'UBS {rng.choice(BAIRROS)} {index}',
+                'endereco': f'Rua {rng.randint(1, 500)}, {rng.randint(1, 2000)}',
+                'cidade_id': cidade_id,
+                'latitude': round(lat + rng.uniform(-0.09, 0.09), 6),
+                'longitude': round(lon + rng.uniform(-0.09, 0.09), 6)
+            })
+            services = rng.sample(service_ids, min(len(service_ids), rng.randint(3, 6)))
+            result['ubs_services'].extend({'ubs_id': ubs_id, 'service_id': s} for s in services)
+
+        for dia in dias_uteis:
+            for service_id in services:
+                for turno in TURNOS:
+                    booked = sum(1 for _ in range(vagas) if rng.random() < fill) if params['usuarios'] else 0
+                    result['slots'].append({
+                        'id': make_id(seed, 'slot', f'{ubs_id}:{service_id}:{dia}:{turno}'),
+                        'ubs_id': ubs_id,
+                        'service_id': service_id,
+                        'data': dia,
+                        'turno': turno,
+                        'quantidade_disponivel': vagas - booked,
+                        'quantidade_total': vagas
+                    })
+
+                    # ~5% a mais de agendamentos cancelados, que não ocupam vaga
+                    cancelled = sum(1 for _ in range(booked) if rng.random() < 0.05)
+                    for n in range(booked + cancelled):
+                        result['appointments'].append({
+                            'id': make_id(seed, 'appointment', f'{ubs_id}:{service_id}:{dia}:{turno}:{n}'),
+                            'user_id': make_id(seed, 'user', rng.randrange(params['usuarios'])),
+                            'ubs_id': ubs_id,
+                            'service_id': service_id,
+                            'data_agendamento': dia,
+                            'turno': turno,
+                            'status': 'Confirmado' if n < booked else 'Cancelado',
+                            'created_at': now - timedelta(minutes=rng.randint(0, 60 * 24 * 60))
+                        })
+
+        # Capacidade por janela de horário: 07:00-17:00 com pausa para almoço
+        if params['intervalo_minutos']:
+            for service_id in services:
+                for row in build_days(ubs_id, service_id, params['inicio'], params['inicio'] + timedelta(days=params['dias'] - 1),
+                                      7 * 60, 17 * 60, params['intervalo_minutos'], params['vagas_por_janela'],
+                                      pausa=(12 * 60, 13 * 60)):
+                    row['id'] = make_id(seed, 'day_capacity', f"{ubs_id}:{service_id}:{row['data']}")
+                    result['day_capacities'].append(row)
+    return result
+
+def _run_parallel(fn, tasks, workers):
+    """Executa fn nos processos, devolvendo os resultados em ordem e com no máximo 2*workers lotes em memória"""
+    if workers <= 1:
+        for task in tasks:
+            yield fn(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(fn, task))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _bulk_insert(conn, table, rows, batch_size):
+    for i in range(0, len(rows), batch_size):
+        conn.execute(table.insert(), rows[i:i + batch_size])
+    conn.commit()
+
+def _bulk_insert_by_shard(conns, ubs_shard, table, rows, batch_size):
+    """Grava cada linha no banco do shard da sua UBS; conns[None] é o banco principal"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(ubs_shard[row['ubs_id']], []).append(row)
+    for key, group in groups.items():
+        _bulk_insert(conns[key], table, group, batch_size)
+
+def _fast_load(conn):
+    if conn.dialect.name == 'sqlite':
+        # Carga inicial: durabilidade não importa, velocidade sim
+        conn.exec_driver_sql('PRAGMA synchronous=OFF')
+        conn.exec_driver_sql('PRAGMA journal_mode=MEMORY')
+
+def populate_database(cidades_extras=0, ubs_por_cidade=0, servicos_extras=0, dias=30, vagas_por_turno=5,
+                      usuarios=0, agendamentos=0, intervalo_minutos=0, vagas_por_janela=1,
+                      seed=42, workers=1, batch_size=10000, ubs_por_lote=20):
+    """
+    Cria os dados de demonstração. Os demais parâmetros geram um volume
+    maior de cidades, UBS, serviços, usuários e agendamentos.
+    """
+    inicio_execucao = time.perf_counter()
+
     with app.app_context():
         # Limpar dados existentes
-        db.drop_all()
-        db.create_all()
-        
-        # Criar cidades
-        cidade_sp = City(nome='São Paulo')
-        cidade_rj = City(nome='Rio de Janeiro')
-        cidade_bh = City(nome='Belo Horizonte')
-        
-        db.session.add_all([cidade_sp, cidade_rj, cidade_bh])
-        db.session.commit()
-        
-        # Criar UBS
-        ubs_sp1 = UBS(nome='UBS Vila Madalena', endereco='Rua Harmonia, 123', cidade_id=cidade_sp.id)
-        ubs_sp2 = UBS(nome='UBS Jardins', endereco='Av. Paulista, 456', cidade_id=cidade_sp.id)
-        ubs_rj1 = UBS(nome='UBS Copacabana', endereco='Av. Atlântica, 789', cidade_id=cidade_rj.id)
-        ubs_bh1 = UBS(nome='UBS Centro', endereco='Rua da Bahia, 321', cidade_id=cidade_bh.id)
-        
-        db.session.add_all([ubs_sp1, ubs_sp2, ubs_rj1, ubs_bh1])
-        db.session.commit()
-        
-        # Criar serviços
-        servico_clinico = Service(nome='Clínico Geral', descricao='Consulta médica geral')
-        servico_dentista = Service(nome='Dentista', descricao='Consulta odontológica')
-        servico_pediatra = Service(nome='Pediatra', descricao='Consulta pediátrica')
-        servico_gineco = Service(nome='Ginecologista', descricao='Consulta ginecológica')
-        servico_cardio = Service(nome='Cardiologista', descricao='Consulta cardiológica')
-        
-        db.session.add_all([servico_clinico, servico_dentista, servico_pediatra, servico_gineco, servico_cardio])
-        db.session.commit()
-        
-        # Associar serviços às UBS
-        ubs_sp1.services.extend([servico_clinico, servico_dentista, servico_pediatra])
-        ubs_sp2.services.extend([servico_clinico, servico_gineco, servico_cardio])
-        ubs_rj1.services.extend([servico_clinico, servico_dentista, servico_gineco])
-        ubs_bh1.services.extend([servico_clinico, servico_pediatra, servico_cardio])
-        
-        db.session.commit()
-        
+        db.drop_all(bind_key=None)
+        db.create_all(bind_key=None)
+        sharding.drop_all()
+        sharding.create_all()
+
+        # Cidades e serviços (poucas linhas, gerados aqui mesmo)
+        cidades = [{'id': make_id(seed, 'city', nome), 'nome': nome} for nome in CIDADES_DEMO]
+        cidades += [
+            {'id': make_id(seed, 'city', i), 'nome': f'Cidade {i + 1:04d}'}
+            for i in range(cidades_extras)
+        ]
+        cidade_ids = {cidade['nome']: cidade['id'] for cidade in cidades}
+
+        servicos = [{'id': make_id(seed, 'service', nome), 'nome': nome, 'descricao': descricao}
+                    for nome, descricao in SERVICOS_DEMO]
+        servicos += [{'id': make_id(seed, 'service', nome), 'nome': nome, 'descricao': f'Atendimento de {nome.lower()}'}
+                     for nome in SERVICOS_EXTRAS[:servicos_extras]]
+        servico_ids = {servico['nome']: servico['id'] for servico in servicos}
+
+        ubs_demo = [
+            {'id': make_id(seed, 'ubs', nome), 'nome': nome, 'endereco': endereco, 'cidade_id': cidade_ids[cidade],
+             'latitude': lat, 'longitude': lon}
+            for (nome, endereco, cidade, _), (lat, lon) in zip(UBS_DEMO, COORDENADAS_DEMO)
+        ]
+
+        # Cidades distribuídas entre os shards em rodízio (sem shards, tudo no principal)
+        shard_keys = sharding.shard_router.keys
+        city_shard = {
+            cidade['id']: shard_keys[i % len(shard_keys)] if shard_keys else None
+            for i, cidade in enumerate(cidades)
+        }
+
+        with ExitStack() as stack:
+            conn = stack.enter_context(db.engine.connect())
+            conns = {None: conn}
+            for key in shard_keys:
+                conns[key] = stack.enter_context(db.engines[key].connect())
+            for connection in conns.values():
+                _fast_load(connection)
+
+            _bulk_insert(conn, City.__table__, cidades, batch_size)
+            if shard_keys:
+                _bulk_insert(conn, CityShard.__table__, [
+                    {'cidade_id': cidade_id, 'shard': shard} for cidade_id, shard in city_shard.items()
+                ], batch_size)
+            _bulk_insert(conn, Service.__table__, servicos, batch_size)
+            _bulk_insert(conn, UBS.__table__, ubs_demo, batch_size)
+            _bulk_insert(conn, ubs_services, [
+                {'ubs_id': ubs['id'], 'service_id': servico_ids[nome]}
+                for ubs, (_, _, _, nomes) in zip(ubs_demo, UBS_DEMO) for nome in nomes
+            ], batch_size)
+
+            # Usuários
+            lotes_usuarios = [(seed, start, min(batch_size, usuarios - start)) for start in range(0, usuarios, batch_size)]
+            for rows in _run_parallel(_generate_users, lotes_usuarios, workers):
+                _bulk_insert(conn, User.__table__, rows, batch_size)
+
+            # UBS geradas, slots e agendamentos
+            specs = [(i, ubs['id'], ubs['cidade_id'], [servico_ids[n] for n in nomes])
+                     for i, (ubs, (_, _, _, nomes)) in enumerate(zip(ubs_demo, UBS_DEMO))]
+            for c, cidade in enumerate(cidades[len(CIDADES_DEMO):]):
+                for j in range(ubs_por_cidade):
+                    index = len(UBS_DEMO) + c * ubs_por_cidade + j
+                    specs.append((index, make_id(seed, 'ubs', index), cidade['id'], None))
+            ubs_shard = {ubs_id: city_shard[cidade_id] for _, ubs_id, cidade_id, _ in specs}
+
+            servicos_por_ubs = (3 + min(6, len(servicos))) / 2
+            dias_uteis = sum(1 for i in range(dias) if (date.today() + timedelta(days=i)).weekday() < 5)
+            capacidade = len(specs) * servicos_por_ubs * dias_uteis * len(TURNOS) * vagas_por_turno
+            params = {
+                'inicio': date.today(),
+                'dias': dias,
+                'vagas_por_turno': vagas_por_turno,
+                'usuarios': usuarios,
+                'intervalo_minutos': intervalo_minutos,
+                'vagas_por_janela': vagas_por_janela,
+                'ocupacao': min(1.0, agendamentos / capacidade) if capacidade else 0.0
+            }
+            servico_id_list = [servico['id'] for servico in servicos]
+            lotes_ubs = [(seed, specs[i:i + ubs_por_lote], servico_id_list, params)
+                         for i in range(0, len(specs), ubs_por_lote)]
+
+            totais = {'ubs': len(ubs_demo), 'slots': 0, 'appointments': 0}
+            for chunk in _run_parallel(_generate_ubs, lotes_ubs, workers):
+                _bulk_insert(conn, UBS.__table__, chunk['ubs'], batch_size)
+                _bulk_insert(conn, ubs_services, chunk['ubs_services'], batch_size)
+                _bulk_insert_by_shard(conns, ubs_shard, Slot.__table__, chunk['slots'], batch_size)
+                _bulk_insert_by_shard(conns, ubs_shard, Appointment.__table__, chunk['appointments'], batch_size)
+                _bulk_insert_by_shard(conns, ubs_shard, DayCapacity.__table__, chunk['day_capacities'], batch_size)
+                totais['ubs'] += len(chunk['ubs'])
+                totais['slots'] += len(chunk['slots'])
+                totais['appointments'] += len(chunk['appointments'])
+
         # Criar administradores
         admin_super = Admin(
             username='admin',
             password_hash=hash_password('admin123'),
             role='SuperAdmin'
         )
-        
+
         admin_ubs1 = Admin(
             username='gestor_sp1',
             password_hash=hash_password('gestor123'),
             role='UBSManager',
-            ubs_id=ubs_sp1.id
+            ubs_id=ubs_demo[0]['id']
         )
-        
+
         db.session.add_all([admin_super, admin_ubs1])
         db.session.commit()
-        
-        # Criar slots (vagas) para os próximos 30 dias
-        today = date.today()
-        for i in range(30):
-            data_slot = today + timedelta(days=i)
-            
-            # Pular fins de semana
-            if data_slot.weekday() >= 5:
-                continue
-            
-            # Criar slots para cada UBS e serviço
-            for ubs in [ubs_sp1, ubs_sp2, ubs_rj1, ubs_bh1]:
-                for service in ubs.services:
-                    # Manhã
-                    slot_manha = Slot(
-                        ubs_id=ubs.id,
-                        service_id=service.id,
-                        data=data_slot,
-                        turno='Manhã',
-                        quantidade_disponivel=5,
-                        quantidade_total=5
-                    )
-                    
-                    # Tarde
-                    slot_tarde = Slot(
-                        ubs_id=ubs.id,
-                        service_id=service.id,
-                        data=data_slot,
-                        turno='Tarde',
-                        quantidade_disponivel=5,
-                        quantidade_total=5
-                    )
-                    
-                    db.session.add_all([slot_manha, slot_tarde])
-        
-        db.session.commit()
-        
+
+        # Contadores das regras de agendamento a partir dos agendamentos gerados
+        totais['contadores'] = rebuild_states(batch_size)
+
         print("Banco de dados populado com sucesso!")
         print("\nCredenciais de acesso:")
         print("Super Admin: admin / admin123")
         print("Gestor UBS SP1: gestor_sp1 / gestor123")
-        print("\nCidades criadas:", [c.nome for c in [cidade_sp, cidade_rj, cidade_bh]])
-        print("UBS criadas:", [u.nome for u in [ubs_sp1, ubs_sp2, ubs_rj1, ubs_bh1]])
-        print("Serviços criados:", [s.nome for s in [servico_clinico, servico_dentista, servico_pediatra, servico_gineco, servico_cardio]])
+        print("\nCidades criadas:", len(cidades))
+        print("UBS criadas:", totais['ubs'])
+        print("Serviços criados:", [s['nome'] for s in servicos])
+        print("Usuários criados:", usuarios)
+        print("Slots criados:", totais['slots'])
+        print("Agendamentos criados:", totais['appointments'])
+        print("Contadores de usuários:", totais['contadores'])
+        print(f"Tempo total: {time.perf_counter() - inicio_execucao:.1f}s")
 
 if __name__ == '__main__':
-    populate_database()
+    parser = argparse.ArgumentParser(description='Recria o banco com dados de demonstração')
+    parser.add_argument('--cidades-extras', type=int, default=0)
+    parser.add_argument('--ubs-por-cidade', type=int, default=0)
+    parser.add_argument('--servicos-extras', type=int, default=0, choices=range(len(SERVICOS_EXTRAS) + 1))
+    parser.add_argument('--dias', type=int, default=30)
+    parser.add_argument('--vagas-por-turno', type=int, default=5)
+    parser.add_argument('--usuarios', type=int, default=0)
+    parser.add_argument('--agendamentos', type=int, default=0,
+                        help='Número aproximado de agendamentos confirmados (requer --usuarios)')
+    parser.add_argument('--intervalo-minutos', type=int, default=0,
+                        help='Gera também capacidade por janelas deste tamanho (0 = não gera)')
+    parser.add_argument('--vagas-por-janela', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Processos usados para gerar os dados')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.agendamentos and not args.usuarios:
+        parser.error('--agendamentos requer --usuarios')
 
+    populate_database(
+        cidades_extras=args.cidades_extras,
+        ubs_por_cidade=args.ubs_por_cidade,
+        servicos_extras=args.servicos_extras,
+        dias=args.dias,
+        vagas_por_turno=args.vagas_por_turno,
+        usuarios=args.usuarios,
+        agendamentos=args.agendamentos,
+        intervalo_minutos=args.intervalo_minutos,
+        vagas_por_janela=args.vagas_por_janela,
+        seed=args.seed,
+        workers=args.workers,
+        batch_size=args.batch_size
+    )
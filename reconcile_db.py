@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# Job de reconciliação; agendar periodicamente (ex.: cron a cada hora)
+#   python reconcile_db.py --por-ubs --workers 4
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import argparse
+import json
+from datetime import date, timedelta
+
+from src.main import app
+from src.models.database import db, UBS
+from src.utils.reconciliation import reconcile, FINAL_STATUSES
+from src.utils.booking_rules import rebuild_states
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Corrige as vagas dos slots e das janelas de horário e, com --status-passados, '
+                    'finaliza agendamentos passados'
+    )
+    parser.add_argument('--ubs-id', action='append',
+                        help='Reconciliar apenas esta UBS (pode repetir)')
+    parser.add_argument('--por-ubs', action='store_true',
+                        help='Processa cada UBS separadamente, em paralelo')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--dias-passados', type=int, default=7,
+                        help='Reconciliar slots a partir de quantos dias antes de hoje')
+    parser.add_argument('--status-passados', choices=FINAL_STATUSES + ('nenhum',), default='nenhum',
+                        help='Status dado aos agendamentos Confirmado de dias anteriores '
+                             '(padrão: nenhum, mantém Confirmado para a UBS registrar presenças e faltas)')
+    parser.add_argument('--batch-size', type=int, default=2000)
+    parser.add_argument('--somente-relatorio', action='store_true',
+                        help='Apenas relata as divergências, sem corrigir')
+    parser.add_argument('--recalcular-usuarios', action='store_true',
+                        help='Recalcula os contadores das regras de agendamento de todos os usuários')
+    args = parser.parse_args()
+
+    status_final = None if args.status_passados == 'nenhum' else args.status_passados
+
+    with app.app_context():
+        ubs_ids = args.ubs_id
+        if not ubs_ids and args.por_ubs:
+            ubs_ids = db.session.execute(db.select(UBS.id)).scalars().all()
+
+        report = reconcile(
+            ubs_ids=ubs_ids,
+            data_inicio=date.today() - timedelta(days=args.dias_passados),
+            cutoff=date.today(),
+            status_final=status_final,
+            batch_size=args.batch_size,
+            fix=not args.somente_relatorio,
+            workers=args.workers
+        )
+
+        if args.recalcular_usuarios and not args.somente_relatorio:
+            report['contadores_recalculados'] = rebuild_states(args.batch_size)
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
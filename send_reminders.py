@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# Envio dos lembretes do dia seguinte; agendar diariamente (ex.: cron às 18:00)
+#   python send_reminders.py --provedor fake
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+import argparse
+import json
+from datetime import date, datetime, timedelta
+
+from src.main import app
+from src.utils.notifications import get_provider, PROVIDERS
+from src.utils.reminders import send_reminders
+
+def main():
+    parser = argparse.ArgumentParser(description='Envia lembretes por SMS/WhatsApp dos agendamentos confirmados')
+    parser.add_argument('--data', help='Data dos agendamentos (AAAA-MM-DD); padrão: amanhã')
+    parser.add_argument('--provedor', choices=sorted(PROVIDERS), default='fake')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--concorrencia', type=int, default=200,
+                        help='Envios simultâneos')
+    parser.add_argument('--max-tentativas', type=int, default=3,
+                        help='Novas tentativas por mensagem em caso de falha')
+    parser.add_argument('--taxa', type=float,
+                        help='Mensagens por segundo (padrão: limite do provedor)')
+    parser.add_argument('--latencia-fake', type=float, default=0.02,
+                        help='Latência simulada do provedor fake, em segundos')
+    parser.add_argument('--falhas-fake', type=float, default=0.0,
+                        help='Fração de envios que o provedor fake faz falhar')
+    parser.add_argument('--log-fake', help='Arquivo NDJSON onde o provedor fake grava as mensagens')
+    args = parser.parse_args()
+
+    if args.data:
+        target_date = datetime.strptime(args.data, '%Y-%m-%d').date()
+    else:
+        target_date = date.today() + timedelta(days=1)
+
+    options = {}
+    if args.provedor == 'fake':
+        options = {'latency': args.latencia_fake, 'failure_rate': args.falhas_fake, 'log_path': args.log_fake}
+    provider = get_provider(args.provedor, **options)
+
+    with app.app_context():
+        result = send_reminders(
+            target_date,
+            provider,
+            batch_size=args.batch_size,
+            concurrency=args.concorrencia,
+            max_retries=args.max_tentativas,
+            rate_limit=args.taxa
+        )
+
+    print(f"Lembretes de {target_date.isoformat()} via {args.provedor}:")
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# API de agendamento assíncrona (ASGI), em paralelo ao app Flask de src/main.py.
+# Cada requisição esperando o banco ou a validação do CPF não ocupa uma thread.
+#   pip install -r requirements-async.txt
+#   uvicorn src.asgi:app --port 5001
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+# Reaproveita a configuração do app Flask (banco, create_all, log de auditoria)
+from src.main import app as flask_app
+from src.routes.async_appointments import routes
+from src.utils.asgi import ASGIApp
+from src.utils.sharding import shard_router
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+}
+
+def async_database_url(url):
+    """URL do SQLAlchemy com o driver assíncrono equivalente"""
+    scheme, rest = url.split('://', 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+def create_engine_from_config():
+    # As rotas assíncronas usam um único engine e não sabem rotear para os shards
+    if shard_router.keys:
+        raise RuntimeError('A API assíncrona não suporta DATABASE_SHARD_URLS; use o app Flask')
+    url = os.environ.get('ASYNC_DATABASE_URL') or async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+    options = {
+        # Limita as conexões simultâneas; as demais requisições aguardam no loop, sem thread
+        'pool_size': int(os.environ.get('ASYNC_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('ASYNC_POOL_OVERFLOW', 10)),
+        'pool_timeout': 60,
+    }
+    if url.startswith('sqlite'):
+        options['connect_args'] = {'timeout': 30}
+    return create_async_engine(url, **options)
+
+engine = create_engine_from_config()
+
+app = ASGIApp(
+    routes,
+    async_sessionmaker(engine, expire_on_commit=False),
+    on_shutdown=[engine.dispose]
+)
@@ -10,17 +10,61 @@ from src.models.database import db
 from src.routes.auth import auth_bp
 from src.routes.appointments import appointments_bp
 from src.routes.admin import admin_bp
+from src.utils import audit, booking_rules, cache, keys, profiling, replicas, sharding
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
 
-# Configuração do banco de dados - usando SQLite para desenvolvimento
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+# Configuração do banco de dados - usando SQLite para desenvolvimento,
+# ou DATABASE_URL quando definida (ex.: postgresql://localhost/agendamento)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+)
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Réplicas de leitura (URLs separadas por vírgula), usadas pelas views com @read_replica
+replicas.configure_binds(app, [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url])
+app.config['REPLICA_MAX_LAG'] = float(os.environ.get('REPLICA_MAX_LAG', 5))
+
+# Shards dos dados de agendamento por cidade (URLs separadas por vírgula), ex.:
+# DATABASE_SHARD_URLS=sqlite:////tmp/shard0.db,sqlite:////tmp/shard1.db
+sharding.configure_binds(app, [url for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url])
+
+# Log de auditoria: 'table' (audit_events) ou 'ndjson' (arquivos em AUDIT_DIR)
+app.config['AUDIT_SINK'] = os.environ.get('AUDIT_SINK', 'table')
+if os.environ.get('AUDIT_DIR'):
+    app.config['AUDIT_DIR'] = os.environ['AUDIT_DIR']
+
+# Cache das leituras: 'local' (LRU por worker), 'sqlite' (arquivo em CACHE_URL,
+# compartilhado pelos workers da máquina) ou 'redis' (CACHE_URL=redis://...)
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'local')
+if os.environ.get('CACHE_URL'):
+    app.config['CACHE_URL'] = os.environ['CACHE_URL']
+
+# Profiler por amostragem (ligado em /api/admin/profiling) e trace de SQL por
+# requisição (cabeçalho X-SQL-Trace, somente SuperAdmin)
+if os.environ.get('PROFILE_DIR'):
+    app.config['PROFILE_DIR'] = os.environ['PROFILE_DIR']
+
+# Regras de agendamento por usuário; limite 0 desliga a regra
+for key in ('BOOKING_MAX_ABERTOS', 'BOOKING_INTERVALO_SERVICO_DIAS', 'BOOKING_FALTAS_LIMITE',
+            'BOOKING_FALTAS_JANELA_DIAS', 'BOOKING_CARENCIA_DIAS'):
+    if os.environ.get(key):
+        app.config[key] = int(os.environ[key])
+
+# Provedor dos avisos das operações em massa (src/utils/notifications.py)
+app.config['NOTIFICATION_PROVIDER'] = os.environ.get('NOTIFICATION_PROVIDER', 'fake')
+
 # Inicializar extensões
 db.init_app(app)
 migrate = Migrate(app, db)
+audit.init_app(app)
+booking_rules.init_app(app)
+cache.init_app(app)
+profiling.init_app(app)
+replicas.init_app(app)
+sharding.init_app(app)
 CORS(app)
 
 # Registrar blueprints
@@ -29,7 +73,14 @@ app.register_blueprint(appointments_bp, url_prefix='/api/appointments')
 app.register_blueprint(admin_bp, url_prefix='/api/admin')
 
 with app.app_context():
-    db.create_all()
+    db.create_all(bind_key=None)  # somente o primário; réplicas recebem o schema pela replicação
+    sharding.create_all()
+    outdated = keys.outdated_tables(db.engine)
+    if outdated:
+        app.logger.warning(
+            'Tabelas com schema antigo (%s): migre com python migrate_keys.py --destino <banco novo> '
+            'ou recrie o banco de desenvolvimento com python populate_db.py', ', '.join(outdated)
+        )
 
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
@@ -1,16 +1,76 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
+import os
+import time
 import uuid
 
-db = SQLAlchemy()
+from src.utils.replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 def generate_uuid():
-    return str(uuid.uuid4())
+    """
+    UUID ordenado pelo tempo (layout do UUIDv7): 48 bits de milissegundos
+    seguidos de bits aleatórios. Ids novos entram no fim do índice da chave
+    primária em vez de em páginas aleatórias.
+    """
+    value = (time.time_ns() // 1_000_000) << 80 | int.from_bytes(os.urandom(10), 'big')
+    value = value & ~(0xF << 76) | 0x7 << 76  # versão 7
+    value = value & ~(0x3 << 62) | 0x2 << 62  # variante RFC 4122
+    return str(uuid.UUID(int=value))
+
+class CompactId(TypeDecorator):
+    """
+    Id gravado em 16 bytes (uuid nativo no PostgreSQL, BINARY(16)/BLOB nos
+    demais) no lugar de VARCHAR(36). Para a aplicação e para a API o id
+    continua sendo a string UUID de sempre; uma string que não é UUID vira
+    NULL na consulta e simplesmente não encontra nenhuma linha.
+    """
+    impl = db.LargeBinary
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        if dialect.name in ('mysql', 'mariadb'):
+            return dialect.type_descriptor(db.BINARY(16))
+        return dialect.type_descriptor(db.LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # Caminho rápido para a string UUID usual, sem passar por uuid.UUID
+            try:
+                raw = bytes.fromhex(value.replace('-', '')) if len(value) in (32, 36) else b''
+            except ValueError:
+                raw = b''
+            if len(raw) != 16:
+                return None
+            return str(uuid.UUID(bytes=raw)) if dialect.name == 'postgresql' else raw
+        try:
+            if isinstance(value, (bytes, bytearray, memoryview)):
+                value = uuid.UUID(bytes=bytes(value))
+            elif not isinstance(value, uuid.UUID):
+                value = uuid.UUID(str(value))
+        except ValueError:
+            return None
+        return str(value) if dialect.name == 'postgresql' else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            h = bytes(value).hex()
+            return f'{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}'
+        return str(value)
 
 class User(db.Model):
     __tablename__ = 'users'
     
-    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
+    id = db.Column(CompactId, primary_key=True, default=generate_uuid)
     cpf = db.Column(db.String(11), unique=True, nullable=False)
     data_nascimento = db.Column(db.Date, nullable=False)
     nome_completo = db.Column(db.String(255), nullable=True)
@@ -24,7 +84,7 @@ class User(db.Model):
 class City(db.Model):
     __tablename__ = 'cities'
     
-    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
+    id = db.Column(CompactId, primary_key=True, default=generate_uuid)
     nome = db.Column(db.String(100), unique=True, nullable=False)
     
     # Relacionamentos
@@ -33,10 +93,12 @@ class City(db.Model):
 class UBS(db.Model):
     __tablename__ = 'ubs'
     
-    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
+    id = db.Column(CompactId, primary_key=True, default=generate_uuid)
     nome = db.Column(db.String(255), nullable=False)
     endereco = db.Column(db.String(500), nullable=True)
-    cidade_id = db.Column(db.String(36), db.ForeignKey('cities.id'), nullable=False)
+    cidade_id = db.Column(CompactId, db.ForeignKey('cities.id'), nullable=False)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
     
     # Relacionamentos
     appointments = db.relationship('Appointment', backref='ubs', lazy=True)
@@ -46,7 +108,7 @@ class UBS(db.Model):
 class Service(db.Model):
     __tablename__ = 'services'
     
-    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
+    id = db.Column(CompactId, primary_key=True, default=generate_uuid)
     nome = db.Column(db.String(255), nullable=False)
     descricao = db.Column(db.Text, nullable=True)
     
@@ -56,40 +118,196 @@ class Service(db.Model):
 
 # Tabela de associação para UBS e Serviços
 ubs_services = db.Table('ubs_services',
-    db.Column('ubs_id', db.String(36), db.ForeignKey('ubs.id'), primary_key=True),
-    db.Column('service_id', db.String(36), db.ForeignKey('services.id'), primary_key=True)
+    db.Column('ubs_id', CompactId, db.ForeignKey('ubs.id'), primary_key=True),
+    db.Column('service_id', CompactId, db.ForeignKey('services.id'), primary_key=True)
 )
 
 class Appointment(db.Model):
     __tablename__ = 'appointments'
+    __table_args__ = (
+        db.Index('ix_appointments_ubs_data', 'ubs_id', 'data_agendamento'),
+        db.Index('ix_appointments_data_id', 'data_agendamento', 'id'),
+        db.Index('ix_appointments_user_data', 'user_id', 'data_agendamento'),
+    )
     
-    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
-    ubs_id = db.Column(db.String(36), db.ForeignKey('ubs.id'), nullable=False)
-    service_id = db.Column(db.String(36), db.ForeignKey('services.id'), nullable=False)
+    id = db.Column(CompactId, primary_key=True, default=generate_uuid)
+    user_id = db.Column(CompactId, db.ForeignKey('users.id'), nullable=False)
+    ubs_id = db.Column(CompactId, db.ForeignKey('ubs.id'), nullable=False)
+    service_id = db.Column(CompactId, db.ForeignKey('services.id'), nullable=False)
     data_agendamento = db.Column(db.Date, nullable=False)
     turno = db.Column(db.String(10), nullable=False)  # 'Manhã' ou 'Tarde'
-    status = db.Column(db.String(20), default='Confirmado')  # 'Confirmado', 'Cancelado', 'Realizado'
+    horario = db.Column(db.String(5), nullable=True)  # 'HH:MM' quando agendado por janela (DayCapacity)
+    status = db.Column(db.String(20), default='Confirmado')  # 'Confirmado', 'Cancelado', 'Realizado', 'Faltou'
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Slot(db.Model):
     __tablename__ = 'slots'
+    __table_args__ = (
+        db.Index('ix_slots_ubs_service_data', 'ubs_id', 'service_id', 'data'),
+    )
     
-    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
-    ubs_id = db.Column(db.String(36), db.ForeignKey('ubs.id'), nullable=False)
-    service_id = db.Column(db.String(36), db.ForeignKey('services.id'), nullable=False)
+    id = db.Column(CompactId, primary_key=True, default=generate_uuid)
+    ubs_id = db.Column(CompactId, db.ForeignKey('ubs.id'), nullable=False)
+    service_id = db.Column(CompactId, db.ForeignKey('services.id'), nullable=False)
     data = db.Column(db.Date, nullable=False)
     turno = db.Column(db.String(10), nullable=False)  # 'Manhã' ou 'Tarde'
     quantidade_disponivel = db.Column(db.Integer, nullable=False)
     quantidade_total = db.Column(db.Integer, nullable=False)
 
+class DayCapacity(db.Model):
+    __tablename__ = 'day_capacities'
+    __table_args__ = (
+        db.UniqueConstraint('ubs_id', 'service_id', 'data'),
+    )
+    
+    # Capacidade de um dia dividida em janelas de intervalo_minutos a partir de
+    # inicio_minutos. As vagas de cada janela ficam num vetor compacto de
+    # uint16 (ver src/utils/capacity.py) em vez de uma linha por janela.
+    id = db.Column(CompactId, primary_key=True, default=generate_uuid)
+    ubs_id = db.Column(CompactId, db.ForeignKey('ubs.id'), nullable=False)
+    service_id = db.Column(CompactId, db.ForeignKey('services.id'), nullable=False)
+    data = db.Column(db.Date, nullable=False)
+    inicio_minutos = db.Column(db.Integer, nullable=False)  # ex.: 420 = 07:00
+    intervalo_minutos = db.Column(db.Integer, nullable=False)  # ex.: 15
+    vagas_disponiveis = db.Column(db.LargeBinary, nullable=False)
+    vagas_totais = db.Column(db.LargeBinary, nullable=False)
+    disponivel = db.Column(db.Integer, nullable=False)  # soma de vagas_disponiveis
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class UserBookingState(db.Model):
+    __tablename__ = 'user_booking_states'
+    
+    # Contadores de um usuário para as regras de agendamento (src/utils/booking_rules.py),
+    # mantidos ao agendar/cancelar: os agendamentos não cancelados recentes e futuros
+    # (data, aberto, serviço) e as datas das faltas recentes, em vetores compactos.
+    user_id = db.Column(CompactId, db.ForeignKey('users.id'), primary_key=True)
+    agendamentos = db.Column(db.LargeBinary, nullable=False)
+    faltas = db.Column(db.LargeBinary, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class BulkOperation(db.Model):
+    __tablename__ = 'bulk_operations'
+    __table_args__ = (
+        db.Index('ix_bulk_operations_ubs_created', 'ubs_id', 'created_at'),
+        # No máximo uma operação em andamento por UBS e data, mesmo com POSTs
+        # simultâneos (mesmos status de bulk.RUNNING_STATUSES)
+        db.Index(
+            'ux_bulk_operations_ubs_data_running', 'ubs_id', 'data', unique=True,
+            sqlite_where=db.text("status IN ('pendente', 'executando', 'notificando')"),
+            postgresql_where=db.text("status IN ('pendente', 'executando', 'notificando')")
+        ),
+    )
+    
+    # Cancelamento/remarcação em massa dos agendamentos de uma UBS num dia
+    # (src/utils/bulk.py); durante a execução o progresso fica no cache
+    id = db.Column(CompactId, primary_key=True, default=generate_uuid)
+    ubs_id = db.Column(CompactId, db.ForeignKey('ubs.id'), nullable=False)
+    data = db.Column(db.Date, nullable=False)
+    turnos = db.Column(db.String(20), nullable=True)  # ex.: 'Manhã'; None = o dia inteiro
+    acao = db.Column(db.String(10), nullable=False)  # 'cancelar' ou 'remarcar'
+    nova_data = db.Column(db.Date, nullable=True)
+    novo_turno = db.Column(db.String(10), nullable=True)  # None = mantém o turno de cada agendamento
+    fechar_vagas = db.Column(db.Boolean, nullable=False, default=True)
+    motivo = db.Column(db.String(255), nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente, executando, notificando, concluida, concluida_com_falhas, falhou
+    total = db.Column(db.Integer, nullable=False, default=0)
+    notificacoes_enviadas = db.Column(db.Integer, nullable=False, default=0)
+    notificacoes_falhas = db.Column(db.Integer, nullable=False, default=0)
+    sem_celular = db.Column(db.Integer, nullable=False, default=0)
+    # Ids (JSON) dos agendamentos alterados cujo aviso ainda não foi confirmado
+    # pelo provedor; reenviados por bulk.start_resend
+    notificacoes_pendentes = db.Column(db.Text, nullable=True)
+    erro = db.Column(db.Text, nullable=True)
+    admin_id = db.Column(CompactId, db.ForeignKey('admins.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Último sinal do worker que executa a operação; sem sinal há mais de
+    # bulk.STALE_AFTER a operação é dada como interrompida
+    heartbeat_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+class CityShard(db.Model):
+    __tablename__ = 'city_shards'
+    
+    # Diretório do particionamento: shard (bind 'shard_N') que guarda slots,
+    # janelas e agendamentos das UBS da cidade (src/utils/sharding.py)
+    cidade_id = db.Column(CompactId, db.ForeignKey('cities.id'), primary_key=True)
+    shard = db.Column(db.String(30), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Admin(db.Model):
     __tablename__ = 'admins'
     
-    id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
+    id = db.Column(CompactId, primary_key=True, default=generate_uuid)
     username = db.Column(db.String(50), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False)  # 'SuperAdmin' ou 'UBSManager'
-    ubs_id = db.Column(db.String(36), db.ForeignKey('ubs.id'), nullable=True)  # Para gerentes de UBS
+    ubs_id = db.Column(CompactId, db.ForeignKey('ubs.id'), nullable=True)  # Para gerentes de UBS
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    
+    # sha256 de "<endpoint>:<Idempotency-Key>" para manter a chave com tamanho fixo
+    id = db.Column(db.String(64), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer, nullable=True)  # None enquanto a requisição está em andamento
+    response_body = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+class AuditEvent(db.Model):
+    __tablename__ = 'audit_events'
+    __table_args__ = (
+        db.Index('ix_audit_events_ubs_created', 'ubs_id', 'created_at'),
+    )
+    
+    # Log somente de inserção, gravado em lotes por src/utils/audit.py
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    action = db.Column(db.String(40), nullable=False)  # ex.: 'appointment.create', 'slot.create'
+    actor_type = db.Column(db.String(10), nullable=True)  # 'user', 'admin'
+    actor_id = db.Column(db.String(36), nullable=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.String(36), nullable=True)
+    ubs_id = db.Column(db.String(36), nullable=True)
+    payload = db.Column(db.Text, nullable=True)  # JSON
+
+# Tabelas de histórico: recebem os slots com data passada e os agendamentos
+# finalizados, mantendo slots/appointments restritos à janela ativa
+class AppointmentArchive(db.Model):
+    __tablename__ = 'appointments_archive'
+    __table_args__ = (
+        db.Index('ix_appointments_archive_data_id', 'data_agendamento', 'id'),
+    )
+    
+    id = db.Column(CompactId, primary_key=True)
+    user_id = db.Column(CompactId, db.ForeignKey('users.id'), nullable=False)
+    ubs_id = db.Column(CompactId, db.ForeignKey('ubs.id'), nullable=False)
+    service_id = db.Column(CompactId, db.ForeignKey('services.id'), nullable=False)
+    data_agendamento = db.Column(db.Date, nullable=False)
+    turno = db.Column(db.String(10), nullable=False)
+    horario = db.Column(db.String(5), nullable=True)
+    status = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False)
+    
+    # Relacionamentos (somente leitura, para os relatórios)
+    user = db.relationship('User', viewonly=True)
+    ubs = db.relationship('UBS', viewonly=True)
+    service = db.relationship('Service', viewonly=True)
+
+class SlotArchive(db.Model):
+    __tablename__ = 'slots_archive'
+    
+    id = db.Column(CompactId, primary_key=True)
+    ubs_id = db.Column(CompactId, db.ForeignKey('ubs.id'), nullable=False)
+    service_id = db.Column(CompactId, db.ForeignKey('services.id'), nullable=False)
+    data = db.Column(db.Date, nullable=False, index=True)
+    turno = db.Column(db.String(10), nullable=False)
+    quantidade_disponivel = db.Column(db.Integer, nullable=False)
+    quantidade_total = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False)
+    
+    # Relacionamentos (somente leitura, para os relatórios)
+    ubs = db.relationship('UBS', viewonly=True)
+    service = db.relationship('Service', viewonly=True)
@@ -1,7 +1,24 @@
-from flask import Blueprint, request, jsonify
-from src.models.database import db, Admin, City, UBS, Service, Slot, Appointment, ubs_services
+from flask import Blueprint, request, jsonify, Response, stream_with_context
+from src.models.database import db, Admin, City, UBS, Service, Slot, Appointment, ubs_services, SlotArchive, AppointmentArchive, DayCapacity, AuditEvent, BulkOperation
+from src.utils.capacity import build_days, format_horario, unpack
+from src.utils.tenancy import ScopeError, tenant_scope, check_ubs_access, require_super_admin, require_admin, ADMIN_HEADER
+from src.utils.audit import record_event
+from src.utils import export
+from src.utils.replicas import read_replica
+from src.utils.reconciliation import FINAL_STATUSES
+from src.utils.booking_rules import apply_change, completion
+from src.utils.cache import cache, CATALOG, ubs_namespace, forget_user
+from src.utils.geo import ubs_locator
+from src.utils.search_index import search_index
+from src.utils import profiling
+from src.utils import bulk
+from src.utils import schemas
+from src.utils.schemas import validate, UNSET
+from src.utils.sharding import assign_city, collect, route_ubs, route_record
+from sqlalchemy.exc import IntegrityError
 import bcrypt
-from datetime import datetime, date
+import json
+from datetime import datetime, date, timedelta
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -11,21 +28,34 @@ def hash_password(password):
 def check_password(password, hashed):
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+def catalog_changed(*changes):
+    """
+    Publica as entradas do catálogo alteradas, ex.: ('ubs', id). Este worker
+    já atualizou os índices em memória (busca e mapa); os demais aplicam só
+    essas entradas quando veem a nova versão do catálogo.
+    """
+    version = cache.publish(CATALOG, *changes)
+    search_index.mark_current(version)
+    ubs_locator.mark_current(version)
+
+def audit(action, entity, entity_id, ubs_id=None, **payload):
+    """Registra no log de auditoria uma alteração feita pelo administrador da requisição"""
+    record_event(action, entity, entity_id, actor_type='admin',
+                 actor_id=request.headers.get(ADMIN_HEADER), ubs_id=ubs_id, **payload)
+
 @admin_bp.route('/login', methods=['POST'])
-def admin_login():
+@validate(body=schemas.ADMIN_LOGIN)
+def admin_login(payload):
     try:
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        
-        if not username or not password:
-            return jsonify({'error': 'Username e senha são obrigatórios'}), 400
+        username, password = payload
         
         admin = Admin.query.filter_by(username=username).first()
         
         if not admin or not check_password(password, admin.password_hash):
             return jsonify({'error': 'Credenciais inválidas'}), 401
         
+        record_event('admin.login', 'admin', admin.id, actor_type='admin', actor_id=admin.id, ubs_id=admin.ubs_id)
+        
         return jsonify({
             'success': True,
             'admin_id': admin.id,
@@ -37,8 +67,10 @@ def admin_login():
         return jsonify({'error': str(e)}), 500
 
 @admin_bp.route('/cities', methods=['GET', 'POST'])
-def manage_cities():
-    if request.method == 'GET':
+@validate(body=schemas.CITY)
+@read_replica
+def manage_cities(payload):
+    if request.method in ('GET', 'HEAD'):
         try:
             cities = City.query.all()
             return jsonify({
@@ -50,11 +82,7 @@ def manage_cities():
     
     elif request.method == 'POST':
         try:
-            data = request.get_json()
-            nome = data.get('nome')
-            
-            if not nome:
-                return jsonify({'error': 'Nome da cidade é obrigatório'}), 400
+            nome = payload.nome
             
             # Verificar se a cidade já existe
             existing_city = City.query.filter_by(nome=nome).first()
@@ -64,6 +92,11 @@ def manage_cities():
             city = City(nome=nome)
             db.session.add(city)
             db.session.commit()
+            assign_city(city.id)
+            
+            search_index.add('city', city.id, city.nome)
+            catalog_changed(('city', city.id))
+            audit('city.create', 'city', city.id, nome=city.nome)
             
             return jsonify({
                 'success': True,
@@ -76,8 +109,10 @@ def manage_cities():
             return jsonify({'error': str(e)}), 500
 
 @admin_bp.route('/ubs', methods=['GET', 'POST'])
-def manage_ubs():
-    if request.method == 'GET':
+@validate(body=schemas.CREATE_UBS)
+@read_replica
+def manage_ubs(payload):
+    if request.method in ('GET', 'HEAD'):
         try:
             city_id = request.args.get('city_id')
             if city_id:
@@ -91,6 +126,8 @@ def manage_ubs():
                     'id': ubs.id,
                     'nome': ubs.nome,
                     'endereco': ubs.endereco,
+                    'latitude': ubs.latitude,
+                    'longitude': ubs.longitude,
                     'cidade_id': ubs.cidade_id,
                     'cidade_nome': ubs.city.nome
                 })
@@ -104,18 +141,20 @@ def manage_ubs():
     
     elif request.method == 'POST':
         try:
-            data = request.get_json()
-            nome = data.get('nome')
-            endereco = data.get('endereco')
-            cidade_id = data.get('cidade_id')
+            nome, endereco, cidade_id, latitude, longitude = payload
             
-            if not nome or not cidade_id:
-                return jsonify({'error': 'Nome e cidade são obrigatórios'}), 400
+            if (latitude is None) != (longitude is None):
+                return jsonify({'error': 'Informe latitude e longitude juntas'}), 400
             
-            ubs = UBS(nome=nome, endereco=endereco, cidade_id=cidade_id)
+            ubs = UBS(nome=nome, endereco=endereco, cidade_id=cidade_id, latitude=latitude, longitude=longitude)
             db.session.add(ubs)
             db.session.commit()
             
+            ubs_locator.update(ubs.id, ubs.latitude, ubs.longitude)
+            search_index.add('ubs', ubs.id, ubs.nome, ubs.city.nome)
+            catalog_changed(('ubs', ubs.id))
+            audit('ubs.create', 'ubs', ubs.id, ubs_id=ubs.id, nome=ubs.nome, cidade_id=cidade_id)
+            
             return jsonify({
                 'success': True,
                 'ubs_id': ubs.id,
@@ -126,9 +165,48 @@ def manage_ubs():
             db.session.rollback()
             return jsonify({'error': str(e)}), 500
 
+@admin_bp.route('/ubs/<ubs_id>', methods=['PUT'])
+@validate(path=schemas.UBS_ID, body=schemas.UPDATE_UBS)
+def update_ubs(ubs_id, payload):
+    try:
+        campos = sorted(campo for campo, valor in payload._asdict().items() if valor is not UNSET)
+        if (payload.latitude is UNSET) != (payload.longitude is UNSET):
+            return jsonify({'error': 'Coordenadas inválidas'}), 400
+        if payload.nome is not UNSET and not payload.nome:
+            return jsonify({'error': 'Nome é obrigatório'}), 400
+        
+        ubs = UBS.query.get(ubs_id)
+        if not ubs:
+            return jsonify({'error': 'UBS não encontrada'}), 404
+        
+        if payload.nome is not UNSET:
+            ubs.nome = payload.nome
+        if payload.endereco is not UNSET:
+            ubs.endereco = payload.endereco
+        if payload.latitude is not UNSET:
+            ubs.latitude, ubs.longitude = payload.latitude, payload.longitude
+        
+        db.session.commit()
+        
+        ubs_locator.update(ubs.id, ubs.latitude, ubs.longitude)
+        search_index.add('ubs', ubs.id, ubs.nome, ubs.city.nome)
+        catalog_changed(('ubs', ubs.id))
+        audit('ubs.update', 'ubs', ubs.id, ubs_id=ubs.id, campos=campos)
+        
+        return jsonify({
+            'success': True,
+            'message': 'UBS atualizada com sucesso'
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @admin_bp.route('/services', methods=['GET', 'POST'])
-def manage_services():
-    if request.method == 'GET':
+@validate(body=schemas.CREATE_SERVICE)
+@read_replica
+def manage_services(payload):
+    if request.method in ('GET', 'HEAD'):
         try:
             services = Service.query.all()
             return jsonify({
@@ -140,17 +218,16 @@ def manage_services():
     
     elif request.method == 'POST':
         try:
-            data = request.get_json()
-            nome = data.get('nome')
-            descricao = data.get('descricao', '')
-            
-            if not nome:
-                return jsonify({'error': 'Nome do serviço é obrigatório'}), 400
+            nome, descricao = payload
             
             service = Service(nome=nome, descricao=descricao)
             db.session.add(service)
             db.session.commit()
             
+            search_index.add('service', service.id, service.nome, service.descricao)
+            catalog_changed(('service', service.id))
+            audit('service.create', 'service', service.id, nome=service.nome)
+            
             return jsonify({
                 'success': True,
                 'service_id': service.id,
@@ -161,15 +238,43 @@ def manage_services():
             db.session.rollback()
             return jsonify({'error': str(e)}), 500
 
-@admin_bp.route('/ubs-services', methods=['POST'])
-def assign_service_to_ubs():
+@admin_bp.route('/services/<service_id>', methods=['PUT'])
+@validate(path=schemas.SERVICE_ID, body=schemas.UPDATE_SERVICE)
+def update_service(service_id, payload):
     try:
-        data = request.get_json()
-        ubs_id = data.get('ubs_id')
-        service_id = data.get('service_id')
+        campos = sorted(campo for campo, valor in payload._asdict().items() if valor is not UNSET)
+        if payload.nome is not UNSET and not payload.nome:
+            return jsonify({'error': 'Nome é obrigatório'}), 400
+        
+        service = Service.query.get(service_id)
+        if not service:
+            return jsonify({'error': 'Serviço não encontrado'}), 404
+        
+        if payload.nome is not UNSET:
+            service.nome = payload.nome
+        if payload.descricao is not UNSET:
+            service.descricao = payload.descricao
         
-        if not ubs_id or not service_id:
-            return jsonify({'error': 'UBS e serviço são obrigatórios'}), 400
+        db.session.commit()
+        
+        search_index.add('service', service.id, service.nome, service.descricao)
+        catalog_changed(('service', service.id))
+        audit('service.update', 'service', service.id, campos=campos)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Serviço atualizado com sucesso'
+        })
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/ubs-services', methods=['POST'])
+@validate(body=schemas.UBS_SERVICE)
+def assign_service_to_ubs(payload):
+    try:
+        ubs_id, service_id = payload
         
         ubs = UBS.query.get(ubs_id)
         service = Service.query.get(service_id)
@@ -184,6 +289,10 @@ def assign_service_to_ubs():
         ubs.services.append(service)
         db.session.commit()
         
+        # Muda só as listas de serviços em cache; os índices não releem nada
+        catalog_changed()
+        audit('ubs_service.create', 'ubs', ubs.id, ubs_id=ubs.id, service_id=service.id)
+        
         return jsonify({
             'success': True,
             'message': 'Serviço associado à UBS com sucesso'
@@ -193,65 +302,56 @@ def assign_service_to_ubs():
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def _list_slots(scope, service_id, incluir_historico):
+    # Com incluir_historico, une os slots arquivados ao resultado
+    models = [Slot, SlotArchive] if incluir_historico else [Slot]
+    
+    slots_data = []
+    for model in models:
+        query = scope.apply(model.query, model, model.data)
+        
+        if service_id:
+            query = query.filter_by(service_id=service_id)
+        
+        for slot in query.all():
+            slots_data.append({
+                'id': slot.id,
+                'ubs_id': slot.ubs_id,
+                'ubs_nome': slot.ubs.nome,
+                'service_id': slot.service_id,
+                'service_nome': slot.service.nome,
+                'data': slot.data.isoformat(),
+                'turno': slot.turno,
+                'quantidade_disponivel': slot.quantidade_disponivel,
+                'quantidade_total': slot.quantidade_total
+            })
+    return slots_data
+
 @admin_bp.route('/slots', methods=['GET', 'POST'])
-def manage_slots():
-    if request.method == 'GET':
+@validate(body=schemas.CREATE_SLOT, args=schemas.LISTING)
+@read_replica
+def manage_slots(payload, params):
+    if request.method in ('GET', 'HEAD'):
         try:
-            ubs_id = request.args.get('ubs_id')
-            service_id = request.args.get('service_id')
-            data_inicio = request.args.get('data_inicio')
-            data_fim = request.args.get('data_fim')
-            
-            query = Slot.query
-            
-            if ubs_id:
-                query = query.filter_by(ubs_id=ubs_id)
-            if service_id:
-                query = query.filter_by(service_id=service_id)
-            if data_inicio:
-                query = query.filter(Slot.data >= datetime.strptime(data_inicio, '%Y-%m-%d').date())
-            if data_fim:
-                query = query.filter(Slot.data <= datetime.strptime(data_fim, '%Y-%m-%d').date())
-            
-            slots = query.all()
-            
-            slots_data = []
-            for slot in slots:
-                slots_data.append({
-                    'id': slot.id,
-                    'ubs_id': slot.ubs_id,
-                    'ubs_nome': slot.ubs.nome,
-                    'service_id': slot.service_id,
-                    'service_nome': slot.service.nome,
-                    'data': slot.data.isoformat(),
-                    'turno': slot.turno,
-                    'quantidade_disponivel': slot.quantidade_disponivel,
-                    'quantidade_total': slot.quantidade_total
-                })
+            scope = tenant_scope(request.args)
+            service_id, incluir_historico = params
             
             return jsonify({
                 'success': True,
-                'slots': slots_data
+                'slots': collect(scope.ubs_id, _list_slots, scope, service_id, incluir_historico)
             })
+        except ScopeError as e:
+            return jsonify({'error': e.message}), e.status
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
     elif request.method == 'POST':
         try:
-            data = request.get_json()
-            ubs_id = data.get('ubs_id')
-            service_id = data.get('service_id')
-            data_slot = data.get('data')
-            turno = data.get('turno')
-            quantidade_total = data.get('quantidade_total')
+            ubs_id, service_id, data_obj, turno, quantidade_total = payload
             
-            if not all([ubs_id, service_id, data_slot, turno, quantidade_total]):
-                return jsonify({'error': 'Todos os campos são obrigatórios'}), 400
-            
-            try:
-                data_obj = datetime.strptime(data_slot, '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({'error': 'Data inválida'}), 400
+            check_ubs_access(ubs_id)
+            if not route_ubs(ubs_id):
+                return jsonify({'error': 'UBS não encontrada'}), 404
             
             # Verificar se o slot já existe
             existing_slot = Slot.query.filter_by(
@@ -276,36 +376,129 @@ def manage_slots():
             db.session.add(slot)
             db.session.commit()
             
+            cache.invalidate(ubs_namespace(ubs_id))
+            audit('slot.create', 'slot', slot.id, ubs_id=ubs_id, service_id=service_id,
+                  data=data_obj.isoformat(), turno=turno, quantidade_total=quantidade_total)
+            
             return jsonify({
                 'success': True,
                 'slot_id': slot.id,
                 'message': 'Slot criado com sucesso'
             })
         
+        except ScopeError as e:
+            return jsonify({'error': e.message}), e.status
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': str(e)}), 500
 
-@admin_bp.route('/appointments', methods=['GET'])
-def get_appointments():
-    try:
-        ubs_id = request.args.get('ubs_id')
-        data_inicio = request.args.get('data_inicio')
-        data_fim = request.args.get('data_fim')
-        
-        query = Appointment.query
-        
-        if ubs_id:
-            query = query.filter_by(ubs_id=ubs_id)
-        if data_inicio:
-            query = query.filter(Appointment.data_agendamento >= datetime.strptime(data_inicio, '%Y-%m-%d').date())
-        if data_fim:
-            query = query.filter(Appointment.data_agendamento <= datetime.strptime(data_fim, '%Y-%m-%d').date())
+@admin_bp.route('/capacity', methods=['GET', 'POST'])
+@validate(body=schemas.CREATE_CAPACITY, args=schemas.LISTING)
+@read_replica
+def manage_capacity(payload, params):
+    if request.method in ('GET', 'HEAD'):
+        try:
+            scope = tenant_scope(request.args)
+            service_id = params.service_id
+            
+            if not scope.ubs_id:
+                return jsonify({'error': 'UBS é obrigatória'}), 400
+            if not route_ubs(scope.ubs_id):
+                return jsonify({'error': 'UBS não encontrada'}), 404
+            
+            query = scope.apply(DayCapacity.query, DayCapacity, DayCapacity.data)
+            
+            if service_id:
+                query = query.filter_by(service_id=service_id)
+            
+            days_data = []
+            for day in query.order_by(DayCapacity.data).all():
+                totais = unpack(day.vagas_totais)
+                days_data.append({
+                    'id': day.id,
+                    'service_id': day.service_id,
+                    'data': day.data.isoformat(),
+                    'intervalo_minutos': day.intervalo_minutos,
+                    'disponivel': day.disponivel,
+                    'janelas': [
+                        {
+                            'horario': format_horario(day.inicio_minutos + i * day.intervalo_minutos),
+                            'disponivel': livre,
+                            'total': totais[i]
+                        }
+                        for i, livre in enumerate(unpack(day.vagas_disponiveis))
+                    ]
+                })
+            
+            return jsonify({
+                'success': True,
+                'capacity': days_data
+            })
+        except ScopeError as e:
+            return jsonify({'error': e.message}), e.status
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    
+    elif request.method == 'POST':
+        try:
+            (ubs_id, service_id, data_inicio_obj, data_fim_obj, inicio_minutos, fim_minutos,
+             intervalo_minutos, vagas_por_janela, pausa_inicio, pausa_fim, incluir_fim_de_semana) = payload
+            
+            if fim_minutos <= inicio_minutos or data_fim_obj < data_inicio_obj:
+                return jsonify({'error': 'Período ou intervalo inválido'}), 400
+            
+            check_ubs_access(ubs_id)
+            if not route_ubs(ubs_id):
+                return jsonify({'error': 'UBS não encontrada'}), 404
+            
+            pausa = None
+            if pausa_inicio is not None and pausa_fim is not None:
+                pausa = (pausa_inicio, pausa_fim)
+            
+            rows = build_days(
+                ubs_id, service_id, data_inicio_obj, data_fim_obj,
+                inicio_minutos, fim_minutos, intervalo_minutos, vagas_por_janela,
+                pausa=pausa, incluir_fim_de_semana=incluir_fim_de_semana
+            )
+            
+            # Dias já configurados são mantidos como estão
+            existing = set(db.session.execute(
+                db.select(DayCapacity.data).filter(
+                    DayCapacity.ubs_id == ubs_id,
+                    DayCapacity.service_id == service_id,
+                    DayCapacity.data.between(data_inicio_obj, data_fim_obj)
+                )
+            ).scalars())
+            rows = [row for row in rows if row['data'] not in existing]
+            
+            db.session.add_all([DayCapacity(**row) for row in rows])
+            db.session.commit()
+            
+            cache.invalidate(ubs_namespace(ubs_id))
+            audit('capacity.create', 'capacity', None, ubs_id=ubs_id, service_id=service_id,
+                  data_inicio=data_inicio_obj.isoformat(), data_fim=data_fim_obj.isoformat(), dias_criados=len(rows))
+            
+            return jsonify({
+                'success': True,
+                'dias_criados': len(rows),
+                'message': 'Capacidade criada com sucesso'
+            })
         
-        appointments = query.all()
+        except ScopeError as e:
+            return jsonify({'error': e.message}), e.status
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
+
+def _list_appointments(scope, incluir_historico):
+    # Com incluir_historico, une os agendamentos arquivados ao resultado
+    models = [Appointment, AppointmentArchive] if incluir_historico else [Appointment]
+    
+    appointments_data = []
+    for model in models:
+        query = scope.apply(model.query, model, model.data_agendamento)
         
-        appointments_data = []
-        for appointment in appointments:
+        for appointment in query.all():
             appointments_data.append({
                 'id': appointment.id,
                 'user_nome': appointment.user.nome_completo,
@@ -315,29 +508,381 @@ def get_appointments():
                 'service_nome': appointment.service.nome,
                 'data_agendamento': appointment.data_agendamento.isoformat(),
                 'turno': appointment.turno,
+                'horario': appointment.horario,
                 'status': appointment.status,
                 'created_at': appointment.created_at.isoformat()
             })
+    return appointments_data
+
+@admin_bp.route('/appointments', methods=['GET'])
+@validate(args=schemas.LISTING)
+@read_replica
+def get_appointments(params):
+    try:
+        scope = tenant_scope(request.args)
         
+        # Sem UBS no escopo, a listagem roda em todos os shards em paralelo
         return jsonify({
             'success': True,
-            'appointments': appointments_data
+            'appointments': collect(scope.ubs_id, _list_appointments, scope, params.incluir_historico)
         })
     
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@admin_bp.route('/create-admin', methods=['POST'])
-def create_admin():
+@admin_bp.route('/appointments/<appointment_id>/status', methods=['POST'])
+@validate(path=schemas.APPOINTMENT_ID, body=schemas.APPOINTMENT_STATUS)
+def update_appointment_status(appointment_id, payload):
+    try:
+        status = payload.status
+        
+        if not route_record(Appointment, appointment_id):
+            return jsonify({'error': 'Agendamento não encontrado'}), 404
+        
+        appointment = Appointment.query.get(appointment_id)
+        if not appointment:
+            return jsonify({'error': 'Agendamento não encontrado'}), 404
+        
+        check_ubs_access(appointment.ubs_id)
+        
+        if appointment.status not in ('Confirmado',) + FINAL_STATUSES:
+            return jsonify({'error': 'Agendamento cancelado'}), 400
+        if appointment.data_agendamento > date.today():
+            return jsonify({'error': 'Agendamento ainda não ocorreu'}), 400
+        
+        # A vaga continua ocupada: presença e falta não devolvem a vaga ao slot
+        appointment.status = status
+        apply_change(appointment.user_id, completion(appointment.service_id, appointment.data_agendamento, status))
+        db.session.commit()
+        
+        forget_user(appointment.user_id)
+        audit('appointment.status', 'appointment', appointment.id, ubs_id=appointment.ubs_id, status=status)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Status atualizado com sucesso'
+        })
+    
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/bulk-operations', methods=['GET', 'POST'])
+@validate(body=schemas.BULK_OPERATION)
+def manage_bulk_operations(payload):
+    """
+    POST cancela ou remarca todos os agendamentos Confirmado de uma UBS
+    num dia (ou nos turnos informados) e avisa os cidadãos; a execução
+    continua em segundo plano e o andamento é consultado pelo GET.
+    """
+    if request.method in ('GET', 'HEAD'):
+        try:
+            ubs_id = check_ubs_access(request.args.get('ubs_id'))
+            bulk.fail_stale()
+            query = BulkOperation.query
+            if ubs_id:
+                query = query.filter_by(ubs_id=ubs_id)
+            operations = query.order_by(BulkOperation.created_at.desc()).limit(50).all()
+            
+            return jsonify({
+                'success': True,
+                'operations': [bulk.describe(operation) for operation in operations]
+            })
+        except ScopeError as e:
+            return jsonify({'error': e.message}), e.status
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    
+    try:
+        ubs_id, data_obj, acao, turnos, turno, nova_data, novo_turno, fechar_vagas, motivo = payload
+        turnos = turnos or ([turno] if turno else None)
+        
+        # A operação fica registrada com o administrador que a pediu
+        admin = require_admin()
+        check_ubs_access(ubs_id)
+        
+        if data_obj < date.today():
+            return jsonify({'error': 'Data já passou'}), 400
+        if acao == 'remarcar' and (not nova_data or nova_data < date.today() or nova_data == data_obj):
+            return jsonify({'error': 'Informe uma nova_data futura e diferente da data'}), 400
+        
+        if not db.session.get(UBS, ubs_id):
+            return jsonify({'error': 'UBS não encontrada'}), 404
+        
+        # Operações abandonadas por um worker que caiu não bloqueiam uma nova
+        bulk.fail_stale()
+        running = BulkOperation.query.filter(
+            BulkOperation.ubs_id == ubs_id,
+            BulkOperation.data == data_obj,
+            BulkOperation.status.in_(bulk.RUNNING_STATUSES)
+        ).first()
+        if running:
+            return jsonify({'error': 'Já existe uma operação em andamento para esta UBS e data',
+                            'operation_id': running.id}), 409
+        
+        operation = BulkOperation(
+            ubs_id=ubs_id,
+            data=data_obj,
+            turnos=','.join(turnos) if turnos else None,
+            acao=acao,
+            nova_data=nova_data if acao == 'remarcar' else None,
+            novo_turno=novo_turno if acao == 'remarcar' else None,
+            fechar_vagas=fechar_vagas,
+            motivo=motivo,
+            admin_id=admin.id
+        )
+        db.session.add(operation)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Outro POST para a mesma UBS e data venceu a corrida (índice único parcial)
+            db.session.rollback()
+            return jsonify({'error': 'Já existe uma operação em andamento para esta UBS e data'}), 409
+        
+        bulk.start_operation(operation.id)
+        
+        return jsonify({
+            'success': True,
+            'operation': bulk.describe(operation),
+            'message': 'Operação iniciada'
+        }), 202
+    
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/bulk-operations/<operation_id>', methods=['GET'])
+@validate(path=schemas.OPERATION_ID)
+def get_bulk_operation(operation_id):
     try:
-        data = request.get_json()
-        username = data.get('username')
-        password = data.get('password')
-        role = data.get('role', 'UBSManager')
-        ubs_id = data.get('ubs_id')
+        bulk.fail_stale()
+        operation = db.session.get(BulkOperation, operation_id)
+        if not operation:
+            return jsonify({'error': 'Operação não encontrada'}), 404
         
-        if not username or not password:
-            return jsonify({'error': 'Username e senha são obrigatórios'}), 400
+        check_ubs_access(operation.ubs_id)
+        
+        return jsonify({
+            'success': True,
+            'operation': bulk.describe(operation)
+        })
+    
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/bulk-operations/<operation_id>/reenviar', methods=['POST'])
+@validate(path=schemas.OPERATION_ID)
+def resend_bulk_operation(operation_id):
+    """Reenvia os avisos não confirmados de uma operação concluida_com_falhas"""
+    try:
+        bulk.fail_stale()
+        operation = db.session.get(BulkOperation, operation_id)
+        if not operation:
+            return jsonify({'error': 'Operação não encontrada'}), 404
+        
+        check_ubs_access(operation.ubs_id)
+        
+        if operation.status != bulk.PARTIAL_STATUS or not operation.notificacoes_pendentes:
+            return jsonify({'error': 'Operação sem avisos pendentes'}), 409
+        
+        try:
+            started = bulk.start_resend(operation.id)
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': 'Já existe uma operação em andamento para esta UBS e data'}), 409
+        if not started:
+            return jsonify({'error': 'Operação sem avisos pendentes'}), 409
+        
+        audit('bulk_operation.resend', 'bulk_operation', operation.id, ubs_id=operation.ubs_id)
+        db.session.refresh(operation)
+        
+        return jsonify({
+            'success': True,
+            'operation': bulk.describe(operation),
+            'message': 'Reenvio iniciado'
+        }), 202
+    
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/export', methods=['GET'])
+@validate(args=schemas.EXPORT)
+@read_replica
+def export_appointments(params):
+    try:
+        scope = tenant_scope(request.args)
+        formato = params.formato
+        
+        if formato == 'parquet' and export.pa is None:
+            return jsonify({'error': 'Exportação em Parquet indisponível neste servidor'}), 400
+        
+        try:
+            columns = export.parse_columns(params.colunas)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        writer = export.get_writer(formato, columns)
+        filename = f"agendamentos_{scope.data_inicio.isoformat()}_{scope.data_fim.isoformat()}.{writer.extension}"
+        
+        # O arquivo é gerado e enviado em partes, sem montar o resultado em memória
+        chunks = export.export_appointments(
+            writer, scope.data_inicio, scope.data_fim,
+            ubs_id=scope.ubs_id,
+            service_id=params.service_id,
+            incluir_historico=params.incluir_historico
+        )
+        audit('appointment.export', 'appointment', None, ubs_id=scope.ubs_id, formato=formato, colunas=columns,
+              data_inicio=scope.data_inicio, data_fim=scope.data_fim)
+        
+        return Response(
+            stream_with_context(chunks),
+            mimetype=writer.mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/audit', methods=['GET'])
+@validate(args=schemas.AUDIT)
+@read_replica
+def get_audit_events(params):
+    try:
+        scope = tenant_scope(request.args)
+        limite = min(params.limite, 1000)
+        
+        # Paginação por id: o cliente envia o menor id recebido em 'antes_de'
+        query = AuditEvent.query.filter(
+            AuditEvent.created_at >= datetime.combine(scope.data_inicio, datetime.min.time()),
+            AuditEvent.created_at < datetime.combine(scope.data_fim + timedelta(days=1), datetime.min.time())
+        )
+        if scope.ubs_id:
+            query = query.filter(AuditEvent.ubs_id == scope.ubs_id)
+        if params.action:
+            query = query.filter(AuditEvent.action == params.action)
+        if params.antes_de:
+            query = query.filter(AuditEvent.id < params.antes_de)
+        
+        events = query.order_by(AuditEvent.id.desc()).limit(limite).all()
+        
+        return jsonify({
+            'success': True,
+            'events': [
+                {
+                    'id': event.id,
+                    'created_at': event.created_at.isoformat(),
+                    'action': event.action,
+                    'actor_type': event.actor_type,
+                    'actor_id': event.actor_id,
+                    'entity': event.entity,
+                    'entity_id': event.entity_id,
+                    'ubs_id': event.ubs_id,
+                    'payload': json.loads(event.payload) if event.payload else None
+                }
+                for event in events
+            ]
+        })
+    
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
+    except ValueError:
+        return jsonify({'error': 'Parâmetros inválidos'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/cache', methods=['GET'])
+def get_cache_stats():
+    """Acertos e falhas do cache no worker que atendeu a requisição"""
+    try:
+        require_super_admin()
+        return jsonify({
+            'success': True,
+            'cache': cache.stats()
+        })
+
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/profiling', methods=['GET', 'POST'])
+@validate(body=schemas.PROFILING)
+def manage_profiling(payload):
+    """
+    POST liga o profiler por amostragem por 'segundos' em todos os workers
+    (cada um entra na sessão na próxima requisição que atender); GET lista
+    a sessão ativa e as sessões gravadas.
+    """
+    try:
+        require_super_admin()
+        directory = profiling.profiles_dir()
+        
+        if request.method == 'POST':
+            try:
+                active = profiling.start_session(payload.segundos, payload.intervalo_ms, directory)
+            except (TypeError, ValueError):
+                return jsonify({'error': 'segundos e intervalo_ms devem ser inteiros'}), 400
+            
+            audit('profiling.start', 'profiling', active['sessao'],
+                  segundos=payload.segundos, intervalo_ms=active['intervalo_ms'])
+            
+            return jsonify({
+                'success': True,
+                'sessao': active['sessao'],
+                'ate': datetime.utcfromtimestamp(active['ate']).isoformat(),
+                'message': 'Profiler ativado'
+            })
+        
+        return jsonify({
+            'success': True,
+            'sessao_ativa': cache.get(profiling.PROFILING_NAMESPACE, profiling.SESSION_KEY),
+            'sessoes': profiling.list_sessions(directory)
+        })
+    
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/profiling/<sessao>', methods=['GET'])
+def get_profile(sessao):
+    """Pilhas da sessão somadas entre os workers, em texto 'folded' (flamegraph.pl, speedscope)"""
+    try:
+        require_super_admin()
+        try:
+            folded = profiling.merged_stacks(profiling.profiles_dir(), sessao)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if folded is None:
+            return jsonify({'error': 'Sessão não encontrada ou ainda em andamento'}), 404
+        
+        return Response(folded, mimetype='text/plain', headers={
+            'Content-Disposition': f'attachment; filename="profile-{sessao}.folded"'
+        })
+    
+    except ScopeError as e:
+        return jsonify({'error': e.message}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@admin_bp.route('/create-admin', methods=['POST'])
+@validate(body=schemas.CREATE_ADMIN)
+def create_admin(payload):
+    try:
+        username, password, role, ubs_id = payload
         
         # Verificar se o username já existe
         existing_admin = Admin.query.filter_by(username=username).first()
@@ -356,6 +901,8 @@ def create_admin():
         db.session.add(admin)
         db.session.commit()
         
+        audit('admin.create', 'admin', admin.id, ubs_id=ubs_id, username=username, role=role)
+        
         return jsonify({
             'success': True,
             'admin_id': admin.id,
@@ -1,81 +1,159 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, jsonify
 from src.models.database import db, User, City, UBS, Service, Appointment, Slot
-from datetime import datetime, date
+from src.utils.idempotency import idempotent
+from src.utils.capacity import (
+    available_windows, reserve_window, release_window, slot_delta_statement,
+    parse_horario, format_horario, turno_for, WindowBusy
+)
+from src.utils.booking_rules import apply_change, booking, cancellation
+from src.utils.sharding import fan_out, route_ubs, route_record
+from src.utils.geo import find_nearest_ubs
+from src.utils.search_index import search_index
+from src.utils.audit import record_event
+from src.utils.replicas import read_replica
+from src.utils import schemas
+from src.utils.schemas import validate
+from src.utils.cache import cache, CATALOG, USERS, AVAILABILITY_TTL, ubs_namespace, forget_availability, forget_user
+from datetime import date, timedelta
 from sqlalchemy import and_
 
 appointments_bp = Blueprint('appointments', __name__)
 
 @appointments_bp.route('/cities', methods=['GET'])
+@read_replica
 def get_cities():
     try:
-        cities = City.query.all()
+        cities = cache.get_or_set(CATALOG, 'cidades', lambda: [
+            {'id': city.id, 'nome': city.nome} for city in City.query.all()
+        ])
         return jsonify({
             'success': True,
-            'cities': [{'id': city.id, 'nome': city.nome} for city in cities]
+            'cities': cities
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @appointments_bp.route('/ubs/<city_id>', methods=['GET'])
+@read_replica
 def get_ubs_by_city(city_id):
     try:
-        ubs_list = UBS.query.filter_by(cidade_id=city_id).all()
+        ubs_list = cache.get_or_set(CATALOG, f'cidade:{city_id}:ubs', lambda: [
+            {'id': ubs.id, 'nome': ubs.nome, 'endereco': ubs.endereco, 'latitude': ubs.latitude, 'longitude': ubs.longitude}
+            for ubs in UBS.query.filter_by(cidade_id=city_id).all()
+        ])
         return jsonify({
             'success': True,
-            'ubs': [{'id': ubs.id, 'nome': ubs.nome, 'endereco': ubs.endereco} for ubs in ubs_list]
+            'ubs': ubs_list
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@appointments_bp.route('/nearest-ubs', methods=['GET'])
+@validate(args=schemas.NEAREST_UBS)
+@read_replica
+def get_nearest_ubs(params):
+    try:
+        today = date.today()
+        found = find_nearest_ubs(
+            params.lat, params.lon, params.service_id, today, today + timedelta(days=params.dias),
+            limite=min(params.limite, 50), max_km=params.raio_km
+        )
+        
+        ubs_by_id = {ubs.id: ubs for ubs in UBS.query.filter(UBS.id.in_([ubs_id for _, ubs_id, _, _ in found])).all()}
+        
+        ubs_data = []
+        for distance, ubs_id, vagas, primeira_data in found:
+            ubs = ubs_by_id[ubs_id]
+            ubs_data.append({
+                'id': ubs.id,
+                'nome': ubs.nome,
+                'endereco': ubs.endereco,
+                'latitude': ubs.latitude,
+                'longitude': ubs.longitude,
+                'distancia_km': round(distance, 2),
+                'vagas': vagas,
+                'proxima_data': primeira_data.isoformat()
+            })
+        
+        return jsonify({
+            'success': True,
+            'ubs': ubs_data
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@appointments_bp.route('/search', methods=['GET'])
+@validate(args=schemas.SEARCH)
+@read_replica
+def search_catalog(params):
+    try:
+        search_index.ensure_loaded()
+        return jsonify({
+            'success': True,
+            'results': search_index.search(params.q, tipo=params.tipo, limit=min(params.limite, 50))
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @appointments_bp.route('/services/<ubs_id>', methods=['GET'])
+@validate(path=schemas.UBS_ID)
+@read_replica
 def get_services_by_ubs(ubs_id):
     try:
-        ubs = UBS.query.get(ubs_id)
-        if not ubs:
+        def load():
+            ubs = UBS.query.get(ubs_id)
+            if not ubs:
+                return False
+            return [{'id': service.id, 'nome': service.nome, 'descricao': service.descricao} for service in ubs.services]
+        
+        # False (UBS inexistente) também fica em cache, como qualquer valor JSON
+        services = cache.get_or_set(CATALOG, f'ubs:{ubs_id}:servicos', load)
+        if services is False:
             return jsonify({'error': 'UBS não encontrada'}), 404
         
-        services = ubs.services
         return jsonify({
             'success': True,
-            'services': [{'id': service.id, 'nome': service.nome, 'descricao': service.descricao} for service in services]
+            'services': services
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @appointments_bp.route('/available-dates', methods=['POST'])
-def get_available_dates():
+@validate(body=schemas.AVAILABILITY)
+@read_replica(methods=('POST',))
+def get_available_dates(payload):
     try:
-        data = request.get_json()
-        ubs_id = data.get('ubs_id')
-        service_id = data.get('service_id')
-        
-        if not ubs_id or not service_id:
-            return jsonify({'error': 'UBS e serviço são obrigatórios'}), 400
+        ubs_id, service_id = payload
+        if not route_ubs(ubs_id):
+            return jsonify({'error': 'UBS não encontrada'}), 404
         
-        # Buscar slots disponíveis (com quantidade_disponivel > 0)
-        today = date.today()
-        slots = Slot.query.filter(
-            and_(
-                Slot.ubs_id == ubs_id,
-                Slot.service_id == service_id,
-                Slot.data >= today,
-                Slot.quantidade_disponivel > 0
-            )
-        ).all()
-        
-        # Agrupar por data
-        dates_dict = {}
-        for slot in slots:
-            date_str = slot.data.isoformat()
-            if date_str not in dates_dict:
-                dates_dict[date_str] = {'data': date_str, 'turnos': {}}
+        def load():
+            # Buscar slots disponíveis (com quantidade_disponivel > 0)
+            today = date.today()
+            slots = Slot.query.filter(
+                and_(
+                    Slot.ubs_id == ubs_id,
+                    Slot.service_id == service_id,
+                    Slot.data >= today,
+                    Slot.quantidade_disponivel > 0
+                )
+            ).all()
+            
+            # Agrupar por data
+            dates_dict = {}
+            for slot in slots:
+                date_str = slot.data.isoformat()
+                if date_str not in dates_dict:
+                    dates_dict[date_str] = {'data': date_str, 'turnos': {}}
+                
+                dates_dict[date_str]['turnos'][slot.turno] = {
+                    'disponivel': slot.quantidade_disponivel,
+                    'total': slot.quantidade_total
+                }
             
-            dates_dict[date_str]['turnos'][slot.turno] = {
-                'disponivel': slot.quantidade_disponivel,
-                'total': slot.quantidade_total
-            }
+            return list(dates_dict.values())
         
-        available_dates = list(dates_dict.values())
+        available_dates = cache.get_or_set(ubs_namespace(ubs_id), f'datas:{service_id}', load, ttl=AVAILABILITY_TTL)
         
         return jsonify({
             'success': True,
@@ -85,49 +163,63 @@ def get_available_dates():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@appointments_bp.route('/available-windows', methods=['POST'])
+@validate(body=schemas.AVAILABILITY)
+@read_replica(methods=('POST',))
+def get_available_windows(payload):
+    try:
+        ubs_id, service_id = payload
+        if not route_ubs(ubs_id):
+            return jsonify({'error': 'UBS não encontrada'}), 404
+        
+        return jsonify({
+            'success': True,
+            'available_dates': cache.get_or_set(
+                ubs_namespace(ubs_id), f'janelas:{service_id}',
+                lambda: available_windows(ubs_id, service_id, date.today()),
+                ttl=AVAILABILITY_TTL
+            )
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @appointments_bp.route('/create', methods=['POST'])
-def create_appointment():
+@validate(body=schemas.CREATE_APPOINTMENT)
+@idempotent
+def create_appointment(payload):
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        ubs_id = data.get('ubs_id')
-        service_id = data.get('service_id')
-        data_agendamento = data.get('data_agendamento')
-        turno = data.get('turno')
-        
-        if not all([user_id, ubs_id, service_id, data_agendamento, turno]):
+        user_id, ubs_id, service_id, data_agendamento_obj, turno, minutos = payload
+        data_agendamento = data_agendamento_obj.isoformat()
+        
+        # horario ('HH:MM', já em minutos) agenda por janela de horário
+        if turno is None and minutos is None:
             return jsonify({'error': 'Todos os campos são obrigatórios'}), 400
         
-        try:
-            data_agendamento_obj = datetime.strptime(data_agendamento, '%Y-%m-%d').date()
-        except ValueError:
-            return jsonify({'error': 'Data de agendamento inválida'}), 400
-        
-        # Verificar se existe slot disponível
-        slot = Slot.query.filter(
-            and_(
-                Slot.ubs_id == ubs_id,
-                Slot.service_id == service_id,
-                Slot.data == data_agendamento_obj,
-                Slot.turno == turno,
-                Slot.quantidade_disponivel > 0
-            )
-        ).first()
+        horario = None
+        if minutos is not None:
+            horario = format_horario(minutos)
+            turno = turno_for(minutos)
         
-        if not slot:
-            return jsonify({'error': 'Não há vagas disponíveis para esta data e turno'}), 400
+        # Slot, janela e agendamento ficam no shard da cidade da UBS
+        if not route_ubs(ubs_id):
+            return jsonify({'error': 'UBS não encontrada'}), 404
         
-        # Verificar se o usuário já tem agendamento para a mesma data
-        existing_appointment = Appointment.query.filter(
-            and_(
-                Appointment.user_id == user_id,
-                Appointment.data_agendamento == data_agendamento_obj,
-                Appointment.status == 'Confirmado'
-            )
-        ).first()
+        # Regras por usuário (uma por data, limite em aberto, intervalo por serviço,
+        # carência após faltas), avaliadas sobre os contadores: uma leitura e uma gravação
+        refusal = apply_change(user_id, booking(service_id, data_agendamento_obj))
+        if refusal:
+            db.session.rollback()
+            return jsonify({'error': refusal}), 400
         
-        if existing_appointment:
-            return jsonify({'error': 'Você já tem um agendamento para esta data'}), 400
+        # Ocupar a vaga com um UPDATE condicional no slot ou na janela de horário
+        if minutos is not None:
+            if not reserve_window(ubs_id, service_id, data_agendamento_obj, minutos):
+                db.session.rollback()
+                return jsonify({'error': 'Não há vagas disponíveis para esta data e horário'}), 400
+        elif not db.session.execute(slot_delta_statement(ubs_id, service_id, data_agendamento_obj, turno, -1)).rowcount:
+            db.session.rollback()
+            return jsonify({'error': 'Não há vagas disponíveis para esta data e turno'}), 400
         
         # Criar o agendamento
         appointment = Appointment(
@@ -135,42 +227,61 @@ def create_appointment():
             ubs_id=ubs_id,
             service_id=service_id,
             data_agendamento=data_agendamento_obj,
-            turno=turno
+            turno=turno,
+            horario=horario
         )
-        
-        # Reduzir a quantidade disponível no slot
-        slot.quantidade_disponivel -= 1
-        
         db.session.add(appointment)
         db.session.commit()
         
+        forget_availability(ubs_id, service_id)
+        forget_user(user_id)
+        record_event(
+            'appointment.create', 'appointment', appointment.id,
+            actor_type='user', actor_id=user_id, ubs_id=ubs_id,
+            service_id=service_id, data=data_agendamento, turno=turno, horario=horario
+        )
+        
         return jsonify({
             'success': True,
             'appointment_id': appointment.id,
             'message': 'Agendamento criado com sucesso'
         })
     
+    except WindowBusy as e:
+        db.session.rollback()
+        response = jsonify({'error': e.message})
+        response.headers['Retry-After'] = '1'
+        return response, e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+def _user_appointments(user_id):
+    return [
+        {
+            'id': appointment.id,
+            'data_agendamento': appointment.data_agendamento.isoformat(),
+            'turno': appointment.turno,
+            'horario': appointment.horario,
+            'status': appointment.status,
+            'ubs_nome': appointment.ubs.nome,
+            'service_nome': appointment.service.nome,
+            'cidade_nome': appointment.ubs.city.nome,
+            'created_at': appointment.created_at.isoformat()
+        }
+        for appointment in Appointment.query.filter_by(user_id=user_id).all()
+    ]
+
 @appointments_bp.route('/user/<user_id>', methods=['GET'])
+@validate(path=schemas.USER_ID)
+@read_replica
 def get_user_appointments(user_id):
     try:
-        appointments = Appointment.query.filter_by(user_id=user_id).all()
-        
-        appointments_data = []
-        for appointment in appointments:
-            appointments_data.append({
-                'id': appointment.id,
-                'data_agendamento': appointment.data_agendamento.isoformat(),
-                'turno': appointment.turno,
-                'status': appointment.status,
-                'ubs_nome': appointment.ubs.nome,
-                'service_nome': appointment.service.nome,
-                'cidade_nome': appointment.ubs.city.nome,
-                'created_at': appointment.created_at.isoformat()
-            })
+        # Um usuário pode ter agendamentos em cidades de shards diferentes
+        appointments_data = cache.get_or_set(
+            USERS, f'{user_id}:agendamentos',
+            lambda: [item for part in fan_out(_user_appointments, user_id) for item in part]
+        )
         
         return jsonify({
             'success': True,
@@ -181,8 +292,13 @@ def get_user_appointments(user_id):
         return jsonify({'error': str(e)}), 500
 
 @appointments_bp.route('/cancel/<appointment_id>', methods=['PUT'])
+@validate(path=schemas.APPOINTMENT_ID)
+@idempotent
 def cancel_appointment(appointment_id):
     try:
+        if not route_record(Appointment, appointment_id):
+            return jsonify({'error': 'Agendamento não encontrado'}), 404
+        
         appointment = Appointment.query.get(appointment_id)
         if not appointment:
             return jsonify({'error': 'Agendamento não encontrado'}), 404
@@ -192,27 +308,44 @@ def cancel_appointment(appointment_id):
         
         # Cancelar o agendamento
         appointment.status = 'Cancelado'
+        apply_change(appointment.user_id, cancellation(appointment.service_id, appointment.data_agendamento))
         
-        # Aumentar a quantidade disponível no slot
-        slot = Slot.query.filter(
-            and_(
-                Slot.ubs_id == appointment.ubs_id,
-                Slot.service_id == appointment.service_id,
-                Slot.data == appointment.data_agendamento,
-                Slot.turno == appointment.turno
+        # Aumentar a quantidade disponível no slot ou na janela de horário
+        if appointment.horario:
+            release_window(
+                appointment.ubs_id,
+                appointment.service_id,
+                appointment.data_agendamento,
+                parse_horario(appointment.horario)
             )
-        ).first()
-        
-        if slot:
-            slot.quantidade_disponivel += 1
+        else:
+            db.session.execute(slot_delta_statement(
+                appointment.ubs_id,
+                appointment.service_id,
+                appointment.data_agendamento,
+                appointment.turno,
+                1
+            ))
         
         db.session.commit()
         
+        forget_availability(appointment.ubs_id, appointment.service_id)
+        forget_user(appointment.user_id)
+        record_event(
+            'appointment.cancel', 'appointment', appointment.id,
+            actor_type='user', actor_id=appointment.user_id, ubs_id=appointment.ubs_id
+        )
+        
         return jsonify({
             'success': True,
             'message': 'Agendamento cancelado com sucesso'
         })
     
+    except WindowBusy as e:
+        db.session.rollback()
+        response = jsonify({'error': e.message})
+        response.headers['Retry-After'] = '1'
+        return response, e.status
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,299 @@
+# Versão assíncrona (ASGI) das rotas do fluxo de agendamento; mesmas URLs e
+# respostas de auth.py e appointments.py, servidas por src/asgi.py
+
+import asyncio
+from datetime import date
+
+from sqlalchemy import select, and_, exists
+
+from src.models.database import User, City, UBS, Service, Appointment, Slot, ubs_services
+from src.utils.asgi import Router
+from src.utils.audit import record_event
+from src.utils.booking_rules import (
+    MAX_RETRIES as BOOKING_RETRIES, BookingState, booking, cancellation, state_query, save_statement
+)
+from src.utils.cache import forget_availability, forget_user
+from src.utils.capacity import (
+    MAX_RETRIES, WindowBusy, windows_query, format_windows, day_query, adjust_statement, slot_delta_statement,
+    parse_horario, format_horario, turno_for
+)
+from src.utils.cpf_validator import validate_cpf_complete
+from src.utils.idempotency import idempotent_async
+from src.utils import schemas
+
+routes = Router()
+
+async def _adjust_window(session, ubs_id, service_id, data, minutos, delta):
+    """Mesmo controle otimista de capacity._adjust, na sessão assíncrona"""
+    for _ in range(MAX_RETRIES):
+        day = (await session.execute(day_query(ubs_id, service_id, data))).first()
+        if day is None:
+            return False
+        statement = adjust_statement(day, minutos, delta)
+        if statement is None:
+            return False
+        if (await session.execute(statement)).rowcount:
+            return True
+    raise WindowBusy()
+
+async def _apply_change(session, user_id, change):
+    """Mesmo controle otimista de booking_rules.apply_change, na sessão assíncrona"""
+    for _ in range(BOOKING_RETRIES):
+        state = BookingState.from_row((await session.execute(state_query(user_id))).first())
+        refusal = change(state)
+        if refusal:
+            return refusal
+        if (await session.execute(save_statement(user_id, state, session.bind.dialect.name))).rowcount:
+            return None
+    raise RuntimeError('Não foi possível atualizar os contadores do usuário: muitas alterações simultâneas')
+
+@routes.route('/api/auth/login', methods=['POST'])
+async def login(request):
+    payload = schemas.LOGIN.load(request.get_json())
+    cpf = payload.cpf.replace('.', '').replace('-', '')
+    data_nascimento_obj = payload.data_nascimento
+
+    # A consulta à fonte oficial do CPF pode ser lenta: roda fora do loop de eventos
+    cpf_validation = await asyncio.to_thread(validate_cpf_complete, cpf, data_nascimento_obj.isoformat())
+    if not cpf_validation['valid']:
+        return {'error': cpf_validation['message']}, 400
+
+    async with request.session() as session:
+        user = (await session.execute(
+            select(User).where(User.cpf == cpf, User.data_nascimento == data_nascimento_obj)
+        )).scalar_one_or_none()
+
+        if user:
+            has_appointments = (await session.execute(
+                select(exists().where(Appointment.user_id == user.id))
+            )).scalar()
+            user_exists = True
+        else:
+            user = User(cpf=cpf, data_nascimento=data_nascimento_obj)
+            session.add(user)
+            await session.commit()
+            has_appointments = False
+            user_exists = False
+
+    return {
+        'success': True,
+        'user_exists': user_exists,
+        'user_id': user.id,
+        'has_appointments': has_appointments,
+        'user_data': {
+            'cpf': user.cpf,
+            'nome_completo': user.nome_completo,
+            'celular': user.celular,
+            'carteira_sus': user.carteira_sus
+        },
+        'cpf_validation': cpf_validation
+    }
+
+@routes.route('/api/appointments/cities')
+async def get_cities(request):
+    async with request.session() as session:
+        cities = (await session.execute(select(City.id, City.nome))).all()
+    return {
+        'success': True,
+        'cities': [{'id': city_id, 'nome': nome} for city_id, nome in cities]
+    }
+
+@routes.route('/api/appointments/ubs/<city_id>')
+async def get_ubs_by_city(request, city_id):
+    async with request.session() as session:
+        ubs_list = (await session.execute(
+            select(UBS.id, UBS.nome, UBS.endereco, UBS.latitude, UBS.longitude).where(UBS.cidade_id == city_id)
+        )).all()
+    return {
+        'success': True,
+        'ubs': [
+            {'id': ubs.id, 'nome': ubs.nome, 'endereco': ubs.endereco, 'latitude': ubs.latitude, 'longitude': ubs.longitude}
+            for ubs in ubs_list
+        ]
+    }
+
+@routes.route('/api/appointments/services/<ubs_id>')
+async def get_services_by_ubs(request, ubs_id):
+    ubs_id = schemas.UBS_ID.load({'ubs_id': ubs_id}).ubs_id
+    async with request.session() as session:
+        if (await session.get(UBS, ubs_id)) is None:
+            return {'error': 'UBS não encontrada'}, 404
+        services = (await session.execute(
+            select(Service.id, Service.nome, Service.descricao)
+            .join(ubs_services, ubs_services.c.service_id == Service.id)
+            .where(ubs_services.c.ubs_id == ubs_id)
+        )).all()
+    return {
+        'success': True,
+        'services': [{'id': s.id, 'nome': s.nome, 'descricao': s.descricao} for s in services]
+    }
+
+@routes.route('/api/appointments/available-dates', methods=['POST'])
+async def get_available_dates(request):
+    ubs_id, service_id = schemas.AVAILABILITY.load(request.get_json())
+
+    async with request.session() as session:
+        slots = (await session.execute(
+            select(Slot.data, Slot.turno, Slot.quantidade_disponivel, Slot.quantidade_total)
+            .where(and_(
+                Slot.ubs_id == ubs_id,
+                Slot.service_id == service_id,
+                Slot.data >= date.today(),
+                Slot.quantidade_disponivel > 0
+            ))
+        )).all()
+
+    dates_dict = {}
+    for data_slot, turno, disponivel, total in slots:
+        date_str = data_slot.isoformat()
+        if date_str not in dates_dict:
+            dates_dict[date_str] = {'data': date_str, 'turnos': {}}
+        dates_dict[date_str]['turnos'][turno] = {'disponivel': disponivel, 'total': total}
+
+    return {
+        'success': True,
+        'available_dates': list(dates_dict.values())
+    }
+
+@routes.route('/api/appointments/available-windows', methods=['POST'])
+async def get_available_windows(request):
+    ubs_id, service_id = schemas.AVAILABILITY.load(request.get_json())
+
+    async with request.session() as session:
+        days = (await session.execute(windows_query(ubs_id, service_id, date.today()))).all()
+    return {
+        'success': True,
+        'available_dates': format_windows(days)
+    }
+
+@routes.route('/api/appointments/create', methods=['POST'])
+@idempotent_async('appointments.create_appointment')
+async def create_appointment(request):
+    user_id, ubs_id, service_id, data_agendamento_obj, turno, minutos = (
+        schemas.CREATE_APPOINTMENT.load(request.get_json())
+    )
+    data_agendamento = data_agendamento_obj.isoformat()
+
+    if turno is None and minutos is None:
+        return {'error': 'Todos os campos são obrigatórios'}, 400
+
+    horario = None
+    if minutos is not None:
+        horario = format_horario(minutos)
+        turno = turno_for(minutos)
+
+    async with request.session() as session:
+        # Regras por usuário, avaliadas sobre os contadores (uma leitura e uma gravação)
+        refusal = await _apply_change(session, user_id, booking(service_id, data_agendamento_obj))
+        if refusal:
+            await session.rollback()
+            return {'error': refusal}, 400
+
+        # A vaga é ocupada com um UPDATE condicional, sem ler e regravar o contador
+        if minutos is not None:
+            if not await _adjust_window(session, ubs_id, service_id, data_agendamento_obj, minutos, -1):
+                await session.rollback()
+                return {'error': 'Não há vagas disponíveis para esta data e horário'}, 400
+        elif not (await session.execute(slot_delta_statement(ubs_id, service_id, data_agendamento_obj, turno, -1))).rowcount:
+            await session.rollback()
+            return {'error': 'Não há vagas disponíveis para esta data e turno'}, 400
+
+        appointment = Appointment(
+            user_id=user_id,
+            ubs_id=ubs_id,
+            service_id=service_id,
+            data_agendamento=data_agendamento_obj,
+            turno=turno,
+            horario=horario
+        )
+        session.add(appointment)
+        await session.commit()
+
+    # Mesmo cache do app Flask quando o backend é compartilhado (sqlite/redis)
+    forget_availability(ubs_id, service_id)
+    forget_user(user_id)
+    record_event(
+        'appointment.create', 'appointment', appointment.id,
+        actor_type='user', actor_id=user_id, ubs_id=ubs_id,
+        service_id=service_id, data=data_agendamento, turno=turno, horario=horario
+    )
+
+    return {
+        'success': True,
+        'appointment_id': appointment.id,
+        'message': 'Agendamento criado com sucesso'
+    }
+
+@routes.route('/api/appointments/user/<user_id>')
+async def get_user_appointments(request, user_id):
+    user_id = schemas.USER_ID.load({'user_id': user_id}).user_id
+    async with request.session() as session:
+        rows = (await session.execute(
+            select(
+                Appointment.id, Appointment.data_agendamento, Appointment.turno, Appointment.horario,
+                Appointment.status, Appointment.created_at,
+                UBS.nome.label('ubs_nome'), Service.nome.label('service_nome'), City.nome.label('cidade_nome')
+            )
+            .join(UBS, Appointment.ubs_id == UBS.id)
+            .join(City, UBS.cidade_id == City.id)
+            .join(Service, Appointment.service_id == Service.id)
+            .where(Appointment.user_id == user_id)
+        )).all()
+
+    return {
+        'success': True,
+        'appointments': [
+            {
+                'id': row.id,
+                'data_agendamento': row.data_agendamento.isoformat(),
+                'turno': row.turno,
+                'horario': row.horario,
+                'status': row.status,
+                'ubs_nome': row.ubs_nome,
+                'service_nome': row.service_nome,
+                'cidade_nome': row.cidade_nome,
+                'created_at': row.created_at.isoformat()
+            }
+            for row in rows
+        ]
+    }
+
+@routes.route('/api/appointments/cancel/<appointment_id>', methods=['PUT'])
+@idempotent_async('appointments.cancel_appointment')
+async def cancel_appointment(request, appointment_id):
+    appointment_id = schemas.APPOINTMENT_ID.load({'appointment_id': appointment_id}).appointment_id
+    async with request.session() as session:
+        appointment = await session.get(Appointment, appointment_id)
+        if not appointment:
+            return {'error': 'Agendamento não encontrado'}, 404
+
+        if appointment.status != 'Confirmado':
+            return {'error': 'Agendamento não pode ser cancelado'}, 400
+
+        appointment.status = 'Cancelado'
+        await _apply_change(session, appointment.user_id, cancellation(appointment.service_id, appointment.data_agendamento))
+
+        if appointment.horario:
+            await _adjust_window(
+                session, appointment.ubs_id, appointment.service_id,
+                appointment.data_agendamento, parse_horario(appointment.horario), 1
+            )
+        else:
+            await session.execute(slot_delta_statement(
+                appointment.ubs_id, appointment.service_id,
+                appointment.data_agendamento, appointment.turno, 1
+            ))
+
+        await session.commit()
+
+    forget_availability(appointment.ubs_id, appointment.service_id)
+    forget_user(appointment.user_id)
+    record_event(
+        'appointment.cancel', 'appointment', appointment.id,
+        actor_type='user', actor_id=appointment.user_id, ubs_id=appointment.ubs_id
+    )
+
+    return {
+        'success': True,
+        'message': 'Agendamento cancelado com sucesso'
+    }
@@ -1,42 +1,43 @@
-from flask import Blueprint, request, jsonify
-from src.models.database import db, User
+from flask import Blueprint, jsonify
+from sqlalchemy import select, exists
+from src.models.database import db, User, Appointment
 from src.utils.cpf_validator import validate_cpf_complete
-from datetime import datetime
+from src.utils.replicas import read_replica
+from src.utils.cache import cache, USERS, forget_user
+from src.utils.sharding import fan_out
+from src.utils import schemas
+from src.utils.schemas import validate, UNSET
 import re
 
 auth_bp = Blueprint('auth', __name__)
 
+def _has_appointments(user_id):
+    return db.session.execute(select(exists().where(Appointment.user_id == user_id))).scalar()
+
 def validate_cpf(cpf):
     """Validação básica de CPF (formato)"""
     cpf = re.sub(r'[^0-9]', '', cpf)
     return len(cpf) == 11 and cpf.isdigit()
 
 @auth_bp.route('/login', methods=['POST'])
-def login():
+@validate(body=schemas.LOGIN)
+def login(payload):
     try:
-        data = request.get_json()
-        cpf = data.get('cpf', '').replace('.', '').replace('-', '')
-        data_nascimento = data.get('data_nascimento')
-        
-        if not cpf or not data_nascimento:
-            return jsonify({'error': 'CPF e data de nascimento são obrigatórios'}), 400
+        cpf = payload.cpf.replace('.', '').replace('-', '')
+        data_nascimento_obj = payload.data_nascimento
         
         # Validação completa do CPF
-        cpf_validation = validate_cpf_complete(cpf, data_nascimento)
+        cpf_validation = validate_cpf_complete(cpf, data_nascimento_obj.isoformat())
         if not cpf_validation['valid']:
             return jsonify({'error': cpf_validation['message']}), 400
         
-        try:
-            data_nascimento_obj = datetime.strptime(data_nascimento, '%Y-%m-%d').date()
-        except ValueError:
-            return jsonify({'error': 'Data de nascimento inválida'}), 400
-        
         # Verificar se o usuário existe
         user = User.query.filter_by(cpf=cpf, data_nascimento=data_nascimento_obj).first()
         
         if user:
             # Usuário existe - verificar se tem agendamentos
-            has_appointments = len(user.appointments) > 0
+            # Os agendamentos do usuário podem estar em qualquer shard
+            has_appointments = any(fan_out(_has_appointments, user.id))
             return jsonify({
                 'success': True,
                 'user_exists': True,
@@ -77,27 +78,23 @@ def login():
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/update-user', methods=['PUT'])
-def update_user():
+@validate(body=schemas.UPDATE_USER)
+def update_user(payload):
     try:
-        data = request.get_json()
-        user_id = data.get('user_id')
-        
-        if not user_id:
-            return jsonify({'error': 'ID do usuário é obrigatório'}), 400
-        
-        user = User.query.get(user_id)
+        user = User.query.get(payload.user_id)
         if not user:
             return jsonify({'error': 'Usuário não encontrado'}), 404
         
         # Atualizar dados do usuário
-        if 'nome_completo' in data:
-            user.nome_completo = data['nome_completo']
-        if 'celular' in data:
-            user.celular = data['celular']
-        if 'carteira_sus' in data:
-            user.carteira_sus = data['carteira_sus']
+        if payload.nome_completo is not UNSET:
+            user.nome_completo = payload.nome_completo
+        if payload.celular is not UNSET:
+            user.celular = payload.celular
+        if payload.carteira_sus is not UNSET:
+            user.carteira_sus = payload.carteira_sus
         
         db.session.commit()
+        forget_user(user.id)
         
         return jsonify({
             'success': True,
@@ -108,15 +105,15 @@ def update_user():
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/user/<user_id>', methods=['GET'])
+@validate(path=schemas.USER_ID)
+@read_replica
 def get_user(user_id):
     try:
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({'error': 'Usuário não encontrado'}), 404
-        
-        return jsonify({
-            'success': True,
-            'user': {
+        def load():
+            user = User.query.get(user_id)
+            if not user:
+                return False
+            return {
                 'id': user.id,
                 'cpf': user.cpf,
                 'nome_completo': user.nome_completo,
@@ -124,6 +121,14 @@ def get_user(user_id):
                 'carteira_sus': user.carteira_sus,
                 'data_nascimento': user.data_nascimento.isoformat()
             }
+        
+        user = cache.get_or_set(USERS, f'{user_id}:perfil', load)
+        if user is False:
+            return jsonify({'error': 'Usuário não encontrado'}), 404
+        
+        return jsonify({
+            'success': True,
+            'user': user
         })
     
     except Exception as e:
@@ -0,0 +1,62 @@
+# Arquivamento do histórico de slots e agendamentos
+
+from datetime import date, datetime
+
+from sqlalchemy import select, insert, delete, literal, and_
+
+from src.models.database import db, Appointment, AppointmentArchive, Slot, SlotArchive
+from src.utils.sharding import shard_keys, using
+
+FINISHED_STATUSES = ('Realizado', 'Cancelado', 'Faltou')
+
+def _move_rows(model, archive_model, condition, batch_size, archived_at):
+    """Copia para a tabela de arquivo e apaga da tabela ativa, em lotes"""
+    table = model.__table__
+    columns = [column.name for column in table.columns]
+    total = 0
+
+    while True:
+        ids = db.session.execute(
+            select(table.c.id).where(condition).limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        db.session.execute(
+            insert(archive_model.__table__).from_select(
+                columns + ['archived_at'],
+                select(*[table.c[name] for name in columns], literal(archived_at))
+                .where(table.c.id.in_(ids))
+            )
+        )
+        db.session.execute(delete(table).where(table.c.id.in_(ids)))
+        db.session.commit()
+        total += len(ids)
+
+    return total
+
+def archive_history(cutoff=None, batch_size=5000):
+    """
+    Move para as tabelas *_archive os slots com data anterior a cutoff
+    e os agendamentos Realizado/Cancelado/Faltou anteriores a cutoff.
+    Cada lote é uma transação curta, então o job pode ser interrompido
+    e executado novamente sem perder dados.
+    """
+    cutoff = cutoff or date.today()
+    archived_at = datetime.utcnow()
+    appointments = slots = 0
+
+    # Ativos e arquivo ficam no mesmo shard; cada shard é arquivado por vez
+    for shard_key in shard_keys():
+        with using(shard_key):
+            appointments += _move_rows(
+                Appointment, AppointmentArchive,
+                and_(
+                    Appointment.data_agendamento < cutoff,
+                    Appointment.status.in_(FINISHED_STATUSES)
+                ),
+                batch_size, archived_at
+            )
+            slots += _move_rows(Slot, SlotArchive, Slot.data < cutoff, batch_size, archived_at)
+
+    return {'appointments': appointments, 'slots': slots}
@@ -0,0 +1,139 @@
+# Estrutura mínima de uma aplicação ASGI (rotas, requisição JSON e CORS),
+# usada pela API assíncrona de agendamento em src/asgi.py
+
+import json
+import re
+from urllib.parse import parse_qs
+
+from src.utils.capacity import WindowBusy
+from src.utils.schemas import ValidationError
+
+# Corpo máximo aceito numa requisição
+MAX_BODY_BYTES = 1024 * 1024
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type, Idempotency-Key, X-Admin-Id'),
+    (b'access-control-allow-methods', b'GET, POST, PUT, OPTIONS'),
+]
+
+class HTTPError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+class Request:
+    def __init__(self, scope, body, sessionmaker):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope['headers']}
+        self.args = {k: v[0] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.body = body
+        self._sessionmaker = sessionmaker
+
+    def get_json(self):
+        try:
+            data = json.loads(self.body) if self.body else None
+        except ValueError:
+            raise HTTPError('JSON inválido')
+        if not isinstance(data, dict):
+            raise HTTPError('JSON inválido')
+        return data
+
+    def session(self):
+        """Nova AsyncSession; usar com 'async with'"""
+        return self._sessionmaker()
+
+class Router:
+    """
+    Rotas no formato do Flask ('/user/<user_id>'); os handlers devolvem
+    dict, (dict, status) ou (dict, status, cabeçalhos)
+    """
+
+    def __init__(self):
+        self.routes = []
+
+    def route(self, path, methods=('GET',)):
+        pattern = re.compile('^' + re.sub(r'<(\w+)>', r'(?P<\1>[^/]+)', path) + '$')
+
+        def decorator(handler):
+            self.routes.append((pattern, set(methods), handler))
+            return handler
+        return decorator
+
+    def match(self, method, path):
+        allowed = False
+        for pattern, methods, handler in self.routes:
+            found = pattern.match(path)
+            if found:
+                if method in methods:
+                    return handler, found.groupdict()
+                allowed = True
+        raise HTTPError('Método não permitido' if allowed else 'Não encontrado', 405 if allowed else 404)
+
+class ASGIApp:
+    def __init__(self, router, sessionmaker, on_shutdown=()):
+        self.router = router
+        self.sessionmaker = sessionmaker
+        self.on_shutdown = list(on_shutdown)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for callback in self.on_shutdown:
+                    await callback()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                raise HTTPError('Requisição muito grande', 413)
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def _http(self, scope, receive, send):
+        if scope['method'] == 'OPTIONS':
+            await self._send(send, 204, None)
+            return
+
+        try:
+            handler, params = self.router.match(scope['method'], scope['path'])
+            body = await self._read_body(receive)
+            if body is None:
+                return
+            result = await handler(Request(scope, body, self.sessionmaker), **params)
+        except (HTTPError, ValidationError, WindowBusy) as e:
+            result = {'error': e.message}, e.status
+        except Exception as e:
+            result = {'error': str(e)}, 500
+
+        if not isinstance(result, tuple):
+            result = (result, 200)
+        payload, status, *headers = result
+        await self._send(send, status, payload, *headers)
+
+    async def _send(self, send, status, payload, extra_headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode() if payload is not None else b''
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        headers += [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in (extra_headers or {}).items()]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers + CORS_HEADERS})
+        await send({'type': 'http.response.body', 'body': body})
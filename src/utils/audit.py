@@ -0,0 +1,167 @@
+# Log de auditoria assíncrono: eventos vão para um buffer em memória e uma
+# thread de fundo grava em lotes na tabela audit_events ou em arquivos NDJSON
+
+import atexit
+import json
+import logging
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+from src.models.database import db, AuditEvent
+
+logger = logging.getLogger(__name__)
+
+class TableSink:
+    """Grava cada lote na tabela audit_events numa única transação (executemany)"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def write(self, events):
+        with self.app.app_context():
+            rows = [
+                dict(event, payload=json.dumps(event['payload'], ensure_ascii=False, default=str) if event['payload'] else None)
+                for event in events
+            ]
+            with db.engine.begin() as conn:
+                conn.execute(AuditEvent.__table__.insert(), rows)
+
+class NDJSONSink:
+    """Grava os lotes em segmentos NDJSON, abrindo um novo a cada max_bytes"""
+
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.path = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment(self):
+        if self.path is None or os.path.getsize(self.path) >= self.max_bytes:
+            stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')
+            self.path = os.path.join(self.directory, f'audit-{stamp}.ndjson')
+        return self.path
+
+    def write(self, events):
+        lines = []
+        for event in events:
+            line = dict(event, created_at=event['created_at'].isoformat())
+            lines.append(json.dumps(line, ensure_ascii=False, default=str, separators=(',', ':')))
+        with open(self._segment(), 'a', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+class AuditLog:
+    """
+    record() só acrescenta o evento num deque de tamanho fixo, sem I/O
+    no caminho da requisição. Se a gravação não acompanhar, o buffer
+    descarta os eventos mais antigos e conta em 'descartados'. Um lote
+    cuja gravação falhou fica à parte (no máximo batch_size eventos) e é
+    regravado antes do buffer, sem ocupar o lugar dos eventos novos.
+    """
+
+    def __init__(self, capacity=100000, batch_size=1000, flush_interval=1.0):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sink = None
+        self.buffer = deque(maxlen=capacity)
+        self._retry = []
+        self.stats = {'registrados': 0, 'gravados': 0, 'descartados': 0, 'falhas': 0}
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def configure(self, sink, capacity=None, batch_size=None, flush_interval=None):
+        self.sink = sink
+        if capacity and capacity != self.capacity:
+            self.capacity = capacity
+            self.buffer = deque(self.buffer, maxlen=capacity)
+        self.batch_size = batch_size or self.batch_size
+        self.flush_interval = flush_interval or self.flush_interval
+
+    def record(self, event):
+        if self.sink is None:
+            return
+        if len(self.buffer) == self.capacity:
+            self.stats['descartados'] += 1
+        self.buffer.append(event)
+        self.stats['registrados'] += 1
+        self._ensure_thread()
+        if len(self.buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def _ensure_thread(self):
+        # Após um fork (workers do gunicorn) a thread do processo pai não existe no filho
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._thread = threading.Thread(target=self._run, name='audit-flush', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Grava tudo o que está no buffer; devolve quantos eventos foram gravados"""
+        written = 0
+        with self._flush_lock:
+            while self._retry or self.buffer:
+                batch = self._retry
+                while self.buffer and len(batch) < self.batch_size:
+                    batch.append(self.buffer.popleft())
+                try:
+                    self.sink.write(batch)
+                except Exception:
+                    logger.exception('Falha ao gravar %d eventos de auditoria', len(batch))
+                    self.stats['falhas'] += 1
+                    # O lote espera a próxima tentativa fora do buffer: devolvê-lo
+                    # ao deque cheio descartaria, sem contar, os eventos mais novos
+                    self._retry = batch
+                    break
+                self._retry = []
+                written += len(batch)
+                self.stats['gravados'] += len(batch)
+        return written
+
+audit_log = AuditLog()
+
+def init_app(app):
+    """
+    Configura o destino pelo app.config:
+    AUDIT_SINK ('table' ou 'ndjson'), AUDIT_DIR, AUDIT_BUFFER_SIZE,
+    AUDIT_BATCH_SIZE e AUDIT_FLUSH_INTERVAL (segundos).
+    """
+    if app.config.get('AUDIT_SINK', 'table') == 'ndjson':
+        sink = NDJSONSink(app.config.get('AUDIT_DIR', os.path.join(app.instance_path, 'audit')))
+    else:
+        sink = TableSink(app)
+
+    audit_log.configure(
+        sink,
+        capacity=app.config.get('AUDIT_BUFFER_SIZE'),
+        batch_size=app.config.get('AUDIT_BATCH_SIZE'),
+        flush_interval=app.config.get('AUDIT_FLUSH_INTERVAL')
+    )
+    atexit.register(audit_log.flush)
+
+def record_event(action, entity, entity_id=None, actor_type=None, actor_id=None, ubs_id=None, **payload):
+    """Registra um evento; chamar depois do commit da operação auditada"""
+    audit_log.record({
+        'created_at': datetime.utcnow(),
+        'action': action,
+        'actor_type': actor_type,
+        'actor_id': actor_id,
+        'entity': entity,
+        'entity_id': entity_id,
+        'ubs_id': ubs_id,
+        # A serialização do payload fica para a thread de gravação
+        'payload': payload or None
+    })
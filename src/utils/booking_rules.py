@@ -0,0 +1,359 @@
+# Regras de agendamento por usuário (uma vaga por data, limite de agendamentos
+# em aberto, intervalo mínimo por serviço, carência depois de faltas),
+# avaliadas sobre os contadores de UserBookingState em vez de consultas em
+# appointments: cada agendamento lê e grava uma única linha pela chave primária.
+
+import struct
+import uuid
+from datetime import date, timedelta
+
+from sqlalchemy import select, update, delete, and_, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.models.database import db, Appointment, AppointmentArchive, User, UserBookingState
+from src.utils.sharding import shard_keys, using
+
+# Quantas vezes a gravação é tentada quando outra requisição altera o mesmo usuário
+MAX_RETRIES = 5
+
+# Agendamento não cancelado: (data ordinal, aberto, service_id em 16 bytes)
+ENTRY = struct.Struct('<IB16s')
+# Falta: data ordinal
+FALTA = struct.Struct('<I')
+
+def service_key(service_id):
+    try:
+        return uuid.UUID(str(service_id)).bytes
+    except ValueError:
+        return None
+
+class BookingState:
+    """Contadores de um usuário; version None enquanto não há linha na tabela"""
+
+    def __init__(self, entries=(), faltas=(), version=None):
+        self.entries = [tuple(entry) for entry in entries]
+        self.faltas = list(faltas)
+        self.version = version
+
+    @classmethod
+    def from_row(cls, row):
+        if row is None:
+            return cls()
+        return cls(
+            ENTRY.iter_unpack(row.agendamentos),
+            [ordinal for (ordinal,) in FALTA.iter_unpack(row.faltas)],
+            row.version
+        )
+
+    def open_dates(self, hoje):
+        """Datas dos agendamentos Confirmado de hoje em diante"""
+        return [ordinal for ordinal, aberto, _ in self.entries if aberto and ordinal >= hoje.toordinal()]
+
+    def dates_for(self, service):
+        return [ordinal for ordinal, _, key in self.entries if key == service]
+
+    def add(self, service, data):
+        self.entries.append((data.toordinal(), 1, service))
+
+    def remove(self, service, data):
+        entry = next((e for e in self.entries if e[0] == data.toordinal() and e[2] == service), None)
+        if entry is not None:
+            self.entries.remove(entry)
+
+    def finish(self, service, data, status):
+        """Realizado/Faltou: deixa de estar em aberto; a falta passa a contar para a carência"""
+        ordinal = data.toordinal()
+        self.entries = [
+            (o, 0, key) if o == ordinal and key == service else (o, aberto, key)
+            for o, aberto, key in self.entries
+        ]
+        if status == 'Faltou':
+            if ordinal not in self.faltas:
+                self.faltas.append(ordinal)
+        elif ordinal in self.faltas:
+            self.faltas.remove(ordinal)
+
+    def prune(self, hoje, retencao_dias):
+        """Descarta o que já não influencia nenhuma regra"""
+        limite = hoje.toordinal() - retencao_dias
+        self.entries = [entry for entry in self.entries if entry[0] >= limite]
+        self.faltas = [ordinal for ordinal in self.faltas if ordinal >= limite]
+
+    def values(self):
+        return {
+            'agendamentos': b''.join(ENTRY.pack(*entry) for entry in sorted(self.entries)),
+            'faltas': b''.join(FALTA.pack(ordinal) for ordinal in sorted(self.faltas))
+        }
+
+class Rule:
+    # Quantos dias de histórico a regra consulta (define o que os contadores guardam)
+    janela_dias = 0
+
+    def check(self, state, service, data, hoje):
+        """Mensagem de recusa, ou None se o agendamento é permitido"""
+        raise NotImplementedError
+
+class UmPorData(Rule):
+    def check(self, state, service, data, hoje):
+        if data.toordinal() in state.open_dates(hoje):
+            return 'Você já tem um agendamento para esta data'
+
+class MaximoAbertos(Rule):
+    def __init__(self, limite):
+        self.limite = limite
+
+    def check(self, state, service, data, hoje):
+        if len(state.open_dates(hoje)) >= self.limite:
+            return f'Limite de {self.limite} agendamentos em aberto atingido'
+
+class IntervaloPorServico(Rule):
+    def __init__(self, dias):
+        self.dias = dias
+        self.janela_dias = dias
+
+    def check(self, state, service, data, hoje):
+        ordinal = data.toordinal()
+        if any(abs(ordinal - other) < self.dias for other in state.dates_for(service)):
+            return f'Já existe um agendamento deste serviço num intervalo de {self.dias} dias'
+
+class CarenciaAposFaltas(Rule):
+    """Com limite faltas nos últimos janela dias, novos agendamentos ficam bloqueados por carencia dias"""
+
+    def __init__(self, limite, janela, carencia):
+        self.limite = limite
+        self.janela = janela
+        self.carencia = carencia
+        self.janela_dias = max(janela, carencia)
+
+    def check(self, state, service, data, hoje):
+        recentes = [ordinal for ordinal in state.faltas if ordinal >= hoje.toordinal() - self.janela]
+        if len(recentes) >= self.limite:
+            liberado = date.fromordinal(max(recentes) + self.carencia)
+            if hoje < liberado:
+                return f'Novos agendamentos bloqueados até {liberado.strftime("%d/%m/%Y")} por faltas anteriores'
+
+def default_rules(config=None):
+    """Regras a partir do app.config; limite 0 desliga a regra"""
+    config = config or {}
+    rules = [UmPorData()]
+    if int(config.get('BOOKING_MAX_ABERTOS', 3)):
+        rules.append(MaximoAbertos(int(config.get('BOOKING_MAX_ABERTOS', 3))))
+    if int(config.get('BOOKING_INTERVALO_SERVICO_DIAS', 30)):
+        rules.append(IntervaloPorServico(int(config.get('BOOKING_INTERVALO_SERVICO_DIAS', 30))))
+    if int(config.get('BOOKING_FALTAS_LIMITE', 2)):
+        rules.append(CarenciaAposFaltas(
+            int(config.get('BOOKING_FALTAS_LIMITE', 2)),
+            int(config.get('BOOKING_FALTAS_JANELA_DIAS', 90)),
+            int(config.get('BOOKING_CARENCIA_DIAS', 30))
+        ))
+    return rules
+
+class BookingRules:
+    def __init__(self, rules=None):
+        self.configure(rules if rules is not None else default_rules())
+
+    def configure(self, rules):
+        self.rules = list(rules)
+        self.retencao_dias = max([rule.janela_dias for rule in self.rules] + [0])
+
+    def evaluate(self, state, service, data, hoje=None):
+        hoje = hoje or date.today()
+        for rule in self.rules:
+            refusal = rule.check(state, service, data, hoje)
+            if refusal:
+                return refusal
+        return None
+
+booking_rules = BookingRules()
+
+# Alterações nos contadores: funções que recebem o BookingState, o modificam
+# e devolvem uma mensagem de recusa ou None
+
+def booking(service_id, data):
+    service = service_key(service_id)
+
+    def change(state):
+        if service is None:
+            return 'Serviço inválido'
+        refusal = booking_rules.evaluate(state, service, data)
+        if refusal is None:
+            state.add(service, data)
+        return refusal
+    return change
+
+def cancellation(service_id, data):
+    def change(state):
+        state.remove(service_key(service_id), data)
+    return change
+
+def rescheduling(service_id, data, nova_data):
+    """Remarcação feita pela UBS: move o agendamento sem avaliar as regras"""
+    def change(state):
+        service = service_key(service_id)
+        state.remove(service, data)
+        state.add(service, nova_data)
+    return change
+
+def completion(service_id, data, status):
+    def change(state):
+        state.finish(service_key(service_id), data, status)
+    return change
+
+def state_query(user_id):
+    return select(
+        UserBookingState.agendamentos, UserBookingState.faltas, UserBookingState.version
+    ).where(UserBookingState.user_id == user_id)
+
+def save_statement(user_id, state, dialect_name):
+    """
+    INSERT (se o usuário ainda não tem linha) ou UPDATE válido só se a
+    linha não mudou desde a leitura; em ambos, rowcount 0 indica conflito.
+    """
+    state.prune(date.today(), booking_rules.retencao_dias)
+    values = state.values()
+    if state.version is None:
+        dialect = postgresql if dialect_name == 'postgresql' else sqlite
+        return (
+            dialect.insert(UserBookingState)
+            .values(user_id=user_id, version=0, **values)
+            .on_conflict_do_nothing(index_elements=['user_id'])
+        )
+    return (
+        update(UserBookingState)
+        .where(and_(UserBookingState.user_id == user_id, UserBookingState.version == state.version))
+        .values(version=state.version + 1, **values)
+    )
+
+def apply_change(user_id, change):
+    """
+    Aplica change aos contadores do usuário na transação atual (sem
+    commit), com controle otimista pela coluna version. Retorna a
+    mensagem de recusa de change, ou None.
+    """
+    dialect_name = db.engine.dialect.name
+    for _ in range(MAX_RETRIES):
+        state = BookingState.from_row(db.session.execute(state_query(user_id)).first())
+        refusal = change(state)
+        if refusal:
+            return refusal
+        if db.session.execute(save_statement(user_id, state, dialect_name)).rowcount:
+            return None
+
+    raise RuntimeError('Não foi possível atualizar os contadores do usuário: muitas alterações simultâneas')
+
+def apply_changes(changes, batch_size=1000):
+    """
+    apply_change em lote, para as operações em massa: changes é um dict
+    user_id -> lista de alterações (que não recusam). Lê os contadores de
+    cada lote de usuários numa consulta, travando as linhas, e grava com
+    um único UPDATE executemany; quem ainda não tem linha passa por
+    apply_change. Gera (usuários processados, total) a cada lote.
+    """
+    table = UserBookingState.__table__
+    statement = (
+        update(table)
+        .where(table.c.user_id == bindparam('b_user_id'))
+        .values(
+            agendamentos=bindparam('b_agendamentos'),
+            faltas=bindparam('b_faltas'),
+            version=table.c.version + 1
+        )
+    )
+    hoje = date.today()
+    user_ids = list(changes)
+
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        rows = {
+            row.user_id: row for row in db.session.execute(
+                select(UserBookingState.user_id, UserBookingState.agendamentos,
+                       UserBookingState.faltas, UserBookingState.version)
+                .where(UserBookingState.user_id.in_(batch))
+                .with_for_update()
+            )
+        }
+
+        params = []
+        for user_id in batch:
+            if user_id not in rows:
+                for change in changes[user_id]:
+                    apply_change(user_id, change)
+                continue
+            state = BookingState.from_row(rows[user_id])
+            for change in changes[user_id]:
+                change(state)
+            state.prune(hoje, booking_rules.retencao_dias)
+            values = state.values()
+            params.append({
+                'b_user_id': user_id,
+                'b_agendamentos': values['agendamentos'],
+                'b_faltas': values['faltas']
+            })
+        if params:
+            db.session.execute(statement, params)
+
+        yield start + len(batch), len(user_ids)
+
+def rebuild_states(batch_size=2000, hoje=None):
+    """
+    Recalcula os contadores de todos os usuários a partir de appointments
+    e appointments_archive (na implantação e pela reconciliação). Cada
+    lote de usuários é uma transação; rodar fora do horário de pico, já
+    que um agendamento feito durante o recálculo do seu lote pode ficar
+    de fora até a próxima execução.
+    """
+    hoje = hoje or date.today()
+    inicio = hoje - timedelta(days=booking_rules.retencao_dias)
+    after_id = None
+    total = 0
+
+    while True:
+        page = [] if after_id is None else [User.id > after_id]
+        user_ids = db.session.execute(
+            select(User.id).where(*page).order_by(User.id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            break
+        after_id = user_ids[-1]
+
+        # Os agendamentos de um usuário podem estar em vários shards, e os
+        # finalizados podem já ter sido arquivados (faltas e intervalos contam)
+        states = {}
+        for shard_key in shard_keys():
+            with using(shard_key):
+                rows = [
+                    row
+                    for model in (Appointment, AppointmentArchive)
+                    for row in db.session.execute(
+                        select(model.user_id, model.service_id, model.data_agendamento, model.status)
+                        .where(
+                            model.user_id.in_(user_ids),
+                            model.data_agendamento >= inicio,
+                            model.status != 'Cancelado'
+                        )
+                    )
+                ]
+            for user_id, service_id, data, status in rows:
+                state = states.setdefault(user_id, BookingState())
+                service = service_key(service_id)
+                state.add(service, data)
+                if status != 'Confirmado':
+                    state.finish(service, data, status)
+
+        db.session.execute(delete(UserBookingState).where(UserBookingState.user_id.in_(user_ids)))
+        if states:
+            db.session.execute(
+                UserBookingState.__table__.insert(),
+                [dict(user_id=user_id, version=0, **state.values()) for user_id, state in states.items()]
+            )
+        db.session.commit()
+        total += len(states)
+
+    return total
+
+def init_app(app):
+    """
+    Regras pelo app.config: BOOKING_MAX_ABERTOS (3), BOOKING_INTERVALO_SERVICO_DIAS (30),
+    BOOKING_FALTAS_LIMITE (2), BOOKING_FALTAS_JANELA_DIAS (90) e BOOKING_CARENCIA_DIAS (30).
+    """
+    booking_rules.configure(default_rules(app.config))
@@ -0,0 +1,499 @@
+# Cancelamento e remarcação em massa dos agendamentos de uma UBS num dia
+# (queda de energia, greve): agendamentos e vagas são alterados com UPDATEs
+# por conjunto numa única transação, os cidadãos são avisados em lotes pelo
+# provedor de notificações e o progresso fica no cache, para que qualquer
+# worker responda à consulta de andamento.
+
+import asyncio
+import json
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from flask import current_app, g
+from sqlalchemy import func, select, update
+
+from src.models.database import db, Appointment, BulkOperation, DayCapacity, Slot, User, UBS, Service
+from src.utils.audit import record_event
+from src.utils.booking_rules import apply_changes, cancellation, rescheduling
+from src.utils.cache import cache, USERS, ubs_namespace, forget_user
+from src.utils.capacity import slot_delta_statement, pack, unpack, parse_horario, format_horario, turno_for
+from src.utils.notifications import dispatch, get_provider, normalize_phone
+from src.utils.sharding import route_ubs, using
+
+ACOES = ('cancelar', 'remarcar')
+TURNOS = ('Manhã', 'Tarde')
+
+# Status em que o progresso vem do cache e não da tabela (o índice parcial
+# ux_bulk_operations_ubs_data_running usa a mesma lista)
+RUNNING_STATUSES = ('pendente', 'executando', 'notificando')
+
+# Alterações gravadas, mas parte dos avisos não foi confirmada pelo provedor;
+# os pendentes são reenviados por start_resend
+PARTIAL_STATUS = 'concluida_com_falhas'
+
+# Operação em andamento sem sinal do worker há mais que isso (reinício ou queda
+# do processo) é dada como interrompida. Antes da gravação ela é marcada como
+# falhou e, como só afeta agendamentos Confirmado, pode ser criada de novo;
+# durante os avisos fica concluida_com_falhas, com os avisos a reenviar
+STALE_AFTER = timedelta(minutes=30)
+
+PROGRESS_NAMESPACE = 'bulk'
+PROGRESS_TTL = 24 * 3600
+
+BATCH_SIZE = 1000
+
+# Acima disso invalida o namespace de usuários inteiro em vez de remover chave por chave
+MAX_USER_KEYS = 1000
+
+CANCEL_TEMPLATE = (
+    'Olá, {nome}! Seu agendamento de {servico} em {data}, {quando}, na {ubs} foi cancelado{motivo}. '
+    'Agende novamente pelo app.'
+)
+MOVE_TEMPLATE = (
+    'Olá, {nome}! Seu agendamento de {servico} na {ubs} foi remarcado de {data} '
+    'para {nova_data}, {quando}{motivo}.'
+)
+
+def split_turnos(operation):
+    return operation.turnos.split(',') if operation.turnos else None
+
+def _progress(operation_id, **values):
+    progress = cache.get(PROGRESS_NAMESPACE, operation_id) or {}
+    progress.update(values)
+    cache.set(PROGRESS_NAMESPACE, operation_id, progress, ttl=PROGRESS_TTL)
+
+def fail_stale(now=None):
+    """Encerra as operações em andamento abandonadas; retorna quantas"""
+    now = now or datetime.utcnow()
+    stale = func.coalesce(BulkOperation.heartbeat_at, BulkOperation.created_at) < now - STALE_AFTER
+    failed = db.session.execute(
+        update(BulkOperation)
+        .where(BulkOperation.status.in_(('pendente', 'executando')), stale)
+        .values(status='falhou', erro='Operação interrompida: o worker parou de responder', finished_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    partial = db.session.execute(
+        update(BulkOperation)
+        .where(BulkOperation.status == 'notificando', stale)
+        .values(status=PARTIAL_STATUS, erro='Envio dos avisos interrompido: o worker parou de responder',
+                finished_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    return failed + partial
+
+def _heartbeat(operation_id):
+    db.session.execute(
+        update(BulkOperation).where(BulkOperation.id == operation_id).values(heartbeat_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+def describe(operation):
+    result = {
+        'id': operation.id,
+        'ubs_id': operation.ubs_id,
+        'data': operation.data.isoformat(),
+        'turnos': split_turnos(operation),
+        'acao': operation.acao,
+        'nova_data': operation.nova_data.isoformat() if operation.nova_data else None,
+        'novo_turno': operation.novo_turno,
+        'fechar_vagas': operation.fechar_vagas,
+        'motivo': operation.motivo,
+        'status': operation.status,
+        'total': operation.total,
+        'processados': operation.total if operation.status not in RUNNING_STATUSES else 0,
+        'notificacoes_enfileiradas': operation.notificacoes_enviadas + operation.notificacoes_falhas,
+        'notificacoes_enviadas': operation.notificacoes_enviadas,
+        'notificacoes_falhas': operation.notificacoes_falhas,
+        'sem_celular': operation.sem_celular,
+        'notificacoes_pendentes': len(json.loads(operation.notificacoes_pendentes or '[]')),
+        'erro': operation.erro,
+        'created_at': operation.created_at.isoformat() if operation.created_at else None,
+        'finished_at': operation.finished_at.isoformat() if operation.finished_at else None
+    }
+    if operation.status in RUNNING_STATUSES:
+        result.update(cache.get(PROGRESS_NAMESPACE, operation.id) or {})
+    return result
+
+def _free_slots(operation, turnos, rows):
+    """Vagas do dia afetado: fecha os slots dos turnos ou devolve as vagas dos agendamentos"""
+    if operation.fechar_vagas:
+        conditions = [Slot.ubs_id == operation.ubs_id, Slot.data == operation.data]
+        if turnos:
+            conditions.append(Slot.turno.in_(turnos))
+        db.session.execute(
+            update(Slot).where(*conditions).values(quantidade_disponivel=0)
+            .execution_options(synchronize_session=False)
+        )
+        return
+
+    released = Counter((row.service_id, row.turno) for row in rows if not row.horario)
+    for (service_id, turno), count in released.items():
+        db.session.execute(slot_delta_statement(operation.ubs_id, service_id, operation.data, turno, count))
+
+def _free_windows(operation, turnos, rows):
+    """Mesmo que _free_slots para as janelas de horário (DayCapacity) do dia"""
+    released = Counter((row.service_id, parse_horario(row.horario)) for row in rows if row.horario)
+    if not operation.fechar_vagas and not released:
+        return
+
+    days = db.session.execute(
+        select(
+            DayCapacity.id, DayCapacity.service_id, DayCapacity.inicio_minutos, DayCapacity.intervalo_minutos,
+            DayCapacity.vagas_disponiveis, DayCapacity.vagas_totais
+        )
+        .where(DayCapacity.ubs_id == operation.ubs_id, DayCapacity.data == operation.data)
+        .with_for_update()
+    ).all()
+    for day in days:
+        vagas = unpack(day.vagas_disponiveis)
+        totais = unpack(day.vagas_totais)
+        for i in range(len(vagas)):
+            minuto = day.inicio_minutos + i * day.intervalo_minutos
+            if operation.fechar_vagas:
+                if not turnos or turno_for(minuto) in turnos:
+                    vagas[i] = 0
+            else:
+                vagas[i] = min(totais[i], vagas[i] + released[(day.service_id, minuto)])
+        # Incrementar version faz quem leu o dia antes (capacity._adjust) reler e tentar de novo
+        db.session.execute(
+            update(DayCapacity)
+            .where(DayCapacity.id == day.id)
+            .values(vagas_disponiveis=pack(vagas), disponivel=sum(vagas), version=DayCapacity.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+def _claim_windows(operation, rows):
+    """
+    Ocupa na nova data as janelas (DayCapacity) dos serviços com o dia
+    configurado por horário. Cada agendamento fica no mesmo horário se ainda
+    houver vaga, senão na janela mais livre do seu turno. Devolve os ids por
+    horário e os agendamentos que ficam para os slots por turno.
+    """
+    days = {day.service_id: day for day in db.session.execute(
+        select(
+            DayCapacity.id, DayCapacity.service_id, DayCapacity.inicio_minutos,
+            DayCapacity.intervalo_minutos, DayCapacity.vagas_disponiveis
+        )
+        .where(
+            DayCapacity.ubs_id == operation.ubs_id,
+            DayCapacity.data == operation.nova_data,
+            DayCapacity.service_id.in_({row.service_id for row in rows})
+        )
+        .with_for_update()
+    )}
+
+    vagas_por_dia = {}
+    horarios = defaultdict(list)
+    remaining = []
+    # Quem tinha horário escolhe primeiro, para manter o mesmo horário quando possível
+    for row in sorted(rows, key=lambda row: row.horario is None):
+        day = days.get(row.service_id)
+        if day is None:
+            remaining.append(row)
+            continue
+
+        vagas = vagas_por_dia.setdefault(day.id, unpack(day.vagas_disponiveis))
+        turno = operation.novo_turno or row.turno
+        livres = [
+            i for i in range(len(vagas))
+            if vagas[i] and turno_for(day.inicio_minutos + i * day.intervalo_minutos) == turno
+        ]
+        if not livres:
+            raise ValueError(
+                f'Vagas insuficientes em {operation.nova_data.strftime("%d/%m/%Y")} (turno {turno}) '
+                f'para remarcar os agendamentos'
+            )
+
+        index = None
+        if row.horario:
+            offset = parse_horario(row.horario) - day.inicio_minutos
+            if offset % day.intervalo_minutos == 0:
+                index = offset // day.intervalo_minutos
+        if index not in livres:
+            index = max(livres, key=lambda i: vagas[i])
+
+        vagas[index] -= 1
+        horarios[format_horario(day.inicio_minutos + index * day.intervalo_minutos)].append(row.id)
+
+    for day_id, vagas in vagas_por_dia.items():
+        # Incrementar version faz quem leu o dia antes (capacity._adjust) reler e tentar de novo
+        db.session.execute(
+            update(DayCapacity)
+            .where(DayCapacity.id == day_id)
+            .values(vagas_disponiveis=pack(vagas), disponivel=sum(vagas), version=DayCapacity.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+    return horarios, remaining
+
+def _claim_target(operation, rows, batch_size):
+    """
+    Ocupa na nova data as vagas de todos os agendamentos remarcados: nas
+    janelas de horário quando o serviço tem o dia configurado assim, senão
+    nos slots por serviço e turno
+    """
+    horarios, remaining = _claim_windows(operation, rows)
+    for horario, ids in horarios.items():
+        for start in range(0, len(ids), batch_size):
+            db.session.execute(
+                update(Appointment).where(Appointment.id.in_(ids[start:start + batch_size]))
+                .values(horario=horario)
+                .execution_options(synchronize_session=False)
+            )
+
+    needed = Counter((row.service_id, operation.novo_turno or row.turno) for row in remaining)
+    for (service_id, turno), count in needed.items():
+        statement = slot_delta_statement(operation.ubs_id, service_id, operation.nova_data, turno, -count)
+        if not db.session.execute(statement).rowcount:
+            raise ValueError(
+                f'Vagas insuficientes em {operation.nova_data.strftime("%d/%m/%Y")} (turno {turno}) '
+                f'para remarcar {count} agendamentos'
+            )
+
+def _apply(operation, batch_size):
+    """
+    Altera agendamentos, vagas e contadores numa única transação e
+    devolve os agendamentos afetados. Em caso de erro nada é alterado.
+    """
+    turnos = split_turnos(operation)
+    conditions = [
+        Appointment.ubs_id == operation.ubs_id,
+        Appointment.data_agendamento == operation.data,
+        Appointment.status == 'Confirmado'
+    ]
+    if turnos:
+        conditions.append(Appointment.turno.in_(turnos))
+
+    rows = db.session.execute(
+        select(Appointment.id, Appointment.user_id, Appointment.service_id, Appointment.turno, Appointment.horario)
+        .where(*conditions)
+        .with_for_update()
+    ).all()
+    _progress(operation.id, status='executando', total=len(rows), processados=0)
+
+    if operation.acao == 'cancelar':
+        values = {'status': 'Cancelado'}
+    else:
+        values = {'data_agendamento': operation.nova_data, 'horario': None}
+        if operation.novo_turno:
+            values['turno'] = operation.novo_turno
+    updated = db.session.execute(
+        update(Appointment).where(*conditions).values(**values)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if updated != len(rows):
+        raise RuntimeError('Os agendamentos mudaram durante a operação; execute novamente')
+
+    _free_slots(operation, turnos, rows)
+    _free_windows(operation, turnos, rows)
+    if operation.acao == 'remarcar':
+        _claim_target(operation, rows, batch_size)
+
+    changes = defaultdict(list)
+    for row in rows:
+        if operation.acao == 'cancelar':
+            changes[row.user_id].append(cancellation(row.service_id, operation.data))
+        else:
+            changes[row.user_id].append(rescheduling(row.service_id, operation.data, operation.nova_data))
+    for done, users in apply_changes(changes, batch_size):
+        _progress(operation.id, processados=round(len(rows) * done / users))
+
+    operation.status = 'notificando'
+    operation.total = len(rows)
+    operation.notificacoes_pendentes = json.dumps([row.id for row in rows])
+    operation.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+    return rows
+
+def render_message(operation, ubs_nome, row):
+    nome = (row.nome_completo or '').split(' ')[0] or 'cidadão'
+    quando = f'às {row.horario}' if row.horario else f'turno da {row.turno.lower()}'
+    motivo = f' ({operation.motivo})' if operation.motivo else ''
+    template = CANCEL_TEMPLATE if operation.acao == 'cancelar' else MOVE_TEMPLATE
+    return template.format(
+        nome=nome,
+        servico=row.servico,
+        data=operation.data.strftime('%d/%m/%Y'),
+        nova_data=row.data_agendamento.strftime('%d/%m/%Y'),
+        quando=quando,
+        ubs=ubs_nome,
+        motivo=motivo
+    )
+
+def _fetch_in_context(app, shard_key, operation_id, ids):
+    with app.app_context():
+        try:
+            _heartbeat(operation_id)
+            # Agendamentos no shard da UBS; cidadãos e serviços no banco principal
+            with using(shard_key):
+                appointments = db.session.execute(
+                    select(
+                        Appointment.id, Appointment.user_id, Appointment.service_id,
+                        Appointment.data_agendamento, Appointment.turno, Appointment.horario
+                    )
+                    .where(Appointment.id.in_(ids))
+                ).all()
+            users = {row.id: row for row in db.session.execute(
+                select(User.id, User.nome_completo, User.celular)
+                .where(User.id.in_({row.user_id for row in appointments}))
+            )}
+            services = dict(db.session.execute(
+                select(Service.id, Service.nome).where(Service.id.in_({row.service_id for row in appointments}))
+            ).all())
+            return [
+                SimpleNamespace(
+                    id=row.id, data_agendamento=row.data_agendamento, turno=row.turno, horario=row.horario,
+                    nome_completo=users[row.user_id].nome_completo, celular=users[row.user_id].celular,
+                    servico=services[row.service_id]
+                )
+                for row in appointments
+            ]
+        finally:
+            db.session.remove()
+
+async def _notification_batches(app, shard_key, operation, ubs_nome, ids, batch_size, counters):
+    for start in range(0, len(ids), batch_size):
+        # Consulta síncrona numa thread, para não travar os envios em andamento
+        rows = await asyncio.to_thread(_fetch_in_context, app, shard_key, operation.id, ids[start:start + batch_size])
+        messages = []
+        for row in rows:
+            phone = normalize_phone(row.celular)
+            if phone is None:
+                counters['sem_celular'] += 1
+                continue
+            messages.append((phone, render_message(operation, ubs_nome, row), row.id))
+        counters['notificacoes_enfileiradas'] += len(messages)
+        _progress(operation.id, **counters)
+        yield messages
+
+def _notify(operation, ids, provider, batch_size):
+    app = current_app._get_current_object()
+    ubs_nome = db.session.get(UBS, operation.ubs_id).nome
+    counters = {'sem_celular': 0, 'notificacoes_enfileiradas': 0}
+    stats = asyncio.run(dispatch(
+        _notification_batches(app, g.get('shard_key'), operation, ubs_nome, ids, batch_size, counters),
+        provider
+    ))
+    return counters, stats
+
+def _send_notifications(operation, ids, provider, batch_size):
+    """
+    Avisa os cidadãos dos agendamentos ids. Os envios não confirmados pelo
+    provedor ficam em notificacoes_pendentes e a operação termina como
+    concluida_com_falhas, para que possam ser reenviados.
+    """
+    provider = provider or get_provider(current_app.config.get('NOTIFICATION_PROVIDER', 'fake'))
+    try:
+        counters, stats = _notify(operation, ids, provider, batch_size)
+        operation.sem_celular += counters['sem_celular']
+        operation.notificacoes_enviadas += stats.enviadas
+        operation.notificacoes_falhas = len(stats.nao_enviadas)
+        operation.notificacoes_pendentes = json.dumps(stats.nao_enviadas) if stats.nao_enviadas else None
+        operation.status = PARTIAL_STATUS if stats.nao_enviadas else 'concluida'
+        operation.erro = None
+    except Exception as e:
+        # As alterações já foram gravadas; notificacoes_pendentes continua com
+        # todos os ids desta rodada (quem já recebeu pode receber de novo)
+        operation.status = PARTIAL_STATUS
+        operation.erro = f'Falha ao notificar: {e}'
+    operation.finished_at = datetime.utcnow()
+    db.session.commit()
+    _progress(operation.id, status=operation.status)
+    return describe(operation)
+
+def run_operation(operation_id, provider=None, batch_size=BATCH_SIZE):
+    """
+    Executa a operação: alterações numa transação, depois os avisos aos
+    cidadãos. Só agendamentos Confirmado são afetados, então uma operação
+    interrompida (ex.: reinício do worker) pode ser criada de novo.
+    """
+    _heartbeat(operation_id)
+    operation = db.session.get(BulkOperation, operation_id)
+    try:
+        # Agendamentos, slots e janelas da UBS ficam no shard da sua cidade
+        if not route_ubs(operation.ubs_id):
+            raise ValueError('UBS não encontrada')
+        rows = _apply(operation, batch_size)
+    except Exception as e:
+        db.session.rollback()
+        operation = db.session.get(BulkOperation, operation_id)
+        operation.status = 'falhou'
+        operation.erro = str(e)
+        operation.finished_at = datetime.utcnow()
+        db.session.commit()
+        _progress(operation_id, status='falhou', erro=str(e))
+        return describe(operation)
+
+    _progress(operation_id, status='notificando', processados=len(rows))
+    cache.invalidate(ubs_namespace(operation.ubs_id))
+    user_ids = {row.user_id for row in rows}
+    if len(user_ids) > MAX_USER_KEYS:
+        cache.invalidate(USERS)
+    else:
+        for user_id in user_ids:
+            forget_user(user_id)
+    record_event(
+        f'appointment.bulk_{operation.acao}', 'bulk_operation', operation.id,
+        actor_type='admin', actor_id=operation.admin_id, ubs_id=operation.ubs_id,
+        data=operation.data.isoformat(), turnos=operation.turnos, total=len(rows),
+        nova_data=operation.nova_data.isoformat() if operation.nova_data else None,
+        motivo=operation.motivo
+    )
+
+    return _send_notifications(operation, [row.id for row in rows], provider, batch_size)
+
+def resend_operation(operation_id, provider=None, batch_size=BATCH_SIZE):
+    """Reenvia os avisos pendentes de uma operação concluida_com_falhas (já marcada notificando)"""
+    _heartbeat(operation_id)
+    operation = db.session.get(BulkOperation, operation_id)
+    route_ubs(operation.ubs_id)
+    ids = json.loads(operation.notificacoes_pendentes or '[]')
+    _progress(operation_id, status='notificando', total=len(ids), processados=len(ids),
+              sem_celular=0, notificacoes_enfileiradas=0)
+    return _send_notifications(operation, ids, provider, batch_size)
+
+def _run_in_context(app, operation_id, target=None):
+    with app.app_context():
+        try:
+            (target or run_operation)(operation_id)
+        finally:
+            db.session.remove()
+
+def start_operation(operation_id):
+    """Executa a operação numa thread do worker; o andamento é consultado por describe()"""
+    app = current_app._get_current_object()
+    _progress(operation_id, status='pendente')
+    threading.Thread(
+        target=_run_in_context, args=(app, operation_id),
+        name=f'bulk-{operation_id}', daemon=True
+    ).start()
+
+def start_resend(operation_id):
+    """
+    Passa a operação de concluida_com_falhas para notificando e reenvia os
+    avisos pendentes numa thread do worker. False se ela não está nesse status
+    (ex.: outro reenvio em andamento).
+    """
+    claimed = db.session.execute(
+        update(BulkOperation)
+        .where(
+            BulkOperation.id == operation_id,
+            BulkOperation.status == PARTIAL_STATUS,
+            BulkOperation.notificacoes_pendentes.isnot(None)
+        )
+        .values(status='notificando', erro=None, finished_at=None, heartbeat_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return False
+
+    _progress(operation_id, status='notificando')
+    app = current_app._get_current_object()
+    threading.Thread(
+        target=_run_in_context, args=(app, operation_id, resend_operation),
+        name=f'bulk-resend-{operation_id}', daemon=True
+    ).start()
+    return True
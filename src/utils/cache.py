@@ -0,0 +1,425 @@
+# Cache das leituras do catálogo, da disponibilidade e dos dados do usuário.
+# O backend é plugável: LRU em memória (um por worker), SQLite compartilhado
+# pelos workers da mesma máquina ou Redis. As chaves ficam em namespaces
+# versionados; invalidar um namespace incrementa a versão no backend, e todo
+# worker passa a ler chaves novas (as antigas expiram pelo TTL). Com réplicas,
+# uma falha logo depois de uma alteração (até REPLICA_MAX_LAG) é carregada do
+# primário; fora dessa janela as views @read_replica carregam da réplica.
+
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from src.utils.replicas import primary_reads, reading_from_replica, replica_set
+
+try:
+    import redis
+except ImportError:  # opcional: só necessário com CACHE_BACKEND=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Namespaces: catálogo (cidades, UBS, serviços), uma UBS (disponibilidade)
+# e usuários (perfil e agendamentos)
+CATALOG = 'catalog'
+USERS = 'user'
+
+# Disponibilidade muda a cada agendamento: TTL curto, além da remoção explícita
+AVAILABILITY_TTL = 10
+
+# Alterações publicadas (publish) ficam no backend por esse tempo; um worker
+# com mais que MAX_CHANGES versões de atraso recarrega tudo
+CHANGES_TTL = 24 * 3600
+MAX_CHANGES = 1000
+
+def ubs_namespace(ubs_id):
+    """Namespace de uma UBS: as chaves de cada tenant são invalidadas separadamente"""
+    return f'ubs:{ubs_id}'
+
+class LocalBackend:
+    """LRU em memória do processo; com vários workers cada um tem o seu"""
+    name = 'local'
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def _store(self, key, value, ttl):
+        self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value):
+        with self._lock:
+            if key not in self._data:
+                self._store(key, value, None)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            value = (entry[0] if entry else 0) + 1
+            self._store(key, value, None)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class SQLiteBackend:
+    """
+    Arquivo SQLite (WAL) compartilhado pelos workers de uma máquina; serve
+    de substituto local do Redis em desenvolvimento e testes.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path, purge_every=1000):
+        self.path = path
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)'
+            )
+
+    def _connect(self):
+        # Uma conexão por thread e por processo (os workers do gunicorn são forks)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl=None):
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, json.dumps(value, ensure_ascii=False), time.time() + ttl if ttl else None)
+        )
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            conn.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+
+    def add(self, key, value):
+        self._connect().execute(
+            'INSERT OR IGNORE INTO cache (key, value, expires_at) VALUES (?, ?, NULL)',
+            (key, json.dumps(value))
+        )
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def incr(self, key):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                "INSERT INTO cache (key, value, expires_at) VALUES (?, '1', NULL) "
+                'ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1',
+                (key,)
+            )
+            value = int(conn.execute('SELECT value FROM cache WHERE key = ?', (key,)).fetchone()[0])
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+class RedisBackend:
+    """Redis compartilhado por todos os workers e máquinas"""
+    name = 'redis'
+
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND=redis requer o pacote redis (pip install redis)')
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key):
+        value = self.client.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value, ensure_ascii=False), ex=ttl)
+
+    def add(self, key, value):
+        self.client.set(key, json.dumps(value), nx=True)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def clear(self):
+        self.client.flushdb()
+
+BACKENDS = {
+    'local': lambda url, options: LocalBackend(maxsize=options.get('maxsize') or 10000),
+    'sqlite': lambda url, options: SQLiteBackend(url),
+    'redis': lambda url, options: RedisBackend(url),
+}
+
+class Cache:
+    """
+    Leituras com get_or_set(namespace, key, loader). A versão de cada
+    namespace fica no backend e é guardada no processo por version_ttl
+    segundos, então uma invalidação feita em outro worker vale para este
+    em no máximo esse tempo. Falhas do backend não derrubam a requisição:
+    contam em 'erros' e a leitura vai ao banco.
+    """
+
+    def __init__(self, backend=None, default_ttl=60, version_ttl=1.0, prefix='agendamento'):
+        self.configure(backend or LocalBackend(), default_ttl, version_ttl, prefix)
+
+    def configure(self, backend, default_ttl=60, version_ttl=1.0, prefix='agendamento'):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self.version_ttl = version_ttl
+        self.prefix = prefix
+        self._versions = {}
+        self._stats = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def _count(self, namespace, metric):
+        with self._lock:
+            self._stats[namespace.split(':', 1)[0]][metric] += 1
+
+    def version(self, namespace):
+        """Versão atual do namespace (muda a cada invalidate)"""
+        cached = self._versions.get(namespace)
+        now = time.monotonic()
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        key = f'{self.prefix}:v:{namespace}'
+        try:
+            version = self.backend.get(key)
+            if version is None:
+                # Começa do relógio: se a chave de versão se perder (LRU, flush
+                # do Redis), a nova versão não coincide com uma já usada
+                self.backend.add(key, time.time_ns() // 1_000_000)
+                version = self.backend.get(key)
+        except Exception:
+            logger.exception('Falha ao ler a versão do cache de %s', namespace)
+            self._count(namespace, 'erros')
+            return None
+
+        self._versions[namespace] = (version, now + self.version_ttl)
+        return version
+
+    def _key(self, namespace, key):
+        version = self.version(namespace)
+        return None if version is None else f'{self.prefix}:{namespace}:{version}:{key}'
+
+    def get(self, namespace, key):
+        full_key = self._key(namespace, key)
+        if full_key is None:
+            return None
+        try:
+            value = self.backend.get(full_key)
+        except Exception:
+            logger.exception('Falha ao ler %s do cache', full_key)
+            self._count(namespace, 'erros')
+            return None
+        self._count(namespace, 'acertos' if value is not None else 'falhas')
+        return value
+
+    def set(self, namespace, key, value, ttl=None):
+        full_key = self._key(namespace, key)
+        if full_key is None:
+            return
+        try:
+            self.backend.set(full_key, value, ttl or self.default_ttl)
+            self._count(namespace, 'gravacoes')
+        except Exception:
+            logger.exception('Falha ao gravar %s no cache', full_key)
+            self._count(namespace, 'erros')
+
+    def _mark_changed(self, *names):
+        """
+        Registra que o namespace (ou a chave) acabou de mudar no banco, por
+        REPLICA_MAX_LAG segundos. Só com réplicas configuradas.
+        """
+        if not replica_set.keys:
+            return
+        ttl = max(1, math.ceil(replica_set.max_lag))
+        for name in names:
+            try:
+                self.backend.set(f'{self.prefix}:t:{name}', 1, ttl)
+            except Exception:
+                logger.exception('Falha ao marcar %s como alterado no cache', name)
+                self._count(name, 'erros')
+
+    def _changed_recently(self, namespace, key):
+        try:
+            return any(
+                self.backend.get(f'{self.prefix}:t:{name}') is not None
+                for name in (namespace, f'{namespace}:{key}')
+            )
+        except Exception:
+            self._count(namespace, 'erros')
+            return True
+
+    def get_or_set(self, namespace, key, loader, ttl=None):
+        """Valor em cache ou o resultado de loader() (que deve ser serializável em JSON)"""
+        value = self.get(namespace, key)
+        if value is None:
+            if reading_from_replica() and self._changed_recently(namespace, key):
+                # Logo depois de uma invalidação a réplica pode estar atrasada e
+                # gravaria no cache, sob a versão nova, o dado de antes dela
+                with primary_reads():
+                    value = loader()
+            else:
+                value = loader()
+            self.set(namespace, key, value, ttl)
+        return value
+
+    def delete(self, namespace, *keys):
+        self._mark_changed(*(f'{namespace}:{key}' for key in keys))
+        for key in keys:
+            full_key = self._key(namespace, key)
+            if full_key is None:
+                continue
+            try:
+                self.backend.delete(full_key)
+                self._count(namespace, 'remocoes')
+            except Exception:
+                logger.exception('Falha ao remover %s do cache', full_key)
+                self._count(namespace, 'erros')
+
+    def invalidate(self, *namespaces):
+        """Descarta todas as chaves dos namespaces, em todos os workers"""
+        self._mark_changed(*namespaces)
+        for namespace in namespaces:
+            try:
+                version = self.backend.incr(f'{self.prefix}:v:{namespace}')
+                self._versions[namespace] = (version, time.monotonic() + self.version_ttl)
+                self._count(namespace, 'invalidacoes')
+            except Exception:
+                logger.exception('Falha ao invalidar o namespace %s do cache', namespace)
+                self._versions.pop(namespace, None)
+                self._count(namespace, 'erros')
+
+    def publish(self, namespace, *changes):
+        """
+        invalidate() de um namespace que também registra as entradas
+        alteradas, ex.: ('ubs', id). Os índices em memória dos outros workers
+        leem essas entradas com changes_since e atualizam só o que mudou.
+        Devolve a nova versão (None se o backend falhou).
+        """
+        self._mark_changed(namespace)
+        try:
+            version = self.backend.incr(f'{self.prefix}:v:{namespace}')
+            self.backend.set(f'{self.prefix}:c:{namespace}:{version}', [list(change) for change in changes], CHANGES_TTL)
+            self._versions[namespace] = (version, time.monotonic() + self.version_ttl)
+            self._count(namespace, 'invalidacoes')
+            return version
+        except Exception:
+            logger.exception('Falha ao publicar alterações do namespace %s no cache', namespace)
+            self._versions.pop(namespace, None)
+            self._count(namespace, 'erros')
+            return None
+
+    def changes_since(self, namespace, since, until):
+        """
+        Entradas publicadas depois da versão since até a versão until, ou
+        None quando não é possível saber (alguma versão sem registro, como
+        as de invalidate(), registro expirado ou atraso acima de MAX_CHANGES):
+        nesse caso quem chamou recarrega tudo
+        """
+        if since is None or until is None or not 0 <= until - since <= MAX_CHANGES:
+            return None
+        changes = []
+        try:
+            for version in range(since + 1, until + 1):
+                entry = self.backend.get(f'{self.prefix}:c:{namespace}:{version}')
+                if entry is None:
+                    return None
+                changes.extend(tuple(change) for change in entry)
+        except Exception:
+            logger.exception('Falha ao ler alterações do namespace %s no cache', namespace)
+            self._count(namespace, 'erros')
+            return None
+        return changes
+
+    def stats(self):
+        """Métricas deste processo, por tipo de namespace"""
+        with self._lock:
+            namespaces = {}
+            for kind, counters in self._stats.items():
+                counters = dict(counters)
+                lookups = counters.get('acertos', 0) + counters.get('falhas', 0)
+                counters['taxa_acerto'] = round(counters.get('acertos', 0) / lookups, 3) if lookups else None
+                namespaces[kind] = counters
+        return {'backend': self.backend.name, 'pid': os.getpid(), 'namespaces': namespaces}
+
+cache = Cache()
+
+def forget_availability(ubs_id, service_id):
+    """Remove do cache a disponibilidade de um serviço da UBS (após agendar/cancelar)"""
+    cache.delete(ubs_namespace(ubs_id), f'datas:{service_id}', f'janelas:{service_id}')
+
+def forget_user(user_id):
+    cache.delete(USERS, f'{user_id}:perfil', f'{user_id}:agendamentos')
+
+def init_app(app):
+    """
+    Configura o cache pelo app.config:
+    CACHE_BACKEND ('local', 'sqlite' ou 'redis'), CACHE_URL (arquivo do
+    SQLite ou URL do Redis), CACHE_DEFAULT_TTL, CACHE_VERSION_TTL e
+    CACHE_LOCAL_SIZE (itens do LRU em memória).
+    """
+    name = app.config.get('CACHE_BACKEND', 'local')
+    if name not in BACKENDS:
+        raise ValueError(f'CACHE_BACKEND inválido: {name}')
+    url = app.config.get('CACHE_URL') or (
+        os.path.join(app.instance_path, 'cache.db') if name == 'sqlite' else 'redis://localhost:6379/0'
+    )
+    cache.configure(
+        BACKENDS[name](url, {'maxsize': app.config.get('CACHE_LOCAL_SIZE')}),
+        default_ttl=int(app.config.get('CACHE_DEFAULT_TTL', 60)),
+        version_ttl=float(app.config.get('CACHE_VERSION_TTL', 1.0))
+    )
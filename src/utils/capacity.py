@@ -0,0 +1,200 @@
+# Capacidade por janela de horário (ex.: 15 minutos) para UBS/serviço, e o
+# ajuste atômico das vagas dos slots por turno
+
+import sys
+from array import array
+from datetime import timedelta
+
+from sqlalchemy import select, update, and_
+
+from src.models.database import db, DayCapacity, Slot
+
+# Quantas vezes a reserva é tentada quando outra requisição altera o mesmo dia
+MAX_RETRIES = 5
+
+class WindowBusy(Exception):
+    """
+    A janela mudou em todas as MAX_RETRIES tentativas. Devolvida como 503
+    (não é gravada pelo @idempotent), para o cliente repetir a requisição.
+    """
+    def __init__(self, message='Muitas reservas simultâneas neste horário; tente novamente', status=503):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def pack(values):
+    """Serializa as vagas por janela em uint16 little-endian"""
+    data = array('H', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+def unpack(blob):
+    data = array('H')
+    data.frombytes(blob)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data
+
+def parse_horario(horario):
+    """'HH:MM' -> minutos desde 00:00; ValueError se inválido"""
+    horas, minutos = horario.split(':')
+    horas, minutos = int(horas), int(minutos)
+    if not (0 <= horas < 24 and 0 <= minutos < 60):
+        raise ValueError(horario)
+    return horas * 60 + minutos
+
+def format_horario(minutos):
+    return f'{minutos // 60:02d}:{minutos % 60:02d}'
+
+def turno_for(minutos):
+    """Turno equivalente, para manter as telas que agrupam por Manhã/Tarde"""
+    return 'Manhã' if minutos < 12 * 60 else 'Tarde'
+
+def build_days(ubs_id, service_id, data_inicio, data_fim, inicio, fim, intervalo, vagas_por_janela,
+               pausa=None, incluir_fim_de_semana=False):
+    """
+    Monta as linhas de DayCapacity (dicts, para INSERT em lote) de um período.
+    inicio/fim/pausa em minutos desde 00:00; pausa é um intervalo (ini, fim)
+    sem atendimento, ex.: almoço.
+    """
+    janelas = list(range(inicio, fim, intervalo))
+    totais = [
+        0 if pausa and pausa[0] <= minuto < pausa[1] else vagas_por_janela
+        for minuto in janelas
+    ]
+    blob = pack(totais)
+
+    rows = []
+    dia = data_inicio
+    while dia <= data_fim:
+        if incluir_fim_de_semana or dia.weekday() < 5:
+            rows.append({
+                'ubs_id': ubs_id,
+                'service_id': service_id,
+                'data': dia,
+                'inicio_minutos': inicio,
+                'intervalo_minutos': intervalo,
+                'vagas_disponiveis': blob,
+                'vagas_totais': blob,
+                'disponivel': sum(totais),
+                'version': 0
+            })
+        dia += timedelta(days=1)
+    return rows
+
+def windows_query(ubs_id, service_id, data_inicio):
+    return (
+        select(
+            DayCapacity.data, DayCapacity.inicio_minutos, DayCapacity.intervalo_minutos,
+            DayCapacity.vagas_disponiveis, DayCapacity.vagas_totais
+        )
+        .where(and_(
+            DayCapacity.ubs_id == ubs_id,
+            DayCapacity.service_id == service_id,
+            DayCapacity.data >= data_inicio,
+            DayCapacity.disponivel > 0
+        ))
+        .order_by(DayCapacity.data)
+    )
+
+def format_windows(days):
+    result = []
+    for data, inicio, intervalo, disponiveis, totais in days:
+        totais = unpack(totais)
+        janelas = [
+            {'horario': format_horario(inicio + i * intervalo), 'disponivel': livre, 'total': totais[i]}
+            for i, livre in enumerate(unpack(disponiveis))
+            if livre > 0
+        ]
+        result.append({'data': data.isoformat(), 'janelas': janelas})
+    return result
+
+def available_windows(ubs_id, service_id, data_inicio):
+    """Datas a partir de data_inicio com as janelas que ainda têm vagas"""
+    return format_windows(db.session.execute(windows_query(ubs_id, service_id, data_inicio)).all())
+
+def day_query(ubs_id, service_id, data):
+    return (
+        select(
+            DayCapacity.id, DayCapacity.inicio_minutos, DayCapacity.intervalo_minutos,
+            DayCapacity.vagas_disponiveis, DayCapacity.vagas_totais, DayCapacity.version
+        )
+        .where(and_(
+            DayCapacity.ubs_id == ubs_id,
+            DayCapacity.service_id == service_id,
+            DayCapacity.data == data
+        ))
+    )
+
+def adjust_statement(day, minutos, delta):
+    """
+    UPDATE que soma delta às vagas da janela que começa em minutos, válido
+    só se ninguém alterou o dia desde a leitura (coluna version).
+    None se a janela não existe ou não tem vaga (delta < 0).
+    """
+    offset = minutos - day.inicio_minutos
+    index = offset // day.intervalo_minutos
+    vagas = unpack(day.vagas_disponiveis)
+    if offset < 0 or offset % day.intervalo_minutos or index >= len(vagas):
+        return None
+
+    novo = vagas[index] + delta
+    if novo < 0 or novo > unpack(day.vagas_totais)[index]:
+        return None
+    vagas[index] = novo
+
+    return (
+        update(DayCapacity)
+        .where(and_(DayCapacity.id == day.id, DayCapacity.version == day.version))
+        .values(
+            vagas_disponiveis=pack(vagas),
+            disponivel=DayCapacity.disponivel + delta,
+            version=day.version + 1
+        )
+    )
+
+def slot_delta_statement(ubs_id, service_id, data, turno, delta):
+    """UPDATE atômico das vagas do slot; com delta < 0 só vale se ainda houver vaga"""
+    conditions = [
+        Slot.ubs_id == ubs_id,
+        Slot.service_id == service_id,
+        Slot.data == data,
+        Slot.turno == turno
+    ]
+    if delta < 0:
+        conditions.append(Slot.quantidade_disponivel >= -delta)
+    return (
+        update(Slot)
+        .where(and_(*conditions))
+        .values(quantidade_disponivel=Slot.quantidade_disponivel + delta)
+        .execution_options(synchronize_session=False)
+    )
+
+def _adjust(ubs_id, service_id, data, minutos, delta):
+    """
+    Soma delta às vagas da janela. Usa controle otimista pela coluna
+    version: em caso de conflito relê o dia e tenta de novo.
+    Retorna False se a janela não existe ou não tem vaga (delta < 0).
+    """
+    for _ in range(MAX_RETRIES):
+        day = db.session.execute(day_query(ubs_id, service_id, data)).first()
+        if day is None:
+            return False
+
+        statement = adjust_statement(day, minutos, delta)
+        if statement is None:
+            return False
+
+        if db.session.execute(statement).rowcount:
+            return True
+
+    raise WindowBusy()
+
+def reserve_window(ubs_id, service_id, data, minutos):
+    """Ocupa uma vaga da janela (sem commit; faz parte da transação do agendamento)"""
+    return _adjust(ubs_id, service_id, data, minutos, -1)
+
+def release_window(ubs_id, service_id, data, minutos):
+    """Devolve uma vaga da janela (sem commit)"""
+    return _adjust(ubs_id, service_id, data, minutos, 1)
@@ -21,6 +21,19 @@ def calculate_cpf_digit(cpf_digits, weights):
     remainder = total % 11
     return 0 if remainder < 2 else 11 - remainder
 
+def complete_cpf(base):
+    """Acrescenta os dígitos verificadores a uma base de 9 dígitos"""
+    first_digit = calculate_cpf_digit(base, [10, 9, 8, 7, 6, 5, 4, 3, 2])
+    second_digit = calculate_cpf_digit(f"{base}{first_digit}", [11, 10, 9, 8, 7, 6, 5, 4, 3, 2])
+    return f"{base}{first_digit}{second_digit}"
+
+def generate_cpf(rng):
+    """Gera um CPF válido (para dados de teste) usando o gerador aleatório informado"""
+    while True:
+        base = ''.join(str(rng.randint(0, 9)) for _ in range(9))
+        if base != base[0] * 9:
+            return complete_cpf(base)
+
 def validate_cpf_algorithm(cpf):
     """Validação completa do algoritmo do CPF"""
     cpf = re.sub(r'[^0-9]', '', cpf)
@@ -0,0 +1,252 @@
+# Exportação de agendamentos para análise: CSV compactado ou Parquet (pyarrow opcional)
+
+import csv
+import gzip
+import heapq
+import io
+import itertools
+
+from sqlalchemy import select, tuple_
+
+from src.models.database import db, Appointment, AppointmentArchive, User, UBS, City, Service
+from src.utils.sharding import group_by_shard, shard_keys, using
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+FORMATS = ('csv', 'parquet')
+
+# Coluna exportada -> (tipo, expressão, tabela global de onde vem). As colunas
+# sem tabela são do agendamento, em função do modelo; as demais são lidas do
+# banco principal pelo id, já que os agendamentos podem estar num shard
+COLUMNS = {
+    'id': ('str', lambda m: m.id, None),
+    'data_agendamento': ('date', lambda m: m.data_agendamento, None),
+    'turno': ('str', lambda m: m.turno, None),
+    'horario': ('str', lambda m: m.horario, None),
+    'status': ('str', lambda m: m.status, None),
+    'created_at': ('datetime', lambda m: m.created_at, None),
+    'user_id': ('str', lambda m: m.user_id, None),
+    'user_cpf': ('str', lambda m: User.cpf, 'user'),
+    'user_nome': ('str', lambda m: User.nome_completo, 'user'),
+    'user_celular': ('str', lambda m: User.celular, 'user'),
+    'user_data_nascimento': ('date', lambda m: User.data_nascimento, 'user'),
+    'ubs_id': ('str', lambda m: m.ubs_id, None),
+    'ubs_nome': ('str', lambda m: UBS.nome, 'ubs'),
+    'cidade_nome': ('str', lambda m: City.nome, 'ubs'),
+    'service_id': ('str', lambda m: m.service_id, None),
+    'service_nome': ('str', lambda m: Service.nome, 'service'),
+}
+
+# Tabela global -> (id no agendamento, id na tabela)
+LOOKUPS = {
+    'user': (lambda m: m.user_id, User.id),
+    'ubs': (lambda m: m.ubs_id, UBS.id),
+    'service': (lambda m: m.service_id, Service.id),
+}
+
+# Sem dados pessoais do cidadão; CPF, nome e celular só quando pedidos explicitamente
+DEFAULT_COLUMNS = [
+    'id', 'data_agendamento', 'turno', 'horario', 'status', 'created_at',
+    'ubs_id', 'ubs_nome', 'cidade_nome', 'service_id', 'service_nome'
+]
+
+def parse_columns(value):
+    """Lista de colunas a partir de 'a,b,c'; None ou vazio usa DEFAULT_COLUMNS"""
+    if not value:
+        return list(DEFAULT_COLUMNS)
+    columns = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in columns if name not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Colunas desconhecidas: {', '.join(unknown)}")
+    return columns
+
+def _tables(columns):
+    return [table for table in LOOKUPS if any(COLUMNS[name][2] == table for name in columns)]
+
+def _query(model, columns, data_inicio, data_fim, ubs_id, service_id):
+    # Colunas do agendamento seguidas dos ids das tabelas globais que as colunas pedidas usam
+    query = select(
+        model.data_agendamento, model.id,
+        *[COLUMNS[name][1](model) for name in columns if COLUMNS[name][2] is None],
+        *[LOOKUPS[table][0](model) for table in _tables(columns)]
+    )
+
+    conditions = [model.data_agendamento.between(data_inicio, data_fim)]
+    if ubs_id:
+        conditions.append(model.ubs_id == ubs_id)
+    if service_id:
+        conditions.append(model.service_id == service_id)
+    return query.where(*conditions)
+
+def _lookup(table, columns, ids):
+    """{id: (valores das colunas de table, na ordem de columns)} lidos do banco principal"""
+    names = [name for name in columns if COLUMNS[name][2] == table]
+    key = LOOKUPS[table][1]
+    query = select(key, *[COLUMNS[name][1](None) for name in names]).where(key.in_(ids))
+    if 'cidade_nome' in names:
+        query = query.join(City, UBS.cidade_id == City.id)
+    return {row[0]: tuple(row[1:]) for row in db.session.execute(query)}
+
+def _enrich(columns, rows):
+    """Monta as tuplas exportadas, com as colunas das tabelas globais de um chunk"""
+    tables = _tables(columns)
+    local = [name for name in columns if COLUMNS[name][2] is None]
+    first_key = 2 + len(local)
+    lookups = [
+        _lookup(table, columns, {row[first_key + i] for row in rows})
+        for i, table in enumerate(tables)
+    ]
+    blanks = [(None,) * sum(COLUMNS[name][2] == table for name in columns) for table in tables]
+
+    # Para cada coluna: (None, posição na linha) ou (tabela, posição nos valores da tabela)
+    plan = []
+    for name in columns:
+        table = COLUMNS[name][2]
+        if table is None:
+            plan.append((None, 2 + local.index(name)))
+        else:
+            names = [other for other in columns if COLUMNS[other][2] == table]
+            plan.append((tables.index(table), names.index(name)))
+
+    result = []
+    for row in rows:
+        found = [lookups[i].get(row[first_key + i], blanks[i]) for i in range(len(tables))]
+        result.append(tuple(row[index] if table is None else found[table][index] for table, index in plan))
+    return result
+
+def _shard_rows(model, shard_key, base, chunk_size):
+    """Agendamentos de um shard, na ordem (data_agendamento, id), lidos em páginas"""
+    last = None
+    while True:
+        query = base
+        if last is not None:
+            # A condição redundante na data permite ao SQLite começar a busca no índice por ela
+            query = query.where(
+                model.data_agendamento >= last[0],
+                tuple_(model.data_agendamento, model.id) > last
+            )
+        with using(shard_key):
+            rows = db.session.execute(
+                query.order_by(model.data_agendamento, model.id).limit(chunk_size)
+            ).all()
+        if not rows:
+            return
+        last = (rows[-1][0], rows[-1][1])
+        yield from rows
+
+def iter_chunks(columns, data_inicio, data_fim, ubs_id=None, service_id=None,
+                incluir_historico=False, chunk_size=50000):
+    """
+    Gera listas de tuplas (uma por agendamento, na ordem de columns),
+    paginando por (data_agendamento, id) para que cada consulta use o
+    índice e a memória fique limitada a um chunk por shard. Os shards são
+    intercalados nessa mesma ordem; com ubs_id só o shard da UBS é lido.
+    """
+    models = [Appointment, AppointmentArchive] if incluir_historico else [Appointment]
+    keys = list(group_by_shard([ubs_id])) if ubs_id else shard_keys()
+    for model in models:
+        base = _query(model, columns, data_inicio, data_fim, ubs_id, service_id)
+        rows = heapq.merge(
+            *[_shard_rows(model, key, base, chunk_size) for key in keys],
+            key=lambda row: (row[0], row[1])
+        )
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+            yield _enrich(columns, chunk)
+
+class _Buffer(io.RawIOBase):
+    """Destino de escrita que acumula os bytes até serem drenados com take()"""
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+class CSVWriter:
+    """CSV com cabeçalho, compactado com gzip"""
+    extension = 'csv.gz'
+    mimetype = 'application/gzip'
+
+    def __init__(self, columns, compresslevel=6):
+        self.columns = columns
+        self.rows = 0
+        self.buffer = _Buffer()
+        self.gzip = gzip.GzipFile(fileobj=self.buffer, mode='wb', compresslevel=compresslevel)
+        self.text = io.TextIOWrapper(self.gzip, encoding='utf-8', newline='')
+        self.writer = csv.writer(self.text)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.rows += len(rows)
+        self.writer.writerows(rows)
+        self.text.flush()
+        return self.buffer.take()
+
+    def close(self):
+        self.text.close()
+        return self.buffer.take()
+
+class ParquetWriter:
+    """Parquet (zstd), um row group por chunk"""
+    extension = 'parquet'
+    mimetype = 'application/vnd.apache.parquet'
+
+    def __init__(self, columns, compression='zstd'):
+        if pa is None:
+            raise RuntimeError('Exportação em Parquet requer o pacote pyarrow')
+        types = {'str': pa.string(), 'date': pa.date32(), 'datetime': pa.timestamp('us')}
+        self.columns = columns
+        self.rows = 0
+        self.schema = pa.schema([(name, types[COLUMNS[name][0]]) for name in columns])
+        self.buffer = _Buffer()
+        self.writer = pq.ParquetWriter(self.buffer, self.schema, compression=compression)
+
+    def write(self, rows):
+        self.rows += len(rows)
+        arrays = [
+            pa.array([row[i] for row in rows], type=field.type)
+            for i, field in enumerate(self.schema)
+        ]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        return self.buffer.take()
+
+    def close(self):
+        self.writer.close()
+        return self.buffer.take()
+
+def get_writer(formato, columns):
+    if formato == 'parquet':
+        return ParquetWriter(columns)
+    if formato == 'csv':
+        return CSVWriter(columns)
+    raise ValueError(f'Formato inválido: {formato}')
+
+def export_appointments(writer, data_inicio, data_fim, **filters):
+    """Gera os bytes do arquivo exportado, um pedaço por chunk de agendamentos"""
+    for rows in iter_chunks(writer.columns, data_inicio, data_fim, **filters):
+        data = writer.write(rows)
+        if data:
+            yield data
+    yield writer.close()
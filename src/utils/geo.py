@@ -0,0 +1,228 @@
+# Índice espacial em memória (grade) das UBS para busca por proximidade
+
+import heapq
+import math
+import threading
+
+from sqlalchemy import select, func, and_
+
+from src.models.database import db, UBS, Slot, DayCapacity
+from src.utils.cache import cache, CATALOG
+from src.utils.replicas import primary_reads
+from src.utils.sharding import group_by_shard, using
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.19
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+class GridIndex:
+    """
+    Divide o mapa em células de cell_size graus. A busca percorre anéis
+    de células em volta do ponto, do mais próximo para o mais distante,
+    e só devolve uma UBS quando nenhuma célula ainda não visitada pode
+    conter outra mais próxima.
+    """
+
+    def __init__(self, points=(), cell_size=0.1):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.positions = {}  # ubs_id -> célula
+        self.size = 0
+        self.bounds = None  # (min_y, max_y, min_x, max_x) em células
+        for ubs_id, lat, lon in points:
+            self.add(ubs_id, lat, lon)
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def add(self, ubs_id, lat, lon):
+        cy, cx = self._cell(lat, lon)
+        # Lista nova em vez de append: uma busca em andamento continua com a anterior
+        self.cells[(cy, cx)] = self.cells.get((cy, cx), []) + [(ubs_id, lat, lon)]
+        self.positions[ubs_id] = (cy, cx)
+        self.size += 1
+        if self.bounds is None:
+            self.bounds = (cy, cy, cx, cx)
+        else:
+            min_y, max_y, min_x, max_x = self.bounds
+            self.bounds = (min(min_y, cy), max(max_y, cy), min(min_x, cx), max(max_x, cx))
+
+    def remove(self, ubs_id):
+        # bounds não encolhe: a busca só percorre alguns anéis vazios a mais
+        cell = self.positions.pop(ubs_id, None)
+        if cell is None:
+            return
+        points = [point for point in self.cells[cell] if point[0] != ubs_id]
+        if points:
+            self.cells[cell] = points
+        else:
+            del self.cells[cell]
+        self.size -= 1
+
+    def _ring(self, center, radius):
+        cy, cx = center
+        if radius == 0:
+            yield center
+            return
+        for dx in range(-radius, radius + 1):
+            yield (cy - radius, cx + dx)
+            yield (cy + radius, cx + dx)
+        for dy in range(-radius + 1, radius):
+            yield (cy + dy, cx - radius)
+            yield (cy + dy, cx + radius)
+
+    def _ring_min_km(self, lat, radius):
+        """Distância mínima de qualquer ponto fora dos anéis 0..radius"""
+        # Longitude encolhe com a latitude: usa o cosseno da latitude mais extrema alcançada
+        extreme = min(89.9, abs(lat) + (radius + 1) * self.cell_size)
+        return radius * self.cell_size * KM_PER_DEGREE * math.cos(math.radians(extreme))
+
+    def nearest(self, lat, lon, max_km=None):
+        """Gera (distancia_km, ubs_id) em ordem crescente de distância"""
+        if not self.size:
+            return
+
+        center = self._cell(lat, lon)
+        heap = []
+        seen = 0
+        radius = 0
+        min_y, max_y, min_x, max_x = self.bounds
+        max_radius = max(abs(min_y - center[0]), abs(max_y - center[0]),
+                         abs(min_x - center[1]), abs(max_x - center[1]))
+
+        while radius <= max_radius:
+            for cell in self._ring(center, radius):
+                for ubs_id, plat, plon in self.cells.get(cell, ()):
+                    heapq.heappush(heap, (haversine_km(lat, lon, plat, plon), ubs_id))
+                    seen += 1
+
+            bound = self._ring_min_km(lat, radius)
+            while heap and heap[0][0] <= bound:
+                distance, ubs_id = heapq.heappop(heap)
+                if max_km is not None and distance > max_km:
+                    return
+                yield distance, ubs_id
+
+            if max_km is not None and bound > max_km:
+                return
+            if seen == self.size and not heap:
+                return
+            radius += 1
+
+        while heap:
+            distance, ubs_id = heapq.heappop(heap)
+            if max_km is not None and distance > max_km:
+                return
+            yield distance, ubs_id
+
+class UBSLocator:
+    """
+    Mantém o GridIndex das UBS com coordenadas. O worker que altera uma
+    UBS atualiza o índice com update(); os demais aplicam as UBS
+    publicadas no cache quando a versão do catálogo muda.
+    """
+
+    def __init__(self):
+        self._index = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def update(self, ubs_id, lat, lon):
+        """Inclui, move ou (sem coordenadas) retira uma UBS do índice"""
+        with self._lock:
+            if self._index is None:
+                return
+            self._index.remove(ubs_id)
+            if lat is not None and lon is not None:
+                self._index.add(ubs_id, lat, lon)
+
+    def mark_current(self, version):
+        """Mesmo que SearchIndex.mark_current"""
+        with self._lock:
+            if self._index is not None and version is not None and self._version == version - 1:
+                self._version = version
+
+    def index(self):
+        version = cache.version(CATALOG)
+        with self._lock:
+            if self._index is not None and version == self._version:
+                return self._index
+
+            changes = cache.changes_since(CATALOG, self._version, version) if self._index is not None else None
+            query = (
+                db.select(UBS.id, UBS.latitude, UBS.longitude)
+                .where(UBS.latitude.isnot(None), UBS.longitude.isnot(None))
+            )
+            # Do primário, como em SearchIndex.ensure_loaded
+            with primary_reads():
+                if changes is None:
+                    self._index = GridIndex(db.session.execute(query).all())
+                else:
+                    ubs_ids = {doc_id for tipo, doc_id in changes if tipo == 'ubs'}
+                    for ubs_id in ubs_ids:
+                        self._index.remove(ubs_id)
+                    if ubs_ids:
+                        for ubs_id, lat, lon in db.session.execute(query.where(UBS.id.in_(ubs_ids))):
+                            self._index.add(ubs_id, lat, lon)
+            self._version = version
+            return self._index
+
+ubs_locator = UBSLocator()
+
+def _availability(ubs_ids, service_id, data_inicio, data_fim):
+    """
+    Vagas e primeira data com vaga por UBS, somando slots e janelas de
+    horário; as consultas agregadas rodam no shard de cada grupo de UBS
+    """
+    result = {}
+    for key, shard_ubs_ids in group_by_shard(ubs_ids).items():
+        with using(key):
+            for model, date_col, vagas_col in (
+                (Slot, Slot.data, Slot.quantidade_disponivel),
+                (DayCapacity, DayCapacity.data, DayCapacity.disponivel),
+            ):
+                rows = db.session.execute(
+                    select(model.ubs_id, func.sum(vagas_col), func.min(date_col))
+                    .where(and_(
+                        model.ubs_id.in_(shard_ubs_ids),
+                        model.service_id == service_id,
+                        date_col.between(data_inicio, data_fim),
+                        vagas_col > 0
+                    ))
+                    .group_by(model.ubs_id)
+                ).all()
+                for ubs_id, vagas, primeira_data in rows:
+                    if ubs_id in result:
+                        vagas += result[ubs_id][0]
+                        primeira_data = min(primeira_data, result[ubs_id][1])
+                    result[ubs_id] = (vagas, primeira_data)
+    return result
+
+def find_nearest_ubs(lat, lon, service_id, data_inicio, data_fim, limite=5, max_km=None, batch_size=50):
+    """
+    UBS mais próximas de (lat, lon) que oferecem o serviço com vagas no
+    período. Os candidatos saem do índice em lotes, em ordem de distância,
+    e cada lote é filtrado por disponibilidade com uma consulta agregada.
+    """
+    found = []
+    candidates = ubs_locator.index().nearest(lat, lon, max_km=max_km)
+
+    while len(found) < limite:
+        batch = [candidate for _, candidate in zip(range(batch_size), candidates)]
+        if not batch:
+            break
+
+        available = _availability([ubs_id for _, ubs_id in batch], service_id, data_inicio, data_fim)
+        for distance, ubs_id in batch:
+            if ubs_id in available:
+                vagas, primeira_data = available[ubs_id]
+                found.append((distance, ubs_id, vagas, primeira_data))
+                if len(found) == limite:
+                    break
+
+    return found
@@ -0,0 +1,280 @@
+# Suporte ao cabeçalho Idempotency-Key nas rotas de agendamento
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import request, jsonify, make_response, current_app
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+from src.models.database import db, IdempotencyKey
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+# Tempo em que uma resposta gravada continua valendo para novas tentativas
+KEY_TTL = timedelta(hours=24)
+
+# Requisições "em andamento" mais antigas que isso são consideradas abandonadas
+CLAIM_TIMEOUT = timedelta(seconds=60)
+
+class ResponseLRU:
+    """Cache LRU em memória das respostas já gravadas na tabela"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < datetime.utcnow():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value, created_at):
+        with self._lock:
+            self._data[key] = (value, created_at + KEY_TTL)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+response_cache = ResponseLRU()
+
+def _hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def _replay(request_hash, status_code, body):
+    """Devolve a resposta gravada, ou erro se a chave foi usada com outros dados"""
+    if request_hash != _hash(request.method, request.path, request.get_data()):
+        return jsonify({'error': 'Idempotency-Key já utilizada com dados diferentes'}), 422
+
+    response = current_app.response_class(body, status=status_code, mimetype='application/json')
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _claim(key_id, request_hash):
+    """
+    Registra a chave antes de executar a rota.
+    Retorna None se a chave foi reservada, ou o registro existente.
+    """
+    now = datetime.utcnow()
+    db.session.add(IdempotencyKey(id=key_id, request_hash=request_hash, created_at=now))
+    try:
+        db.session.commit()
+        return None
+    except IntegrityError:
+        db.session.rollback()
+
+    existing = db.session.get(IdempotencyKey, key_id)
+    if existing is None:
+        # Removida entre o INSERT e o SELECT; tenta reservar novamente
+        return _claim(key_id, request_hash)
+
+    expired = existing.created_at < now - KEY_TTL
+    abandoned = existing.status_code is None and existing.created_at < now - CLAIM_TIMEOUT
+    if expired or abandoned:
+        # Só remove se ninguém reservou a chave nesse meio tempo
+        result = db.session.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.id == key_id,
+                IdempotencyKey.created_at == existing.created_at
+            )
+        )
+        db.session.commit()
+        if result.rowcount:
+            return _claim(key_id, request_hash)
+        existing = db.session.get(IdempotencyKey, key_id)
+
+    return existing
+
+def _release(key_id):
+    db.session.rollback()
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == key_id))
+    db.session.commit()
+
+def idempotent(view):
+    """
+    Executa a rota no máximo uma vez por Idempotency-Key.
+    Novas tentativas com a mesma chave recebem a resposta original,
+    servida do cache em memória ou da tabela idempotency_keys, sem
+    tocar em Slot/Appointment. Respostas 5xx não são gravadas para
+    que o cliente possa tentar novamente.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': 'Idempotency-Key inválida'}), 400
+
+        key_id = _hash(request.endpoint, key)
+
+        cached = response_cache.get(key_id)
+        if cached is not None:
+            return _replay(*cached)
+
+        request_hash = _hash(request.method, request.path, request.get_data())
+        existing = _claim(key_id, request_hash)
+        if existing is not None:
+            if existing.status_code is None:
+                response = jsonify({'error': 'Requisição com esta Idempotency-Key ainda em processamento'})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+
+            stored = (existing.request_hash, existing.status_code, existing.response_body)
+            response_cache.put(key_id, stored, existing.created_at)
+            return _replay(*stored)
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            _release(key_id)
+            raise
+
+        if response.status_code >= 500:
+            _release(key_id)
+            return response
+
+        body = response.get_data(as_text=True)
+        db.session.rollback()
+        db.session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.id == key_id)
+            .values(status_code=response.status_code, response_body=body)
+        )
+        db.session.commit()
+        response_cache.put(key_id, (request_hash, response.status_code, body), datetime.utcnow())
+
+        return response
+
+    return wrapper
+
+# Mesmo protocolo nas rotas assíncronas (src/routes/async_appointments.py), na
+# mesma tabela e com o mesmo endpoint do app Flask: uma chave usada num dos
+# apps é respeitada pelo outro
+
+async def _claim_async(session, key_id, request_hash):
+    """Mesmo que _claim, numa AsyncSession"""
+    now = datetime.utcnow()
+    session.add(IdempotencyKey(id=key_id, request_hash=request_hash, created_at=now))
+    try:
+        await session.commit()
+        return None
+    except IntegrityError:
+        await session.rollback()
+
+    existing = await session.get(IdempotencyKey, key_id)
+    if existing is None:
+        return await _claim_async(session, key_id, request_hash)
+
+    expired = existing.created_at < now - KEY_TTL
+    abandoned = existing.status_code is None and existing.created_at < now - CLAIM_TIMEOUT
+    if expired or abandoned:
+        result = await session.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.id == key_id,
+                IdempotencyKey.created_at == existing.created_at
+            )
+        )
+        await session.commit()
+        if result.rowcount:
+            return await _claim_async(session, key_id, request_hash)
+        existing = await session.get(IdempotencyKey, key_id, populate_existing=True)
+
+    return existing
+
+async def _release_async(session, key_id):
+    await session.rollback()
+    await session.execute(delete(IdempotencyKey).where(IdempotencyKey.id == key_id))
+    await session.commit()
+
+def _replay_async(request_hash, stored_hash, status_code, body):
+    if request_hash != stored_hash:
+        return {'error': 'Idempotency-Key já utilizada com dados diferentes'}, 422
+    return json.loads(body), status_code, {'Idempotent-Replayed': 'true'}
+
+def idempotent_async(endpoint):
+    """
+    Versão de @idempotent para os handlers ASGI. endpoint é o nome da
+    rota equivalente no Flask (ex.: 'appointments.create_appointment').
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request, **params):
+            key = request.headers.get(IDEMPOTENCY_HEADER.lower())
+            if not key:
+                return await handler(request, **params)
+
+            if len(key) > MAX_KEY_LENGTH:
+                return {'error': 'Idempotency-Key inválida'}, 400
+
+            key_id = _hash(endpoint, key)
+            request_hash = _hash(request.method, request.path, request.body)
+
+            cached = response_cache.get(key_id)
+            if cached is not None:
+                return _replay_async(request_hash, *cached)
+
+            async with request.session() as session:
+                existing = await _claim_async(session, key_id, request_hash)
+                if existing is not None:
+                    if existing.status_code is None:
+                        return (
+                            {'error': 'Requisição com esta Idempotency-Key ainda em processamento'},
+                            409, {'Retry-After': '1'}
+                        )
+                    stored = (existing.request_hash, existing.status_code, existing.response_body)
+                    response_cache.put(key_id, stored, existing.created_at)
+                    return _replay_async(request_hash, *stored)
+
+                try:
+                    result = await handler(request, **params)
+                except Exception:
+                    await _release_async(session, key_id)
+                    raise
+
+                payload, status_code = result if isinstance(result, tuple) else (result, 200)
+                if status_code >= 500:
+                    await _release_async(session, key_id)
+                    return result
+
+                body = json.dumps(payload, ensure_ascii=False)
+                await session.execute(
+                    update(IdempotencyKey)
+                    .where(IdempotencyKey.id == key_id)
+                    .values(status_code=status_code, response_body=body)
+                )
+                await session.commit()
+                response_cache.put(key_id, (request_hash, status_code, body), datetime.utcnow())
+
+            return result
+        return wrapper
+    return decorator
+
+def purge_expired_keys(now=None):
+    """Remove as chaves com mais de KEY_TTL (job diário archive_db.py); retorna quantas foram apagadas"""
+    cutoff = (now or datetime.utcnow()) - KEY_TTL
+    result = db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+    db.session.commit()
+    return result.rowcount
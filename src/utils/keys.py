@@ -0,0 +1,109 @@
+# Migração das chaves VARCHAR(36) para ids compactos de 16 bytes (CompactId):
+# copia as tabelas de um banco com o schema antigo para um banco novo, criado
+# a partir dos modelos atuais. Os ids continuam os mesmos para a API.
+
+import time
+import uuid
+
+import sqlalchemy as sa
+
+from src.models.database import db, CompactId
+
+def compact_columns(table):
+    """Nomes das colunas de table gravadas como CompactId"""
+    return {column.name for column in table.columns if isinstance(column.type, CompactId)}
+
+def outdated_tables(engine):
+    """
+    Tabelas já existentes em engine cujo schema é anterior aos modelos:
+    colunas que faltam ou ids ainda em VARCHAR(36). create_all só cria as
+    tabelas novas; essas precisam de copy_database (migrate_keys.py).
+    """
+    inspector = sa.inspect(engine)
+    existing = set(inspector.get_table_names())
+    outdated = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        columns = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+        if any(column.name not in columns for column in table.columns) or any(
+            isinstance(columns.get(name), sa.String) for name in compact_columns(table)
+        ):
+            outdated.append(table.name)
+    return outdated
+
+def _convert(rows, columns, table_name):
+    converted = []
+    for row in rows:
+        row = dict(row._mapping)
+        for name in columns:
+            value = row.get(name)
+            if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+                continue
+            try:
+                row[name] = uuid.UUID(str(value))
+            except ValueError:
+                raise ValueError(f'{table_name}.{name}: id {value!r} não é um UUID')
+        converted.append(row)
+    return converted
+
+def copy_database(source_url, target_url, batch_size=10000, log=print):
+    """
+    Cria o schema atual em target_url e copia para ele, em lotes, todas as
+    tabelas de source_url, na ordem das chaves estrangeiras. Retorna a
+    contagem de linhas por tabela, conferida nos dois bancos.
+    """
+    source = sa.create_engine(source_url)
+    target = sa.create_engine(target_url)
+    try:
+        with target.connect() as conn:
+            existing = sa.inspect(conn).get_table_names()
+        if any(table.name in existing for table in db.metadata.sorted_tables):
+            raise ValueError('O banco de destino já tem as tabelas da aplicação; use um banco vazio')
+        db.metadata.create_all(target)
+
+        source_tables = sa.MetaData()
+        source_tables.reflect(bind=source)
+
+        report = {}
+        for table in db.metadata.sorted_tables:
+            old = source_tables.tables.get(table.name)
+            if old is None:
+                report[table.name] = {'origem': 0, 'destino': 0, 'ausente': True}
+                continue
+
+            names = [column.name for column in old.columns if column.name in table.columns]
+            columns = compact_columns(table) & set(names)
+            start = time.perf_counter()
+            copied = 0
+            with source.connect() as reader:
+                result = reader.execution_options(stream_results=True, yield_per=batch_size).execute(
+                    sa.select(*[old.c[name] for name in names])
+                )
+                for rows in result.partitions(batch_size):
+                    with target.begin() as writer:
+                        writer.execute(table.insert(), _convert(rows, columns, table.name))
+                    copied += len(rows)
+
+            with source.connect() as reader:
+                total_source = reader.execute(sa.select(sa.func.count()).select_from(old)).scalar()
+            with target.connect() as writer:
+                total_target = writer.execute(sa.select(sa.func.count()).select_from(table)).scalar()
+            if total_source != total_target:
+                raise RuntimeError(f'{table.name}: {total_source} linhas na origem e {total_target} no destino')
+
+            if target.dialect.name == 'postgresql' and table.autoincrement_column is not None and total_target:
+                # Os ids inteiros foram copiados explicitamente: a sequência precisa continuar do máximo
+                column = table.autoincrement_column.name
+                with target.begin() as writer:
+                    writer.execute(sa.text(
+                        f"SELECT setval(pg_get_serial_sequence('{table.name}', '{column}'), "
+                        f"(SELECT max({column}) FROM {table.name}))"
+                    ))
+
+            report[table.name] = {'origem': total_source, 'destino': total_target}
+            log(f'{table.name}: {copied} linhas em {time.perf_counter() - start:.1f}s')
+        return report
+    finally:
+        source.dispose()
+        target.dispose()
@@ -0,0 +1,179 @@
+# Envio de SMS/WhatsApp: interface de provedores, limite de taxa e disparo assíncrono
+
+import asyncio
+import json
+import random
+import re
+import time
+
+class ProviderError(Exception):
+    """Falha no envio; retryable=False para erros que não adianta repetir (ex.: número inválido)"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+class NotificationProvider:
+    """
+    Interface dos provedores. Implementações devem sobrescrever send()
+    e definir rate_limit (mensagens por segundo aceitas pelo provedor).
+    """
+    name = 'base'
+    rate_limit = 50
+
+    async def send(self, phone, message):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class FakeProvider(NotificationProvider):
+    """Provedor local para desenvolvimento e testes de carga: simula latência e falhas"""
+    name = 'fake'
+
+    def __init__(self, latency=0.02, failure_rate=0.0, rate_limit=1000, seed=None, log_path=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rate_limit = rate_limit
+        self.sent = 0
+        self._rng = random.Random(seed)
+        self._log = open(log_path, 'a', encoding='utf-8') if log_path else None
+
+    async def send(self, phone, message):
+        await asyncio.sleep(self.latency)
+        if self._rng.random() < self.failure_rate:
+            raise ProviderError('Falha simulada do provedor')
+        self.sent += 1
+        if self._log:
+            self._log.write(json.dumps({'phone': phone, 'message': message}, ensure_ascii=False) + '\n')
+
+    async def close(self):
+        if self._log:
+            self._log.close()
+
+PROVIDERS = {
+    'fake': FakeProvider,
+}
+
+def get_provider(name, **options):
+    try:
+        return PROVIDERS[name](**options)
+    except KeyError:
+        raise ValueError(f'Provedor desconhecido: {name}')
+
+def normalize_phone(celular):
+    """Celular em formato E.164 (+55...), ou None se não parece um celular brasileiro"""
+    digits = re.sub(r'[^0-9]', '', celular or '')
+    if digits.startswith('55') and len(digits) in (12, 13):
+        digits = digits[2:]
+    if len(digits) not in (10, 11):
+        return None
+    return f'+55{digits}'
+
+class RateLimiter:
+    """Token bucket: no máximo rate envios por segundo, com rajadas de até burst"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class DispatchStats:
+    def __init__(self):
+        self.enviadas = 0
+        self.falhas = 0
+        self.retentativas = 0
+        self.latencias = []
+        # Referências (3º item da mensagem, quando informado) dos envios que falharam
+        self.nao_enviadas = []
+        self.inicio = time.perf_counter()
+        self.fim = None
+
+    def as_dict(self):
+        duracao = (self.fim or time.perf_counter()) - self.inicio
+        latencias = sorted(self.latencias)
+
+        def pct(p):
+            return round(latencias[min(len(latencias) - 1, int(p / 100 * len(latencias)))] * 1000, 1) if latencias else 0.0
+
+        return {
+            'enviadas': self.enviadas,
+            'falhas': self.falhas,
+            'retentativas': self.retentativas,
+            'duracao_s': round(duracao, 2),
+            'mensagens_por_s': round(self.enviadas / duracao, 1) if duracao else 0.0,
+            'latencia_p50_ms': pct(50),
+            'latencia_p95_ms': pct(95)
+        }
+
+async def _send_with_retry(provider, limiter, phone, message, stats, max_retries, backoff):
+    for attempt in range(max_retries + 1):
+        await limiter.acquire()
+        start = time.perf_counter()
+        try:
+            await provider.send(phone, message)
+            stats.latencias.append(time.perf_counter() - start)
+            stats.enviadas += 1
+            return True
+        except ProviderError as e:
+            if not e.retryable or attempt == max_retries:
+                break
+        except (OSError, asyncio.TimeoutError):
+            if attempt == max_retries:
+                break
+        stats.retentativas += 1
+        # Backoff exponencial com jitter para não sincronizar as novas tentativas
+        await asyncio.sleep(backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    stats.falhas += 1
+    return False
+
+async def dispatch(batches, provider, concurrency=200, max_retries=3, backoff=0.5, rate_limit=None):
+    """
+    Envia as mensagens de batches (iterador assíncrono de listas de
+    (telefone, texto) ou (telefone, texto, referência)) com até concurrency
+    envios simultâneos, respeitando o limite de taxa do provedor. A fila é
+    limitada para que a leitura dos lotes não passe muito à frente dos envios.
+    """
+    stats = DispatchStats()
+    limiter = RateLimiter(rate_limit or provider.rate_limit)
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    async def worker():
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                sent = await _send_with_retry(provider, limiter, item[0], item[1], stats, max_retries, backoff)
+                if not sent and len(item) > 2:
+                    stats.nao_enviadas.append(item[2])
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        async for batch in batches:
+            for item in batch:
+                await queue.put(item)
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        await provider.close()
+        stats.fim = time.perf_counter()
+
+    return stats
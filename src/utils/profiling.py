@@ -0,0 +1,242 @@
+# Diagnóstico em produção: profiler por amostragem ligado pelo admin por N
+# segundos em todos os workers (saída em pilhas "folded", pronta para
+# flamegraph.pl ou speedscope) e trace das consultas SQL de uma requisição,
+# pedido pelo cabeçalho X-SQL-Trace.
+
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import sqlalchemy as sa
+from flask import current_app, g, request, json, has_request_context
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from src.models.database import db, Admin
+from src.utils.cache import cache
+from src.utils.tenancy import ADMIN_HEADER
+
+TRACE_HEADER = 'X-SQL-Trace'
+
+# Limites do profiler
+MAX_SECONDS = 300
+MIN_INTERVAL_MS = 1
+MAX_DEPTH = 128
+
+# Namespace/chave do cache onde fica a sessão de profiling ativa
+PROFILING_NAMESPACE = 'profiling'
+SESSION_KEY = 'sessao'
+
+_SESSION_NAME = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{6}$')
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f'{os.path.basename(code.co_filename)}:{code.co_name}'
+
+def fold_stack(frame):
+    """Pilha da raiz até o frame, no formato 'a;b;c'"""
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+class SamplingProfiler:
+    """
+    Uma thread amostra, a cada intervalo, a pilha das threads que estão
+    atendendo requisições (registradas em before_request) e conta as
+    pilhas iguais. Sem chamadas em cada função, o custo fica no
+    intervalo escolhido e não no volume de requisições.
+    """
+
+    def __init__(self):
+        self.request_threads = set()
+        self.session = None
+        self.samples = 0
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pid = None
+        self._checked_at = 0.0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+
+    def start(self, session, until, interval, directory):
+        with self._lock:
+            if self.running:
+                return False
+            self.session = session
+            self.samples = 0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, args=(session, until, interval, directory),
+                name='sampling-profiler', daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def _run(self, session, until, interval, directory):
+        stacks = Counter()
+        own = threading.get_ident()
+        while time.time() < until:
+            frames = sys._current_frames()
+            for ident in list(self.request_threads):
+                frame = frames.get(ident)
+                if frame is not None and ident != own:
+                    stacks[fold_stack(frame)] += 1
+            self.samples += 1
+            time.sleep(interval)
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{session}-{os.getpid()}.folded')
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+    def poll(self, directory, poll_interval):
+        """Inicia a amostragem neste worker se houver uma sessão ativa no cache"""
+        now = time.monotonic()
+        if now - self._checked_at < poll_interval:
+            return
+        self._checked_at = now
+        active = cache.get(PROFILING_NAMESPACE, SESSION_KEY)
+        if active and active['ate'] > time.time() and not (self.running and self.session == active['sessao']):
+            self.start(active['sessao'], active['ate'], active['intervalo_ms'] / 1000, directory)
+
+profiler = SamplingProfiler()
+
+def start_session(seconds, interval_ms, directory):
+    """Publica uma sessão de profiling para todos os workers e inicia neste"""
+    seconds = max(1, min(int(seconds), MAX_SECONDS))
+    interval_ms = max(MIN_INTERVAL_MS, int(interval_ms))
+    session = time.strftime('%Y%m%d-%H%M%S') + '-' + os.urandom(3).hex()
+    active = {'sessao': session, 'ate': time.time() + seconds, 'intervalo_ms': interval_ms}
+    cache.set(PROFILING_NAMESPACE, SESSION_KEY, active, ttl=seconds)
+    profiler.start(session, active['ate'], interval_ms / 1000, directory)
+    return active
+
+def list_sessions(directory):
+    """Sessões gravadas, com os workers (pids) de cada uma"""
+    sessions = {}
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.folded'):
+                session, _, pid = name[:-len('.folded')].rpartition('-')
+                sessions.setdefault(session, []).append(int(pid))
+    return [{'sessao': session, 'workers': pids} for session, pids in sorted(sessions.items(), reverse=True)]
+
+def merged_stacks(directory, session):
+    """Pilhas de todos os workers de uma sessão somadas, no formato folded"""
+    if not _SESSION_NAME.match(session or ''):
+        raise ValueError('Sessão inválida')
+    stacks = Counter()
+    prefix = f'{session}-'
+    for name in os.listdir(directory) if os.path.isdir(directory) else ():
+        if name.startswith(prefix) and name.endswith('.folded'):
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    stacks[stack] += int(count)
+    if not stacks:
+        return None
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+# --- Trace de SQL por requisição -------------------------------------------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('sql_trace') is not None:
+        conn.info.setdefault('sql_trace_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if not has_request_context() or g.get('sql_trace') is None:
+        return
+    starts = conn.info.get('sql_trace_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    g.sql_trace.append({
+        'sql': statement,
+        'parametros': repr(parameters)[:500],
+        'ms': round(elapsed * 1000, 3),
+        # Em SELECT o DB-API não informa o número de linhas; ver _count_rows
+        'linhas': cursor.rowcount if cursor.rowcount >= 0 else None,
+        'banco': conn.engine.url.database,
+        'executemany': executemany
+    })
+
+def _count_rows(orm_execute_state):
+    """
+    Nas consultas da sessão, materializa o resultado para contar as linhas
+    e preenche o último comando do trace; consultas com yield_per
+    continuam em streaming e ficam sem contagem.
+    """
+    if not has_request_context() or g.get('sql_trace') is None or not orm_execute_state.is_select:
+        return None
+    if orm_execute_state.execution_options.get('yield_per') or orm_execute_state.execution_options.get('stream_results'):
+        return None
+    before = len(g.sql_trace)
+    frozen = orm_execute_state.invoke_statement().freeze()
+    if len(g.sql_trace) > before and g.sql_trace[-1]['linhas'] is None:
+        g.sql_trace[-1]['linhas'] = len(frozen.data)
+    return frozen()
+
+def _trace_allowed():
+    """Somente um SuperAdmin identificado pelo X-Admin-Id pode pedir o trace"""
+    admin_id = request.headers.get(ADMIN_HEADER)
+    if not admin_id:
+        return False
+    admin = db.session.get(Admin, admin_id)
+    return admin is not None and admin.role == 'SuperAdmin'
+
+def _start_request():
+    profiler.request_threads.add(threading.get_ident())
+    try:
+        profiler.poll(profiles_dir(), float(current_app.config.get('PROFILER_POLL_INTERVAL', 1.0)))
+    except Exception:
+        pass  # o profiler nunca deve derrubar uma requisição
+
+    if request.headers.get(TRACE_HEADER) and _trace_allowed():
+        g.sql_trace = []
+        g.sql_trace_start = time.perf_counter()
+
+def _finish_trace(response):
+    trace = g.get('sql_trace')
+    if trace is None:
+        return response
+    total_ms = round(sum(item['ms'] for item in trace), 3)
+    request_ms = round((time.perf_counter() - g.sql_trace_start) * 1000, 3)
+    response.headers['Server-Timing'] = f'db;dur={total_ms};desc="{len(trace)} consultas", app;dur={request_ms}'
+
+    # Nas respostas JSON (objeto) o trace vai no corpo; nas demais, só o resumo no cabeçalho
+    if response.is_json and not response.is_streamed:
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body['sql_trace'] = {'consultas': trace, 'total_ms': total_ms, 'requisicao_ms': request_ms}
+            response.set_data(json.dumps(body))
+    g.sql_trace = None
+    return response
+
+def _end_request(exc=None):
+    profiler.request_threads.discard(threading.get_ident())
+
+def profiles_dir():
+    return current_app.config.get('PROFILE_DIR') or os.path.join(current_app.instance_path, 'profiles')
+
+def init_app(app):
+    """
+    Registra os ganchos do profiler e do trace de SQL.
+    PROFILE_DIR: onde cada worker grava as pilhas de uma sessão
+    (padrão instance/profiles); PROFILER_POLL_INTERVAL: de quanto em quanto
+    tempo cada worker consulta o cache por uma sessão ativa. Para valer em
+    todos os workers o cache precisa ser compartilhado (sqlite ou redis).
+    """
+    sa.event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    sa.event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    sa.event.listen(Session, 'do_orm_execute', _count_rows)
+    app.before_request(_start_request)
+    app.after_request(_finish_trace)
+    app.teardown_request(_end_request)
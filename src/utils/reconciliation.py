@@ -0,0 +1,301 @@
+# Reconciliação das vagas dos slots e das janelas de horário e transição de
+# status dos agendamentos passados
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+from flask import current_app
+from sqlalchemy import select, update, func, and_, tuple_
+
+from src.models.database import db, Appointment, DayCapacity, Slot
+from src.utils.capacity import pack, unpack, parse_horario, format_horario
+from src.utils.sharding import route_ubs, shard_keys, use_shard
+from src.utils.booking_rules import apply_change, completion
+from src.utils.cache import forget_user
+
+# Status finais que um agendamento Confirmado pode assumir depois da data
+FINAL_STATUSES = ('Realizado', 'Faltou')
+
+# Quantas divergências detalhar no relatório
+MAX_SAMPLES = 20
+
+def _slot_usage(ids):
+    """Vagas ocupadas de cada slot do lote, numa única consulta agregada"""
+    used = func.count(Appointment.id)
+    return db.session.execute(
+        select(Slot.id, Slot.ubs_id, Slot.data, Slot.turno,
+               Slot.quantidade_total, Slot.quantidade_disponivel, used)
+        .outerjoin(Appointment, and_(
+            Appointment.ubs_id == Slot.ubs_id,
+            Appointment.service_id == Slot.service_id,
+            Appointment.data_agendamento == Slot.data,
+            Appointment.turno == Slot.turno,
+            # Agendamentos por janela de horário consomem DayCapacity, não o slot
+            Appointment.horario.is_(None),
+            Appointment.status != 'Cancelado'
+        ))
+        .where(Slot.id.in_(ids))
+        .group_by(Slot.id)
+    ).all()
+
+def reconcile_slots(ubs_id=None, data_inicio=None, batch_size=2000, fix=True, report=None):
+    """
+    Recalcula quantidade_disponivel dos slots a partir dos agendamentos
+    não cancelados. A correção só é gravada se o slot não mudou desde a
+    leitura; se um agendamento entrou no meio, o slot fica para a próxima
+    execução e é contado em 'conflitos'.
+    """
+    report = report if report is not None else new_report()
+    conditions = []
+    if ubs_id:
+        conditions.append(Slot.ubs_id == ubs_id)
+    if data_inicio:
+        conditions.append(Slot.data >= data_inicio)
+
+    after_id = None
+    while True:
+        page = conditions if after_id is None else conditions + [Slot.id > after_id]
+        ids = db.session.execute(
+            select(Slot.id)
+            .where(*page)
+            .order_by(Slot.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        after_id = ids[-1]
+
+        for slot_id, slot_ubs, data, turno, total, disponivel, usados in _slot_usage(ids):
+            report['slots_verificados'] += 1
+            esperado = max(0, total - usados)
+            if usados > total:
+                report['excedidos'] += 1
+            if disponivel == esperado:
+                continue
+
+            report['divergentes'] += 1
+            if len(report['amostras']) < MAX_SAMPLES:
+                report['amostras'].append({
+                    'slot_id': slot_id,
+                    'ubs_id': slot_ubs,
+                    'data': data.isoformat(),
+                    'turno': turno,
+                    'quantidade_total': total,
+                    'quantidade_disponivel': disponivel,
+                    'esperado': esperado
+                })
+
+            if fix:
+                result = db.session.execute(
+                    update(Slot.__table__)
+                    .where(Slot.__table__.c.id == slot_id,
+                           Slot.__table__.c.quantidade_disponivel == disponivel)
+                    .values(quantidade_disponivel=esperado)
+                )
+                if result.rowcount:
+                    report['corrigidos'] += 1
+                else:
+                    report['conflitos'] += 1
+
+        db.session.commit()
+
+    return report
+
+def _window_usage(days):
+    """{(ubs_id, service_id, data): {minuto: ocupadas}} dos agendamentos por horário dos dias do lote"""
+    usage = {}
+    rows = db.session.execute(
+        select(Appointment.ubs_id, Appointment.service_id, Appointment.data_agendamento,
+               Appointment.horario, func.count(Appointment.id))
+        .where(
+            tuple_(Appointment.ubs_id, Appointment.service_id, Appointment.data_agendamento).in_(
+                [(day.ubs_id, day.service_id, day.data) for day in days]
+            ),
+            Appointment.horario.is_not(None),
+            Appointment.status != 'Cancelado'
+        )
+        .group_by(Appointment.ubs_id, Appointment.service_id, Appointment.data_agendamento, Appointment.horario)
+    ).all()
+    for ubs_id, service_id, data, horario, count in rows:
+        usage.setdefault((ubs_id, service_id, data), {})[parse_horario(horario)] = count
+    return usage
+
+def reconcile_windows(ubs_id=None, data_inicio=None, batch_size=2000, fix=True, report=None):
+    """
+    Recalcula o vetor vagas_disponiveis de cada dia de DayCapacity a partir
+    dos agendamentos por horário não cancelados. Como em _adjust, a correção
+    só é gravada se a version do dia não mudou desde a leitura; senão o dia
+    fica para a próxima execução e é contado em 'conflitos'.
+    """
+    report = report if report is not None else new_report()
+    conditions = []
+    if ubs_id:
+        conditions.append(DayCapacity.ubs_id == ubs_id)
+    if data_inicio:
+        conditions.append(DayCapacity.data >= data_inicio)
+
+    after_id = None
+    while True:
+        page = conditions if after_id is None else conditions + [DayCapacity.id > after_id]
+        days = db.session.execute(
+            select(
+                DayCapacity.id, DayCapacity.ubs_id, DayCapacity.service_id, DayCapacity.data,
+                DayCapacity.inicio_minutos, DayCapacity.intervalo_minutos,
+                DayCapacity.vagas_disponiveis, DayCapacity.vagas_totais, DayCapacity.version
+            )
+            .where(*page)
+            .order_by(DayCapacity.id)
+            .limit(batch_size)
+        ).all()
+        if not days:
+            break
+        after_id = days[-1].id
+
+        usage = _window_usage(days)
+        for day in days:
+            report['dias_janelas_verificados'] += 1
+            vagas = unpack(day.vagas_disponiveis)
+            totais = unpack(day.vagas_totais)
+            usados = usage.get((day.ubs_id, day.service_id, day.data), {})
+            esperado = [
+                max(0, total - usados.get(day.inicio_minutos + i * day.intervalo_minutos, 0))
+                for i, total in enumerate(totais)
+            ]
+            if any(usados.get(day.inicio_minutos + i * day.intervalo_minutos, 0) > total
+                   for i, total in enumerate(totais)):
+                report['excedidos'] += 1
+            if list(vagas) == esperado:
+                continue
+
+            report['divergentes'] += 1
+            if len(report['amostras']) < MAX_SAMPLES:
+                report['amostras'].append({
+                    'day_capacity_id': day.id,
+                    'ubs_id': day.ubs_id,
+                    'data': day.data.isoformat(),
+                    'janelas': [
+                        {'horario': format_horario(day.inicio_minutos + i * day.intervalo_minutos),
+                         'vagas_disponiveis': vagas[i], 'esperado': esperado[i]}
+                        for i in range(len(esperado)) if vagas[i] != esperado[i]
+                    ]
+                })
+
+            if fix:
+                result = db.session.execute(
+                    update(DayCapacity)
+                    .where(DayCapacity.id == day.id, DayCapacity.version == day.version)
+                    .values(vagas_disponiveis=pack(esperado), disponivel=sum(esperado), version=day.version + 1)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount:
+                    report['corrigidos'] += 1
+                else:
+                    report['conflitos'] += 1
+
+        db.session.commit()
+
+    return report
+
+def finish_past_appointments(cutoff=None, status_final=None, ubs_id=None, batch_size=2000):
+    """
+    Agendamentos ainda Confirmado com data anterior a cutoff passam para
+    status_final, que o operador escolhe (não há padrão: marcar todos como
+    Realizado apagaria as faltas). Presenças e faltas marcadas pela UBS
+    antes do job são preservadas, já que só Confirmado é alterado. Com
+    Faltou, as faltas entram nos contadores das regras de agendamento de
+    cada usuário.
+    """
+    if status_final not in FINAL_STATUSES:
+        raise ValueError(f'Status final inválido: {status_final}')
+    cutoff = cutoff or date.today()
+
+    conditions = [Appointment.data_agendamento < cutoff, Appointment.status == 'Confirmado']
+    if ubs_id:
+        conditions.append(Appointment.ubs_id == ubs_id)
+
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(Appointment.id, Appointment.user_id, Appointment.service_id, Appointment.data_agendamento)
+            .where(*conditions).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        ids = [row.id for row in rows]
+        db.session.execute(
+            update(Appointment.__table__)
+            .where(Appointment.__table__.c.id.in_(ids),
+                   Appointment.__table__.c.status == 'Confirmado')
+            .values(status=status_final)
+        )
+        if status_final == 'Faltou':
+            for row in rows:
+                apply_change(row.user_id, completion(row.service_id, row.data_agendamento, status_final))
+        db.session.commit()
+        for user_id in {row.user_id for row in rows}:
+            forget_user(user_id)
+        total += len(ids)
+
+    return total
+
+def new_report():
+    return {
+        'slots_verificados': 0,
+        'dias_janelas_verificados': 0,
+        'divergentes': 0,
+        'corrigidos': 0,
+        'conflitos': 0,
+        'excedidos': 0,
+        'agendamentos_finalizados': 0,
+        'amostras': []
+    }
+
+def _merge(report, partial):
+    for key, value in partial.items():
+        if key == 'amostras':
+            report[key].extend(value[:MAX_SAMPLES - len(report[key])])
+        else:
+            report[key] += value
+
+def _reconcile_ubs(app, ubs_id, data_inicio, cutoff, status_final, batch_size, fix, shard_key=None):
+    with app.app_context():
+        try:
+            report = new_report()
+            # Uma UBS vai ao shard da sua cidade; sem UBS, ao shard informado
+            if ubs_id is None:
+                use_shard(shard_key)
+            elif not route_ubs(ubs_id):
+                return report
+            if status_final and fix:
+                report['agendamentos_finalizados'] = finish_past_appointments(
+                    cutoff, status_final, ubs_id=ubs_id, batch_size=batch_size
+                )
+            reconcile_slots(ubs_id, data_inicio, batch_size=batch_size, fix=fix, report=report)
+            reconcile_windows(ubs_id, data_inicio, batch_size=batch_size, fix=fix, report=report)
+            return report
+        finally:
+            db.session.remove()
+
+def reconcile(ubs_ids=None, data_inicio=None, cutoff=None, status_final=None,
+              batch_size=2000, fix=True, workers=1):
+    """
+    Executa a reconciliação de slots e janelas de horário e, se
+    status_final for informado, a transição de status dos agendamentos
+    passados. Com ubs_ids, cada UBS é processada de forma independente,
+    em paralelo em até workers threads; sem ubs_ids, as tabelas inteiras
+    de cada shard em lotes.
+    Com fix=False apenas relata as divergências.
+    """
+    app = current_app._get_current_object()
+    args = (data_inicio, cutoff, status_final, batch_size, fix)
+
+    report = new_report()
+    if not ubs_ids:
+        for shard_key in shard_keys():
+            _merge(report, _reconcile_ubs(app, None, *args, shard_key=shard_key))
+        return report
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for partial in pool.map(lambda ubs_id: _reconcile_ubs(app, ubs_id, *args), ubs_ids):
+            _merge(report, partial)
+    return report
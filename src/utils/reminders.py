@@ -0,0 +1,129 @@
+# Lembretes por SMS/WhatsApp dos agendamentos do dia seguinte
+
+import asyncio
+from types import SimpleNamespace
+
+from flask import current_app
+from sqlalchemy import select
+
+from src.models.database import db, Appointment, User, UBS, Service
+from src.utils.notifications import dispatch, normalize_phone
+from src.utils.sharding import shard_keys, using
+
+MESSAGE_TEMPLATE = (
+    'Olá, {nome}! Lembrete: {servico} em {data}, {quando}, na {ubs} ({endereco}). '
+    'Se não puder comparecer, cancele pelo app para liberar a vaga.'
+)
+
+def render_message(row):
+    nome = (row.nome_completo or '').split(' ')[0] or 'cidadão'
+    quando = f'às {row.horario}' if row.horario else f'turno da {row.turno.lower()}'
+    return MESSAGE_TEMPLATE.format(
+        nome=nome,
+        servico=row.servico,
+        data=row.data_agendamento.strftime('%d/%m/%Y'),
+        quando=quando,
+        ubs=row.ubs,
+        endereco=row.endereco
+    )
+
+def fetch_batch(target_date, after_id, batch_size):
+    """
+    Próximo lote de agendamentos Confirmado do dia no shard selecionado,
+    paginado por id (keyset) sobre o índice (data_agendamento, id).
+    Cidadão, UBS e serviço vêm do banco principal numa consulta por
+    tabela, já que os agendamentos podem estar em outro banco.
+    """
+    conditions = [
+        Appointment.data_agendamento == target_date,
+        Appointment.status == 'Confirmado'
+    ]
+    if after_id is not None:
+        conditions.append(Appointment.id > after_id)
+    appointments = db.session.execute(
+        select(
+            Appointment.id,
+            Appointment.user_id,
+            Appointment.ubs_id,
+            Appointment.service_id,
+            Appointment.data_agendamento,
+            Appointment.turno,
+            Appointment.horario
+        )
+        .where(*conditions)
+        .order_by(Appointment.id)
+        .limit(batch_size)
+    ).all()
+    if not appointments:
+        return []
+
+    users = {row.id: row for row in db.session.execute(
+        select(User.id, User.nome_completo, User.celular)
+        .where(User.id.in_({row.user_id for row in appointments}))
+    )}
+    ubs = {row.id: row for row in db.session.execute(
+        select(UBS.id, UBS.nome, UBS.endereco).where(UBS.id.in_({row.ubs_id for row in appointments}))
+    )}
+    services = dict(db.session.execute(
+        select(Service.id, Service.nome).where(Service.id.in_({row.service_id for row in appointments}))
+    ).all())
+    return [
+        SimpleNamespace(
+            id=row.id,
+            data_agendamento=row.data_agendamento,
+            turno=row.turno,
+            horario=row.horario,
+            nome_completo=users[row.user_id].nome_completo,
+            celular=users[row.user_id].celular,
+            ubs=ubs[row.ubs_id].nome,
+            endereco=ubs[row.ubs_id].endereco,
+            servico=services[row.service_id]
+        )
+        for row in appointments
+    ]
+
+async def _reminder_batches(app, target_date, batch_size, counters):
+    # Um shard por vez; sem shards, shard_keys() é só o banco principal
+    for shard_key in shard_keys():
+        after_id = None
+        while True:
+            # A consulta é síncrona: roda numa thread para não travar os envios em andamento
+            rows = await asyncio.to_thread(_fetch_in_context, app, shard_key, target_date, after_id, batch_size)
+            if not rows:
+                break
+            after_id = rows[-1].id
+            counters['selecionados'] += len(rows)
+
+            messages = []
+            for row in rows:
+                phone = normalize_phone(row.celular)
+                if phone is None:
+                    counters['sem_celular'] += 1
+                    continue
+                messages.append((phone, render_message(row)))
+            yield messages
+
+def _fetch_in_context(app, shard_key, target_date, after_id, batch_size):
+    with app.app_context():
+        try:
+            with using(shard_key):
+                return fetch_batch(target_date, after_id, batch_size)
+        finally:
+            db.session.remove()
+
+def send_reminders(target_date, provider, batch_size=5000, concurrency=200, max_retries=3, rate_limit=None):
+    """Envia os lembretes de target_date e devolve as métricas do disparo"""
+    app = current_app._get_current_object()
+    counters = {'selecionados': 0, 'sem_celular': 0}
+
+    stats = asyncio.run(dispatch(
+        _reminder_batches(app, target_date, batch_size, counters),
+        provider,
+        concurrency=concurrency,
+        max_retries=max_retries,
+        rate_limit=rate_limit
+    ))
+
+    result = dict(counters)
+    result.update(stats.as_dict())
+    return result
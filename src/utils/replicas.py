@@ -0,0 +1,181 @@
+# Roteamento das leituras para réplicas do banco
+
+import contextlib
+import functools
+import itertools
+import threading
+import time
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context, request
+from flask_sqlalchemy.session import Session
+
+from src.utils.sharding import shard_bind
+
+REPLICA_PREFIX = 'replica_'
+
+# Cookie com o instante (epoch) até o qual o cliente deve ler do primário
+STICKY_COOKIE = 'db_primary_until'
+
+class RoutingSession(Session):
+    """
+    Sessão que envia as consultas SELECT para uma réplica quando a view
+    foi marcada com @read_replica. Escritas, flush e qualquer uso fora
+    de uma view marcada continuam no primário. Consultas às tabelas
+    particionadas vão ao shard selecionado (src/utils/sharding.py); as
+    réplicas valem só para o banco principal.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            engine = shard_bind(mapper, clause)
+            if engine is not None:
+                return engine
+        if bind is None and not self._flushing and isinstance(clause, sa.Select) and has_app_context():
+            engine = g.get('replica_engine')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+class ReplicaSet:
+    """
+    Réplicas configuradas e a defasagem de cada uma. Uma réplica com
+    defasagem acima de max_lag (ou que falhou na verificação) deixa de
+    receber leituras até a próxima verificação.
+    """
+
+    def __init__(self, max_lag=5.0, check_interval=5.0):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.keys = []
+        self._lag = {}
+        self._checked = {}
+        self._cycle = None
+        self._lock = threading.Lock()
+
+    def configure(self, keys, max_lag, check_interval):
+        self.keys = keys
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lag.clear()
+        self._checked.clear()
+        self._cycle = itertools.cycle(keys) if keys else None
+
+    def measure_lag(self, engine):
+        """Segundos de atraso da réplica em relação ao primário"""
+        with engine.connect() as conn:
+            if engine.dialect.name == 'postgresql':
+                # NULL quando o servidor não está em recuperação (não é standby)
+                lag = conn.execute(sa.text(
+                    'SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())'
+                )).scalar()
+                return float(lag or 0.0)
+            conn.execute(sa.text('SELECT 1'))
+            return 0.0
+
+    def lag(self, key, engine):
+        now = time.monotonic()
+        if now - self._checked.get(key, float('-inf')) >= self.check_interval:
+            with self._lock:
+                if now - self._checked.get(key, float('-inf')) >= self.check_interval:
+                    try:
+                        self._lag[key] = self.measure_lag(engine)
+                    except Exception:
+                        current_app.logger.exception('Réplica %s indisponível', key)
+                        self._lag[key] = None
+                    self._checked[key] = now
+        return self._lag.get(key)
+
+    def pick(self, engines):
+        """Próxima réplica saudável (rodízio), ou None para usar o primário"""
+        for _ in range(len(self.keys)):
+            with self._lock:
+                key = next(self._cycle)
+            lag = self.lag(key, engines[key])
+            if lag is not None and lag <= self.max_lag:
+                return engines[key]
+        return None
+
+replica_set = ReplicaSet()
+
+def _sticky_to_primary():
+    try:
+        return float(request.cookies.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def read_replica(view=None, methods=('GET', 'HEAD')):
+    """
+    Marca uma view como somente leitura: nas requisições com um dos
+    methods, as consultas vão para uma réplica. Clientes que acabaram de
+    escrever (cookie db_primary_until) continuam lendo do primário.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if replica_set.keys and request.method in methods and not _sticky_to_primary():
+                engines = current_app.extensions['sqlalchemy'].engines
+                g.replica_engine = replica_set.pick(engines)
+            return view(*args, **kwargs)
+        return wrapper
+
+    if view is not None:
+        return decorator(view)
+    return decorator
+
+def reading_from_replica():
+    """True dentro de uma view @read_replica que recebeu uma réplica"""
+    return has_app_context() and g.get('replica_engine') is not None
+
+@contextlib.contextmanager
+def primary_reads():
+    """As consultas do bloco vão ao primário, mesmo numa view marcada com @read_replica"""
+    engine = g.pop('replica_engine', None) if has_app_context() else None
+    try:
+        yield
+    finally:
+        if engine is not None:
+            g.replica_engine = engine
+
+def _mark_flush(session, flush_context):
+    if has_app_context() and (session.new or session.dirty or session.deleted):
+        g.wrote_to_primary = True
+
+def _mark_statement(orm_execute_state):
+    # UPDATE/INSERT/DELETE executados direto na sessão (ex.: reserva de janela)
+    if has_app_context() and not orm_execute_state.is_select:
+        g.wrote_to_primary = True
+
+def _set_sticky_cookie(response):
+    # Depois de uma escrita, as próximas leituras do cliente vão ao primário
+    # pelo tempo máximo de defasagem aceito nas réplicas
+    if g.get('wrote_to_primary') and replica_set.keys:
+        until = time.time() + replica_set.max_lag
+        response.set_cookie(STICKY_COOKIE, f'{until:.3f}', max_age=int(replica_set.max_lag) + 1,
+                            httponly=True, samesite='Lax')
+    return response
+
+def configure_binds(app, urls):
+    """Registra as URLs das réplicas em SQLALCHEMY_BINDS; chamar antes de db.init_app"""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for i, url in enumerate(urls):
+        binds[f'{REPLICA_PREFIX}{i}'] = url
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+def init_app(app):
+    """
+    Ativa o roteamento para as réplicas registradas com configure_binds.
+    REPLICA_MAX_LAG (segundos) é a defasagem tolerada e também o tempo
+    em que um cliente lê do primário depois de escrever;
+    REPLICA_LAG_CHECK_INTERVAL é o intervalo entre verificações.
+    """
+    keys = sorted(key for key in (app.config.get('SQLALCHEMY_BINDS') or {}) if key.startswith(REPLICA_PREFIX))
+    replica_set.configure(
+        keys,
+        max_lag=float(app.config.get('REPLICA_MAX_LAG', 5.0)),
+        check_interval=float(app.config.get('REPLICA_LAG_CHECK_INTERVAL', 5.0))
+    )
+    if keys:
+        sa.event.listen(RoutingSession, 'after_flush', _mark_flush)
+        sa.event.listen(RoutingSession, 'do_orm_execute', _mark_statement)
+        app.after_request(_set_sticky_cookie)
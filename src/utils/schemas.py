@@ -0,0 +1,406 @@
+# Validação das requisições antes de qualquer acesso ao banco: cada schema
+# é montado uma vez, na importação do blueprint, e converte o corpo JSON,
+# a query string ou os parâmetros da URL num resultado tipado (namedtuple).
+# Entrada inválida vira 400 sem abrir sessão nem consultar o cache.
+
+import math
+import re
+from collections import namedtuple
+from datetime import datetime
+from functools import lru_cache, wraps
+
+from flask import request, jsonify
+
+from src.utils.capacity import parse_horario
+from src.utils.reconciliation import FINAL_STATUSES
+from src.utils import bulk, export
+
+class ValidationError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+@lru_cache(maxsize=4096)
+def parse_date(value):
+    """'AAAA-MM-DD' -> date; poucas datas distintas se repetem em quase todas as requisições"""
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+# Default dos campos opcionais em que "ausente" difere de "vazio" (ex.: update-user)
+UNSET = object()
+
+_ID = re.compile(r'^[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}$')
+
+class Field:
+    """
+    Campo de um schema. convert() recebe o valor já presente e não vazio
+    e levanta ValueError/TypeError se ele for inválido. Com nullable, um
+    null enviado explicitamente chega como None (apaga o valor) em vez do
+    default, que fica só para o campo ausente.
+    """
+    # '' conta como ausente, exceto nos campos de texto
+    allow_empty = False
+
+    def __init__(self, required=False, default=None, message=None, nullable=False):
+        self.required = required
+        self.default = default
+        self.message = message
+        self.nullable = nullable
+
+    def convert(self, value):
+        return value
+
+class String(Field):
+    allow_empty = True
+
+    def __init__(self, max_length=255, **options):
+        super().__init__(**options)
+        self.max_length = max_length
+
+    def convert(self, value):
+        if not isinstance(value, str) or len(value) > self.max_length:
+            raise ValueError(value)
+        return value
+
+class Integer(Field):
+    def __init__(self, minimum=None, maximum=None, **options):
+        super().__init__(**options)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def convert(self, value):
+        # Na query string tudo chega como texto; no JSON, bool não conta como número
+        if isinstance(value, bool) or not isinstance(value, (int, str)):
+            raise TypeError(value)
+        value = int(value)
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(value)
+        if self.maximum is not None and value > self.maximum:
+            raise ValueError(value)
+        return value
+
+class Float(Field):
+    def __init__(self, minimum=None, maximum=None, **options):
+        super().__init__(**options)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    def convert(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise TypeError(value)
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError(value)
+        if self.minimum is not None and value < self.minimum:
+            raise ValueError(value)
+        if self.maximum is not None and value > self.maximum:
+            raise ValueError(value)
+        return value
+
+class Boolean(Field):
+    def convert(self, value):
+        if isinstance(value, bool):
+            return value
+        if value in ('true', '1'):
+            return True
+        if value in ('false', '0'):
+            return False
+        raise ValueError(value)
+
+class Date(Field):
+    def convert(self, value):
+        if not isinstance(value, str):
+            raise TypeError(value)
+        return parse_date(value)
+
+class Horario(Field):
+    """'HH:MM' -> minutos desde 00:00"""
+
+    def convert(self, value):
+        if not isinstance(value, str):
+            raise TypeError(value)
+        return parse_horario(value)
+
+class Id(Field):
+    """Id no formato UUID; o que não tem esse formato nunca existe no banco"""
+
+    def convert(self, value):
+        if not isinstance(value, str) or not _ID.match(value):
+            raise ValueError(value)
+        return value
+
+class Choice(Field):
+    def __init__(self, choices, **options):
+        super().__init__(**options)
+        self.choices = frozenset(choices)
+
+    def convert(self, value):
+        if value not in self.choices:
+            raise ValueError(value)
+        return value
+
+class List(Field):
+    def __init__(self, item, max_items=100, **options):
+        super().__init__(**options)
+        self.item = item
+        self.max_items = max_items
+
+    def convert(self, value):
+        if not isinstance(value, list) or len(value) > self.max_items:
+            raise ValueError(value)
+        return [self.item.convert(item) for item in value]
+
+class Schema:
+    """
+    Conjunto de campos. required_message substitui a mensagem de campo
+    obrigatório ausente de todos os campos (ex.: 'Todos os campos são
+    obrigatórios'), para manter as mensagens já usadas pelo frontend;
+    error_status é o código das respostas de erro (404 para ids da URL).
+    """
+
+    def __init__(self, name, required_message=None, error_status=400, **fields):
+        self.result = namedtuple(name, list(fields))
+        self.error_status = error_status
+        # Pré-compilado: o laço de load() só lê tuplas e chama convert
+        self._fields = tuple(
+            (
+                field_name,
+                field.convert,
+                field.required,
+                field.default,
+                field.allow_empty,
+                field.nullable,
+                required_message or field.message or f'{field_name} é obrigatório',
+                field.message or f'{field_name} inválido'
+            )
+            for field_name, field in fields.items()
+        )
+
+    def load(self, data):
+        if not hasattr(data, 'get'):
+            raise ValidationError('O corpo da requisição deve ser um objeto JSON')
+        values = []
+        for name, convert, required, default, allow_empty, nullable, missing_message, invalid_message in self._fields:
+            value = data.get(name)
+            if value is None or value == '' and (required or not allow_empty):
+                if required:
+                    raise ValidationError(missing_message, self.error_status)
+                values.append(None if nullable and value is None and name in data else default)
+                continue
+            try:
+                values.append(convert(value))
+            except (TypeError, ValueError):
+                raise ValidationError(invalid_message, self.error_status)
+        return self.result._make(values)
+
+NO_BODY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+def validate(body=None, args=None, path=None):
+    """
+    Valida a requisição antes da view: o corpo JSON (body) chega à view
+    como payload (None em GET/HEAD/OPTIONS, que não têm corpo), a
+    query string (args) como params e os parâmetros da URL (path)
+    substituem os originais, já convertidos.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*view_args, **kwargs):
+            try:
+                if path is not None:
+                    kwargs.update(path.load(kwargs)._asdict())
+                if body is not None:
+                    kwargs['payload'] = (
+                        body.load(request.get_json(silent=True)) if request.method not in NO_BODY_METHODS else None
+                    )
+                if args is not None:
+                    kwargs['params'] = args.load(request.args)
+            except ValidationError as e:
+                return jsonify({'error': e.message}), e.status
+            return view(*view_args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- Schemas das rotas (Flask e ASGI) ----------------------------------------
+
+TURNOS = ('Manhã', 'Tarde')
+
+def path_id(name, message):
+    """Id na URL: com formato inválido, o recurso não existe (404)"""
+    return Schema(name.title().replace('_', ''), error_status=404, **{name: Id(required=True, message=message)})
+
+LOGIN = Schema(
+    'Login', required_message='CPF e data de nascimento são obrigatórios',
+    cpf=String(max_length=14, required=True),
+    data_nascimento=Date(required=True, message='Data de nascimento inválida')
+)
+
+UPDATE_USER = Schema(
+    'UpdateUser', required_message='ID do usuário é obrigatório',
+    user_id=Id(required=True, message='ID do usuário inválido'),
+    nome_completo=String(max_length=255, default=UNSET, nullable=True),
+    celular=String(max_length=15, default=UNSET, nullable=True),
+    carteira_sus=String(max_length=20, default=UNSET, nullable=True)
+)
+
+NEAREST_UBS = Schema(
+    'NearestUBS',
+    service_id=Id(required=True, message='Serviço é obrigatório'),
+    lat=Float(minimum=-90, maximum=90, required=True, message='lat e lon são obrigatórios e devem ser numéricos'),
+    lon=Float(minimum=-180, maximum=180, required=True, message='lat e lon são obrigatórios e devem ser numéricos'),
+    dias=Integer(minimum=1, maximum=366, default=7, message='dias inválido'),
+    limite=Integer(minimum=1, default=5, message='limite inválido'),
+    raio_km=Float(minimum=0, message='raio_km inválido')
+)
+
+SEARCH = Schema(
+    'Search',
+    q=String(max_length=200, default=''),
+    tipo=Choice(('ubs', 'service', 'city'), message='Tipo inválido'),
+    limite=Integer(minimum=1, default=10, message='limite inválido')
+)
+
+AVAILABILITY = Schema(
+    'Availability', required_message='UBS e serviço são obrigatórios',
+    ubs_id=Id(required=True, message='UBS inválida'),
+    service_id=Id(required=True, message='Serviço inválido')
+)
+
+CREATE_APPOINTMENT = Schema(
+    'CreateAppointment', required_message='Todos os campos são obrigatórios',
+    user_id=Id(required=True, message='Usuário inválido'),
+    ubs_id=Id(required=True, message='UBS inválida'),
+    service_id=Id(required=True, message='Serviço inválido'),
+    data_agendamento=Date(required=True, message='Data de agendamento inválida'),
+    turno=Choice(TURNOS, message='Turno inválido'),
+    horario=Horario(message='Horário inválido')
+)
+
+ADMIN_LOGIN = Schema(
+    'AdminLogin', required_message='Username e senha são obrigatórios',
+    username=String(max_length=50, required=True),
+    password=String(max_length=128, required=True)
+)
+
+CREATE_ADMIN = Schema(
+    'CreateAdmin', required_message='Username e senha são obrigatórios',
+    username=String(max_length=50, required=True, message='Username inválido'),
+    password=String(max_length=128, required=True, message='Senha inválida'),
+    role=Choice(('SuperAdmin', 'UBSManager'), default='UBSManager', message='Perfil inválido'),
+    ubs_id=Id(message='UBS inválida')
+)
+
+CITY = Schema(
+    'City', required_message='Nome da cidade é obrigatório',
+    nome=String(max_length=100, required=True, message='Nome da cidade inválido')
+)
+
+CREATE_UBS = Schema(
+    'CreateUBS', required_message='Nome e cidade são obrigatórios',
+    nome=String(max_length=255, required=True, message='Nome inválido'),
+    endereco=String(max_length=500),
+    cidade_id=Id(required=True, message='Cidade inválida'),
+    latitude=Float(minimum=-90, maximum=90, message='Coordenadas inválidas'),
+    longitude=Float(minimum=-180, maximum=180, message='Coordenadas inválidas')
+)
+
+UPDATE_UBS = Schema(
+    'UpdateUBS',
+    nome=String(max_length=255, default=UNSET, message='Nome inválido'),
+    endereco=String(max_length=500, default=UNSET),
+    latitude=Float(minimum=-90, maximum=90, default=UNSET, message='Coordenadas inválidas'),
+    longitude=Float(minimum=-180, maximum=180, default=UNSET, message='Coordenadas inválidas')
+)
+
+CREATE_SERVICE = Schema(
+    'CreateService', required_message='Nome do serviço é obrigatório',
+    nome=String(max_length=255, required=True, message='Nome inválido'),
+    descricao=String(max_length=5000, default='')
+)
+
+UPDATE_SERVICE = Schema(
+    'UpdateService',
+    nome=String(max_length=255, default=UNSET, message='Nome inválido'),
+    descricao=String(max_length=5000, default=UNSET)
+)
+
+UBS_SERVICE = Schema(
+    'UBSService', required_message='UBS e serviço são obrigatórios',
+    ubs_id=Id(required=True, message='UBS ou serviço não encontrado'),
+    service_id=Id(required=True, message='UBS ou serviço não encontrado')
+)
+
+CREATE_SLOT = Schema(
+    'CreateSlot', required_message='Todos os campos são obrigatórios',
+    ubs_id=Id(required=True, message='UBS inválida'),
+    service_id=Id(required=True, message='Serviço inválido'),
+    data=Date(required=True, message='Data inválida'),
+    turno=Choice(TURNOS, required=True, message='Turno inválido'),
+    quantidade_total=Integer(minimum=1, maximum=10000, required=True, message='Quantidade inválida')
+)
+
+CREATE_CAPACITY = Schema(
+    'CreateCapacity', required_message='Todos os campos são obrigatórios',
+    ubs_id=Id(required=True, message='UBS inválida'),
+    service_id=Id(required=True, message='Serviço inválido'),
+    data_inicio=Date(required=True, message='Data ou horário inválido'),
+    data_fim=Date(required=True, message='Data ou horário inválido'),
+    inicio=Horario(default=7 * 60, message='Data ou horário inválido'),
+    fim=Horario(default=17 * 60, message='Data ou horário inválido'),
+    intervalo_minutos=Integer(minimum=1, maximum=240, default=15, message='Período ou intervalo inválido'),
+    vagas_por_janela=Integer(minimum=1, maximum=10000, required=True, message='vagas_por_janela inválido'),
+    pausa_inicio=Horario(message='Data ou horário inválido'),
+    pausa_fim=Horario(message='Data ou horário inválido'),
+    incluir_fim_de_semana=Boolean(default=False, message='incluir_fim_de_semana inválido')
+)
+
+APPOINTMENT_STATUS = Schema(
+    'AppointmentStatus',
+    status=Choice(FINAL_STATUSES, required=True, message=f"Status deve ser um de: {', '.join(FINAL_STATUSES)}")
+)
+
+BULK_OPERATION = Schema(
+    'BulkOperation', required_message='ubs_id, data e acao são obrigatórios',
+    ubs_id=Id(required=True, message='UBS inválida'),
+    data=Date(required=True, message='Data inválida'),
+    acao=Choice(bulk.ACOES, required=True, message=f"Ação deve ser uma de: {', '.join(bulk.ACOES)}"),
+    turnos=List(Choice(bulk.TURNOS), max_items=len(bulk.TURNOS),
+                message=f"Turno deve ser um de: {', '.join(bulk.TURNOS)}"),
+    turno=Choice(bulk.TURNOS, message=f"Turno deve ser um de: {', '.join(bulk.TURNOS)}"),
+    nova_data=Date(message='Data inválida'),
+    novo_turno=Choice(bulk.TURNOS, message=f"Turno deve ser um de: {', '.join(bulk.TURNOS)}"),
+    fechar_vagas=Boolean(default=True, message='fechar_vagas inválido'),
+    motivo=String(max_length=255)
+)
+
+PROFILING = Schema(
+    'Profiling',
+    segundos=Integer(minimum=1, default=30, message='segundos e intervalo_ms devem ser inteiros'),
+    intervalo_ms=Integer(minimum=1, default=10, message='segundos e intervalo_ms devem ser inteiros')
+)
+
+EXPORT = Schema(
+    'Export',
+    formato=Choice(export.FORMATS, default='csv', message=f"Formato deve ser um de: {', '.join(export.FORMATS)}"),
+    colunas=String(max_length=1000),
+    service_id=Id(message='Serviço inválido'),
+    incluir_historico=Boolean(default=False, message='incluir_historico inválido')
+)
+
+AUDIT = Schema(
+    'Audit',
+    limite=Integer(minimum=1, default=100, message='limite inválido'),
+    action=String(max_length=40),
+    antes_de=Integer(minimum=1, message='antes_de inválido')
+)
+
+LISTING = Schema(
+    'Listing',
+    service_id=Id(message='Serviço inválido'),
+    incluir_historico=Boolean(default=False, message='incluir_historico inválido')
+)
+
+USER_ID = path_id('user_id', 'Usuário não encontrado')
+UBS_ID = path_id('ubs_id', 'UBS não encontrada')
+SERVICE_ID = path_id('service_id', 'Serviço não encontrado')
+APPOINTMENT_ID = path_id('appointment_id', 'Agendamento não encontrado')
+OPERATION_ID = path_id('operation_id', 'Operação não encontrada')
@@ -0,0 +1,196 @@
+# Índice invertido em memória para busca de UBS, serviços e cidades
+
+import re
+import threading
+import unicodedata
+from collections import defaultdict
+
+from src.models.database import db, City, UBS, Service
+from src.utils.cache import cache, CATALOG
+from src.utils.replicas import primary_reads
+
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
+
+def normalize(text):
+    """Minúsculas, sem acentos, separado em palavras: 'São José' -> ['sao', 'jose']"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return _NON_ALNUM.sub(' ', text).split()
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class SearchIndex:
+    """
+    Cada palavra dos nomes é indexada por todos os seus prefixos, então
+    "vila mad" é a interseção dos documentos com palavras começando por
+    "vila" e por "mad". Sem resultado por prefixo, cai para similaridade
+    por trigramas, que tolera erros de digitação ("madalna").
+    """
+
+    def __init__(self, max_prefix=20, min_similarity=0.4):
+        self.max_prefix = max_prefix
+        self.min_similarity = min_similarity
+        self.docs = {}
+        self.prefixes = defaultdict(set)
+        self.trigram_index = defaultdict(set)
+        self.loaded = False
+        self.version = None
+        self._lock = threading.RLock()
+
+    def _postings(self, tokens):
+        for token in set(tokens):
+            for n in range(1, min(len(token), self.max_prefix) + 1):
+                yield self.prefixes, token[:n]
+            for gram in trigrams(token):
+                yield self.trigram_index, gram
+
+    def add(self, tipo, doc_id, nome, detalhe=None):
+        """Inclui ou atualiza um documento"""
+        key = (tipo, doc_id)
+        with self._lock:
+            self._remove(key)
+            tokens = normalize(nome)
+            self.docs[key] = {'tipo': tipo, 'id': doc_id, 'nome': nome, 'detalhe': detalhe, 'tokens': tokens}
+            for index, term in self._postings(tokens):
+                index[term].add(key)
+
+    def remove(self, tipo, doc_id):
+        with self._lock:
+            self._remove((tipo, doc_id))
+
+    def _remove(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        for index, term in self._postings(doc['tokens']):
+            postings = index.get(term)
+            if postings is not None:
+                postings.discard(key)
+                if not postings:
+                    del index[term]
+
+    def clear(self):
+        with self._lock:
+            self.docs.clear()
+            self.prefixes.clear()
+            self.trigram_index.clear()
+            self.loaded = False
+
+    def _prefix_matches(self, tokens):
+        candidates = None
+        for token in tokens:
+            keys = self.prefixes.get(token[:self.max_prefix], set())
+            if len(token) > self.max_prefix:
+                keys = {k for k in keys if any(t.startswith(token) for t in self.docs[k]['tokens'])}
+            candidates = keys if candidates is None else candidates & keys
+            if not candidates:
+                return {}
+
+        scores = {}
+        for key in candidates:
+            doc_tokens = self.docs[key]['tokens']
+            # Palavra completa vale mais que prefixo; nomes curtos desempatam
+            exact = sum(1 for token in tokens if token in doc_tokens)
+            scores[key] = len(tokens) + exact - len(doc_tokens) * 0.01
+        return scores
+
+    def _fuzzy_matches(self, tokens):
+        grams = set()
+        for token in tokens:
+            grams |= trigrams(token)
+
+        hits = defaultdict(int)
+        for gram in grams:
+            for key in self.trigram_index.get(gram, ()):
+                hits[key] += 1
+
+        return {
+            key: count / len(grams)
+            for key, count in hits.items()
+            if count / len(grams) >= self.min_similarity
+        }
+
+    def search(self, query, tipo=None, limit=10):
+        tokens = normalize(query)
+        if not tokens:
+            return []
+
+        with self._lock:
+            scores = self._prefix_matches(tokens) or self._fuzzy_matches(tokens)
+            if tipo:
+                scores = {key: score for key, score in scores.items() if key[0] == tipo}
+            best = sorted(scores.items(), key=lambda item: (-item[1], self.docs[item[0]]['nome']))[:limit]
+            return [
+                {'tipo': key[0], 'id': key[1], 'nome': self.docs[key]['nome'], 'detalhe': self.docs[key]['detalhe']}
+                for key, _ in best
+            ]
+
+    def ensure_loaded(self):
+        """
+        Carrega o catálogo do banco na primeira busca do processo. Depois,
+        quando a versão do catálogo no cache muda, aplica só as entradas
+        publicadas pelos outros workers (cache.publish); sem esse registro
+        recarrega tudo.
+        """
+        version = cache.version(CATALOG)
+        if self.loaded and version == self.version:
+            return
+        with self._lock:
+            if self.loaded and version == self.version:
+                return
+            changes = cache.changes_since(CATALOG, self.version, version) if self.loaded else None
+            # Do primário: uma réplica atrasada devolveria o catálogo de antes
+            # da alteração, e ele ficaria no índice com a versão nova
+            with primary_reads():
+                if changes is None:
+                    self._load_all()
+                else:
+                    for tipo, doc_id in changes:
+                        self._refresh(tipo, doc_id)
+            self.loaded = True
+            self.version = version
+
+    def mark_current(self, version):
+        """
+        Chamado pelo worker que já atualizou o índice com add/remove e
+        publicou a alteração: avança a versão se não há outra pendente
+        """
+        with self._lock:
+            if self.loaded and version is not None and self.version == version - 1:
+                self.version = version
+
+    def _load_all(self):
+        self.clear()
+        for city_id, nome in db.session.execute(db.select(City.id, City.nome)):
+            self.add('city', city_id, nome)
+        for ubs_id, nome, cidade_nome in db.session.execute(
+            db.select(UBS.id, UBS.nome, City.nome).join(City, UBS.cidade_id == City.id)
+        ):
+            self.add('ubs', ubs_id, nome, cidade_nome)
+        for service_id, nome, descricao in db.session.execute(
+            db.select(Service.id, Service.nome, Service.descricao)
+        ):
+            self.add('service', service_id, nome, descricao)
+
+    def _refresh(self, tipo, doc_id):
+        """Relê uma entrada do banco; removida se não existe mais"""
+        if tipo == 'city':
+            row = db.session.execute(db.select(City.nome).where(City.id == doc_id)).first()
+        elif tipo == 'ubs':
+            row = db.session.execute(
+                db.select(UBS.nome, City.nome).join(City, UBS.cidade_id == City.id).where(UBS.id == doc_id)
+            ).first()
+        elif tipo == 'service':
+            row = db.session.execute(
+                db.select(Service.nome, Service.descricao).where(Service.id == doc_id)
+            ).first()
+        else:
+            return  # ex.: associação UBS-serviço, que não muda a busca
+        if row is None:
+            self.remove(tipo, doc_id)
+        else:
+            self.add(tipo, doc_id, *row)
+
+search_index = SearchIndex()
@@ -0,0 +1,239 @@
+# Particionamento horizontal (shards) dos dados de agendamento por cidade:
+# slots, janelas de horário e agendamentos (e seus arquivos) das UBS de uma
+# cidade ficam num dos bancos de DATABASE_SHARD_URLS. Usuários, catálogo,
+# contadores, administração e o diretório cidade -> shard ficam no banco
+# principal. Sem shards configurados nada muda: tudo vai para o principal.
+
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import sqlalchemy as sa
+from flask import current_app, g, has_app_context
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql.util import find_tables
+
+SHARD_PREFIX = 'shard_'
+
+# Tabelas particionadas; todas as demais são globais (banco principal)
+SHARDED_TABLES = frozenset({'appointments', 'slots', 'day_capacities', 'appointments_archive', 'slots_archive'})
+
+class ShardRouter:
+    """
+    Shards configurados e o diretório em memória: cidade -> shard e
+    UBS -> cidade. Nenhum dos dois muda depois de gravado (uma cidade não
+    troca de shard e uma UBS não troca de cidade), então não expiram.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self._city_shard = {}
+        self._ubs_city = {}
+
+    def configure(self, keys):
+        self.keys = keys
+        self._city_shard.clear()
+        self._ubs_city.clear()
+
+    def shard_for_city(self, cidade_id):
+        shard = self._city_shard.get(cidade_id)
+        if shard is None:
+            from src.models.database import db, CityShard
+            shard = db.session.execute(
+                sa.select(CityShard.shard).where(CityShard.cidade_id == cidade_id)
+            ).scalar() or self.assign(cidade_id)
+            self._city_shard[cidade_id] = shard
+        return shard
+
+    def shard_for_ubs(self, ubs_id):
+        """Shard da UBS, ou None se ela não existe"""
+        cidade_id = self._ubs_city.get(ubs_id)
+        if cidade_id is None:
+            from src.models.database import db, UBS
+            cidade_id = db.session.execute(sa.select(UBS.cidade_id).where(UBS.id == ubs_id)).scalar()
+            if cidade_id is None:
+                return None
+            self._ubs_city[ubs_id] = cidade_id
+        return self.shard_for_city(cidade_id)
+
+    def assign(self, cidade_id):
+        """
+        Atribui a cidade ao shard com menos cidades. Usa uma transação
+        própria, para que a atribuição valha mesmo se a requisição falhar
+        depois; chamar antes de escrever na sessão (SQLite trava o banco).
+        """
+        from src.models.database import db, CityShard
+        table = CityShard.__table__
+        with db.engine.begin() as conn:
+            counts = dict(conn.execute(
+                sa.select(table.c.shard, sa.func.count()).group_by(table.c.shard)
+            ).all())
+            shard = min(self.keys, key=lambda key: (counts.get(key, 0), key))
+            dialect = postgresql if conn.dialect.name == 'postgresql' else sqlite
+            conn.execute(
+                dialect.insert(table)
+                .values(cidade_id=cidade_id, shard=shard)
+                .on_conflict_do_nothing(index_elements=['cidade_id'])
+            )
+            # Outro worker pode ter atribuído a mesma cidade no meio tempo
+            return conn.execute(sa.select(table.c.shard).where(table.c.cidade_id == cidade_id)).scalar_one()
+
+shard_router = ShardRouter()
+
+def shard_keys():
+    """Shards a percorrer; [None] (o banco principal) quando não há shards"""
+    return list(shard_router.keys) or [None]
+
+def use_shard(key):
+    """Envia as consultas às tabelas particionadas da requisição/contexto atual ao shard key"""
+    g.shard_key = key
+
+@contextlib.contextmanager
+def using(key):
+    previous = g.get('shard_key')
+    g.shard_key = key
+    try:
+        yield
+    finally:
+        g.shard_key = previous
+
+def route_ubs(ubs_id):
+    """Seleciona o shard da UBS; False se há shards e a UBS não existe"""
+    if not shard_router.keys:
+        return True
+    key = shard_router.shard_for_ubs(ubs_id)
+    use_shard(key)
+    return key is not None
+
+def group_by_shard(ubs_ids):
+    """{shard: [ubs_id, ...]}; UBS inexistentes ficam de fora"""
+    if not shard_router.keys:
+        return {None: list(ubs_ids)}
+    groups = {}
+    for ubs_id in ubs_ids:
+        key = shard_router.shard_for_ubs(ubs_id)
+        if key is not None:
+            groups.setdefault(key, []).append(ubs_id)
+    return groups
+
+def _run_in_shard(app, key, function, args):
+    with app.app_context():
+        try:
+            use_shard(key)
+            return function(*args)
+        finally:
+            from src.models.database import db
+            db.session.remove()
+
+def fan_out(function, *args):
+    """
+    Executa function(*args) em todos os shards, em paralelo (uma thread e
+    uma sessão por shard), e devolve os resultados na ordem dos shards.
+    Sem shards, executa uma vez no contexto atual.
+    """
+    if not shard_router.keys:
+        return [function(*args)]
+    app = current_app._get_current_object()
+    with ThreadPoolExecutor(max_workers=len(shard_router.keys)) as pool:
+        return list(pool.map(lambda key: _run_in_shard(app, key, function, args), shard_router.keys))
+
+def collect(ubs_id, function, *args):
+    """
+    Listagem sobre tabelas particionadas: só no shard da UBS quando
+    ubs_id é informado, senão em todos os shards em paralelo; as listas
+    devolvidas por function(*args) são concatenadas.
+    """
+    if ubs_id:
+        return function(*args) if route_ubs(ubs_id) else []
+    return [item for part in fan_out(function, *args) for item in part]
+
+def assign_city(cidade_id):
+    """Grava no diretório o shard de uma cidade nova (nada a fazer sem shards)"""
+    return shard_router.shard_for_city(cidade_id) if shard_router.keys else None
+
+def _exists(model, record_id):
+    from src.models.database import db
+    return db.session.execute(sa.select(model.id).where(model.id == record_id)).first() is not None
+
+def route_record(model, record_id):
+    """
+    Seleciona o shard que contém o registro (procurado em todos os shards,
+    em paralelo); False se há shards e nenhum deles o contém
+    """
+    if not shard_router.keys:
+        return True
+    for key, found in zip(shard_router.keys, fan_out(_exists, model, record_id)):
+        if found:
+            use_shard(key)
+            return True
+    return False
+
+def _table_names(mapper, clause):
+    names = set()
+    if mapper is not None:
+        names.add(mapper.local_table.name)
+    if clause is not None:
+        names.update(
+            table.name for table in find_tables(clause, check_columns=True, include_crud=True)
+            if isinstance(table, sa.Table)
+        )
+    return names
+
+def shard_bind(mapper=None, clause=None):
+    """Engine do shard selecionado quando a consulta usa tabelas particionadas (chamado por RoutingSession)"""
+    if not shard_router.keys or not has_app_context():
+        return None
+    names = _table_names(mapper, clause)
+    if not names & SHARDED_TABLES:
+        return None
+    if names - SHARDED_TABLES:
+        raise RuntimeError(f'Consulta junta tabelas globais e particionadas: {", ".join(sorted(names))}')
+    key = g.get('shard_key')
+    if key is None:
+        raise RuntimeError(f'Nenhum shard selecionado para a consulta em {", ".join(sorted(names))}')
+    return current_app.extensions['sqlalchemy'].engines[key]
+
+def shard_metadata():
+    """
+    Cópia das tabelas particionadas para os shards, sem as chaves
+    estrangeiras para as tabelas globais (que estão em outro banco)
+    """
+    from src.models.database import db
+    metadata = sa.MetaData()
+    for name in sorted(SHARDED_TABLES):
+        source = db.metadata.tables[name]
+        table = sa.Table(name, metadata, *[
+            sa.Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+            for column in source.columns
+        ])
+        for index in source.indexes:
+            sa.Index(index.name, *[table.c[column.name] for column in index.columns], unique=index.unique)
+        for constraint in source.constraints:
+            if isinstance(constraint, sa.UniqueConstraint):
+                table.append_constraint(sa.UniqueConstraint(*[column.name for column in constraint.columns]))
+    return metadata
+
+def create_all():
+    engines = current_app.extensions['sqlalchemy'].engines
+    metadata = shard_metadata()
+    for key in shard_router.keys:
+        metadata.create_all(engines[key])
+
+def drop_all():
+    engines = current_app.extensions['sqlalchemy'].engines
+    metadata = shard_metadata()
+    for key in shard_router.keys:
+        metadata.drop_all(engines[key])
+
+def configure_binds(app, urls):
+    """Registra as URLs dos shards em SQLALCHEMY_BINDS; chamar antes de db.init_app"""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for i, url in enumerate(urls):
+        binds[f'{SHARD_PREFIX}{i}'] = url
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+def init_app(app):
+    """Ativa o roteamento para os shards registrados com configure_binds"""
+    shard_router.configure(sorted(
+        (key for key in (app.config.get('SQLALCHEMY_BINDS') or {}) if key.startswith(SHARD_PREFIX)),
+        key=lambda key: int(key[len(SHARD_PREFIX):])
+    ))
@@ -0,0 +1,109 @@
+# Escopo por UBS (tenant) das consultas administrativas
+
+from datetime import date, timedelta
+
+from flask import request, g
+
+from src.models.database import db, Admin
+from src.utils.schemas import parse_date
+
+ADMIN_HEADER = 'X-Admin-Id'
+
+# Maior período aceito numa listagem administrativa
+MAX_RANGE_DAYS = 366
+
+# Período usado quando um gestor de UBS não informa data_inicio/data_fim
+DEFAULT_PAST_DAYS = 30
+DEFAULT_FUTURE_DAYS = 90
+
+class ScopeError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+def current_admin():
+    """Administrador identificado pelo cabeçalho X-Admin-Id (None se ausente)"""
+    admin_id = request.headers.get(ADMIN_HEADER)
+    if g.get('admin_id') != admin_id or 'admin' not in g:
+        g.admin_id = admin_id
+        g.admin = db.session.get(Admin, admin_id) if admin_id else None
+    if admin_id and g.admin is None:
+        raise ScopeError('Administrador não encontrado', 401)
+    return g.admin
+
+class TenantScope:
+    """Filtros obrigatórios (UBS e período) de uma consulta administrativa"""
+
+    def __init__(self, ubs_id, data_inicio, data_fim):
+        self.ubs_id = ubs_id
+        self.data_inicio = data_inicio
+        self.data_fim = data_fim
+
+    def apply(self, query, model, date_column):
+        if self.ubs_id:
+            query = query.filter(model.ubs_id == self.ubs_id)
+        return query.filter(date_column >= self.data_inicio, date_column <= self.data_fim)
+
+def _parse_date(value):
+    try:
+        return parse_date(value)
+    except ValueError:
+        raise ScopeError('Data inválida')
+
+def require_admin():
+    """Rotas com escopo por UBS: exige um administrador identificado pelo X-Admin-Id"""
+    admin = current_admin()
+    if admin is None:
+        raise ScopeError('Administrador não identificado', 401)
+    return admin
+
+def check_ubs_access(ubs_id):
+    """Gestores de UBS só podem ler ou alterar a própria UBS"""
+    admin = require_admin()
+    if admin.role == 'UBSManager':
+        if not admin.ubs_id:
+            raise ScopeError('Gestor sem UBS vinculada', 403)
+        if ubs_id and ubs_id != admin.ubs_id:
+            raise ScopeError('Acesso negado a outra UBS', 403)
+        return admin.ubs_id
+    return ubs_id
+
+def require_super_admin():
+    """Rotas de diagnóstico: somente um SuperAdmin identificado pelo X-Admin-Id"""
+    admin = require_admin()
+    if admin.role != 'SuperAdmin':
+        raise ScopeError('Acesso negado', 403)
+    return admin
+
+def tenant_scope(args):
+    """
+    Monta o escopo de uma listagem a partir dos parâmetros da requisição.
+    Para UBSManager o ubs_id vem do cadastro do gestor, não da requisição.
+    O período é sempre limitado a MAX_RANGE_DAYS. O SuperAdmin informa
+    data_inicio e data_fim; o gestor, já restrito à própria UBS, pode
+    omiti-los e recebe a janela padrão em volta de hoje.
+    """
+    ubs_id = check_ubs_access(args.get('ubs_id'))
+
+    data_inicio = _parse_date(args['data_inicio']) if args.get('data_inicio') else None
+    data_fim = _parse_date(args['data_fim']) if args.get('data_fim') else None
+
+    if current_admin().role != 'UBSManager' and (data_inicio is None or data_fim is None):
+        raise ScopeError('Informe data_inicio e data_fim')
+
+    if data_inicio is None and data_fim is None:
+        today = date.today()
+        data_inicio = today - timedelta(days=DEFAULT_PAST_DAYS)
+        data_fim = today + timedelta(days=DEFAULT_FUTURE_DAYS)
+    elif data_inicio is None:
+        data_inicio = data_fim - timedelta(days=MAX_RANGE_DAYS)
+    elif data_fim is None:
+        data_fim = data_inicio + timedelta(days=MAX_RANGE_DAYS)
+
+    if data_fim < data_inicio:
+        raise ScopeError('Período inválido')
+    if (data_fim - data_inicio).days > MAX_RANGE_DAYS:
+        raise ScopeError(f'Período máximo de {MAX_RANGE_DAYS} dias')
+
+    return TenantScope(ubs_id, data_inicio, data_fim)
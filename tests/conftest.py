@@ -0,0 +1,107 @@
+# Ambiente dos testes: banco principal e dois shards em SQLite num diretório
+# temporário, configurados pelas mesmas variáveis de ambiente da aplicação
+# antes de importar src.main (que cria as tabelas na importação).
+# TEST_SHARDS=0 roda tudo só no banco principal.
+
+import itertools
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_tmp = tempfile.mkdtemp(prefix='agendamento-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_tmp, 'app.db')}"
+if os.environ.get('TEST_SHARDS', '2') != '0':
+    os.environ['DATABASE_SHARD_URLS'] = ','.join(
+        f"sqlite:///{os.path.join(_tmp, f'shard{i}.db')}" for i in range(2)
+    )
+os.environ.setdefault('NOTIFICATION_PROVIDER', 'fake')
+for key in ('DATABASE_REPLICA_URLS', 'CACHE_BACKEND', 'CACHE_URL', 'AUDIT_SINK', 'AUDIT_DIR'):
+    os.environ.pop(key, None)
+
+from src.main import app as flask_app  # noqa: E402
+from src.models.database import db, Admin, User  # noqa: E402
+from src.utils.sharding import shard_router  # noqa: E402
+
+_cpfs = itertools.count(10000000000)
+
+# Datas dos slots, em dias a partir de hoje: afastadas mais que o intervalo
+# padrão por serviço (30 dias) para que cada uma aceite o mesmo serviço
+DIAS = (5, 40, 75, 110)
+
+def day(offset):
+    return (date.today() + timedelta(days=offset)).isoformat()
+
+@pytest.fixture(scope='session')
+def app():
+    return flask_app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture(scope='session')
+def admin_headers(app):
+    with app.app_context():
+        admin = Admin(username='super-testes', password_hash='-', role='SuperAdmin')
+        db.session.add(admin)
+        db.session.commit()
+        return {'X-Admin-Id': admin.id}
+
+def _post(client, path, body, headers=None):
+    response = client.post(path, json=body, headers=headers)
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+@pytest.fixture(scope='session')
+def catalog(app, admin_headers):
+    """
+    Duas cidades (com shards configurados, cada uma num shard), uma UBS
+    em cada e dois serviços oferecidos pelas duas, com slots de 10 vagas
+    nos dois turnos das datas de DIAS.
+    """
+    client = app.test_client()
+    cities = [_post(client, '/api/admin/cities', {'nome': f'Cidade {i}'})['city_id'] for i in range(2)]
+    ubs = [
+        _post(client, '/api/admin/ubs', {'nome': f'UBS {i}', 'cidade_id': city_id})['ubs_id']
+        for i, city_id in enumerate(cities)
+    ]
+    services = [
+        _post(client, '/api/admin/services', {'nome': nome})['service_id']
+        for nome in ('Consulta', 'Vacina')
+    ]
+    for ubs_id in ubs:
+        for service_id in services:
+            _post(client, '/api/admin/ubs-services', {'ubs_id': ubs_id, 'service_id': service_id})
+            for dia in DIAS:
+                for turno in ('Manhã', 'Tarde'):
+                    _post(client, '/api/admin/slots', {
+                        'ubs_id': ubs_id,
+                        'service_id': service_id,
+                        'data': day(dia),
+                        'turno': turno,
+                        'quantidade_total': 10
+                    }, admin_headers)
+    return {'cities': cities, 'ubs': ubs, 'services': services}
+
+def new_user(app, **fields):
+    """Usuário gravado direto no banco, com CPF único; devolve o id"""
+    with app.app_context():
+        user = User(cpf=str(next(_cpfs)), data_nascimento=date(1990, 1, 1), **fields)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+@pytest.fixture
+def user_id(app):
+    return new_user(app, nome_completo='Paciente')
+
+@pytest.fixture
+def sharded():
+    if len(shard_router.keys) < 2:
+        pytest.skip('requer dois shards (TEST_SHARDS=0)')
+    return shard_router.keys
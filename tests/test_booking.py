@@ -0,0 +1,165 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from conftest import DIAS, day, new_user
+from src.models.database import db, Slot, UserBookingState
+from src.utils import booking_rules
+from src.utils.booking_rules import (
+    BookingState, apply_change, apply_changes, booking, rescheduling, service_key, state_query
+)
+from src.utils.sharding import route_ubs
+
+def book(client, user_id, ubs_id, service_id, offset, turno='Manhã'):
+    return client.post('/api/appointments/create', json={
+        'user_id': user_id,
+        'ubs_id': ubs_id,
+        'service_id': service_id,
+        'data_agendamento': day(offset),
+        'turno': turno
+    })
+
+def state(app, user_id):
+    with app.app_context():
+        return BookingState.from_row(db.session.execute(state_query(user_id)).first())
+
+def disponivel(app, ubs_id, service_id, offset, turno='Manhã'):
+    with app.app_context():
+        route_ubs(ubs_id)
+        return Slot.query.filter_by(
+            ubs_id=ubs_id, service_id=service_id,
+            data=date.today() + timedelta(days=offset), turno=turno
+        ).one().quantidade_disponivel
+
+def test_create_and_cancel_update_counters(app, client, catalog, user_id):
+    ubs_id, service_id = catalog['ubs'][0], catalog['services'][0]
+    antes = disponivel(app, ubs_id, service_id, DIAS[0])
+
+    response = book(client, user_id, ubs_id, service_id, DIAS[0])
+    assert response.status_code == 200, response.get_json()
+    appointment_id = response.get_json()['appointment_id']
+
+    counters = state(app, user_id)
+    assert counters.version == 0
+    assert counters.entries == [((date.today() + timedelta(days=DIAS[0])).toordinal(), 1, service_key(service_id))]
+    assert disponivel(app, ubs_id, service_id, DIAS[0]) == antes - 1
+
+    response = client.put(f'/api/appointments/cancel/{appointment_id}')
+    assert response.status_code == 200, response.get_json()
+
+    counters = state(app, user_id)
+    assert counters.version == 1
+    assert counters.entries == []
+    assert disponivel(app, ubs_id, service_id, DIAS[0]) == antes
+
+    # Cancelar de novo não mexe nos contadores nem na vaga
+    assert client.put(f'/api/appointments/cancel/{appointment_id}').status_code == 400
+    assert state(app, user_id).version == 1
+    assert disponivel(app, ubs_id, service_id, DIAS[0]) == antes
+
+def test_one_per_date(app, client, catalog, user_id):
+    ubs_id = catalog['ubs'][0]
+    consulta, vacina = catalog['services']
+
+    first = book(client, user_id, ubs_id, consulta, DIAS[0])
+    assert first.status_code == 200
+
+    refused = book(client, user_id, ubs_id, vacina, DIAS[0], 'Tarde')
+    assert refused.status_code == 400
+    assert refused.get_json()['error'] == 'Você já tem um agendamento para esta data'
+    assert len(state(app, user_id).entries) == 1
+
+    # Depois do cancelamento a data fica livre de novo
+    client.put(f"/api/appointments/cancel/{first.get_json()['appointment_id']}")
+    assert book(client, user_id, ubs_id, vacina, DIAS[0], 'Tarde').status_code == 200
+
+def test_max_open(app, client, catalog, user_id):
+    ubs_id, service_id = catalog['ubs'][0], catalog['services'][0]
+
+    for offset in DIAS[:3]:
+        assert book(client, user_id, ubs_id, service_id, offset).status_code == 200
+
+    antes = disponivel(app, ubs_id, service_id, DIAS[3])
+    refused = book(client, user_id, ubs_id, service_id, DIAS[3])
+    assert refused.status_code == 400
+    assert refused.get_json()['error'] == 'Limite de 3 agendamentos em aberto atingido'
+    assert disponivel(app, ubs_id, service_id, DIAS[3]) == antes
+    assert state(app, user_id).version == 2
+
+def _bump_version(user_id):
+    """Simula outra requisição gravando os contadores do usuário entre a leitura e a gravação"""
+    db.session.execute(
+        update(UserBookingState)
+        .where(UserBookingState.user_id == user_id)
+        .values(version=UserBookingState.version + 1)
+    )
+
+def test_apply_change_retries_on_version_conflict(app, catalog, user_id):
+    service_id = catalog['services'][0]
+    data = date.today() + timedelta(days=DIAS[0])
+    with app.app_context():
+        assert apply_change(user_id, rescheduling(service_id, data, data)) is None
+        db.session.commit()
+
+        calls = []
+        change = booking(service_id, data + timedelta(days=60))
+
+        def concurrent(state):
+            calls.append(state.version)
+            if len(calls) == 1:
+                _bump_version(user_id)
+            return change(state)
+
+        assert apply_change(user_id, concurrent) is None
+        db.session.commit()
+
+        # A primeira gravação perdeu para a concorrente; a segunda releu a linha
+        assert calls == [0, 1]
+        counters = BookingState.from_row(db.session.execute(state_query(user_id)).first())
+        assert counters.version == 2
+        assert len(counters.entries) == 2
+
+def test_apply_change_gives_up_after_max_retries(app, catalog, user_id):
+    service_id = catalog['services'][0]
+    data = date.today() + timedelta(days=DIAS[0])
+    with app.app_context():
+        apply_change(user_id, rescheduling(service_id, data, data))
+        db.session.commit()
+
+        calls = []
+
+        def always_conflicting(state):
+            calls.append(state.version)
+            _bump_version(user_id)
+
+        with pytest.raises(RuntimeError):
+            apply_change(user_id, always_conflicting)
+        db.session.rollback()
+        assert len(calls) == booking_rules.MAX_RETRIES
+
+def test_apply_changes_updates_existing_and_new_rows(app, catalog, user_id):
+    service_id = catalog['services'][0]
+    data = date.today() + timedelta(days=DIAS[0])
+    nova_data = data + timedelta(days=1)
+    with app.app_context():
+        apply_change(user_id, rescheduling(service_id, data, data))
+        db.session.commit()
+
+    # other ainda não tem linha de contadores: passa por apply_change
+    other_id = new_user(app)
+    with app.app_context():
+        progress = list(apply_changes({
+            user_id: [rescheduling(service_id, data, nova_data)],
+            other_id: [rescheduling(service_id, data, nova_data)]
+        }))
+        db.session.commit()
+        assert progress == [(2, 2)]
+
+    key = service_key(service_id)
+    existing = state(app, user_id)
+    assert existing.version == 1
+    assert existing.entries == [(nova_data.toordinal(), 1, key)]
+    created = state(app, other_id)
+    assert created.version == 0
+    assert created.entries == [(nova_data.toordinal(), 1, key)]
@@ -0,0 +1,110 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import update
+
+from conftest import DIAS, day, new_user
+from src.models.database import db, DayCapacity
+from src.utils import capacity
+from src.utils.capacity import WindowBusy, day_query, reserve_window, unpack
+from src.utils.sharding import route_ubs
+
+# Vagas por janela; as janelas (30 minutos, das 08:00 às 09:00) ficam no primeiro dia de DIAS
+VAGAS = 2
+
+@pytest.fixture(scope='module')
+def windows(app, admin_headers, catalog):
+    ubs_id, service_id = catalog['ubs'][1], catalog['services'][0]
+    response = app.test_client().post('/api/admin/capacity', json={
+        'ubs_id': ubs_id,
+        'service_id': service_id,
+        'data_inicio': day(DIAS[0]),
+        'data_fim': day(DIAS[0]),
+        'inicio': '08:00',
+        'fim': '09:00',
+        'intervalo_minutos': 30,
+        'vagas_por_janela': VAGAS,
+        'incluir_fim_de_semana': True
+    }, headers=admin_headers)
+    assert response.status_code == 200, response.get_json()
+    return ubs_id, service_id, date.today() + timedelta(days=DIAS[0])
+
+def _day(ubs_id, service_id, data):
+    route_ubs(ubs_id)
+    return db.session.execute(day_query(ubs_id, service_id, data)).first()
+
+def _book(client, user_id, ubs_id, service_id, data, horario):
+    return client.post('/api/appointments/create', json={
+        'user_id': user_id,
+        'ubs_id': ubs_id,
+        'service_id': service_id,
+        'data_agendamento': data.isoformat(),
+        'horario': horario
+    })
+
+def test_window_booking_and_cancel(app, client, windows):
+    ubs_id, service_id, data = windows
+
+    created = []
+    for _ in range(VAGAS):
+        response = _book(client, new_user(app), ubs_id, service_id, data, '08:30')
+        assert response.status_code == 200, response.get_json()
+        created.append(response.get_json()['appointment_id'])
+
+    full = _book(client, new_user(app), ubs_id, service_id, data, '08:30')
+    assert full.status_code == 400
+    # Horário fora da grade de janelas também não tem vaga
+    assert _book(client, new_user(app), ubs_id, service_id, data, '08:10').status_code == 400
+
+    with app.app_context():
+        assert list(unpack(_day(ubs_id, service_id, data).vagas_disponiveis)) == [VAGAS, 0]
+
+    assert client.put(f'/api/appointments/cancel/{created[0]}').status_code == 200
+    with app.app_context():
+        assert list(unpack(_day(ubs_id, service_id, data).vagas_disponiveis)) == [VAGAS, 1]
+
+def _bump_day(day):
+    """Simula outra requisição alterando o dia entre a leitura e o UPDATE condicional"""
+    db.session.execute(
+        update(DayCapacity).where(DayCapacity.id == day.id).values(version=DayCapacity.version + 1)
+    )
+
+def test_adjust_retries_on_version_conflict(app, windows, monkeypatch):
+    ubs_id, service_id, data = windows
+    original = capacity.adjust_statement
+    calls = []
+
+    def concurrent(day, minutos, delta):
+        calls.append(day.version)
+        if len(calls) == 1:
+            _bump_day(day)
+        return original(day, minutos, delta)
+
+    monkeypatch.setattr(capacity, 'adjust_statement', concurrent)
+    with app.app_context():
+        before = _day(ubs_id, service_id, data)
+        assert reserve_window(ubs_id, service_id, data, 8 * 60)
+        after = _day(ubs_id, service_id, data)
+        db.session.rollback()
+
+    assert calls == [before.version, before.version + 1]
+    assert after.version == before.version + 2
+    assert unpack(after.vagas_disponiveis)[0] == unpack(before.vagas_disponiveis)[0] - 1
+
+def test_adjust_gives_up_with_window_busy(app, windows, monkeypatch):
+    ubs_id, service_id, data = windows
+    original = capacity.adjust_statement
+    calls = []
+
+    def always_conflicting(day, minutos, delta):
+        calls.append(day.version)
+        _bump_day(day)
+        return original(day, minutos, delta)
+
+    monkeypatch.setattr(capacity, 'adjust_statement', always_conflicting)
+    with app.app_context():
+        route_ubs(ubs_id)
+        with pytest.raises(WindowBusy):
+            reserve_window(ubs_id, service_id, data, 8 * 60)
+        db.session.rollback()
+    assert len(calls) == capacity.MAX_RETRIES
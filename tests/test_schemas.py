@@ -0,0 +1,104 @@
+import uuid
+
+import pytest
+from sqlalchemy.dialects import postgresql, sqlite
+
+from src.models.database import db, CompactId, User
+from src.utils import schemas
+from src.utils.schemas import UNSET, ValidationError
+
+USER = '0190a0b2-7c1d-7e3f-8a4b-5c6d7e8f9a0b'
+
+def test_update_user_null_vs_absent():
+    absent = schemas.UPDATE_USER.load({'user_id': USER})
+    assert absent.nome_completo is UNSET and absent.celular is UNSET and absent.carteira_sus is UNSET
+
+    cleared = schemas.UPDATE_USER.load({'user_id': USER, 'celular': None, 'nome_completo': ''})
+    assert cleared.celular is None
+    assert cleared.nome_completo == ''
+    assert cleared.carteira_sus is UNSET
+
+def test_null_on_non_nullable_field_counts_as_absent():
+    # UPDATE_UBS não aceita apagar campos: null volta ao default (UNSET)
+    payload = schemas.UPDATE_UBS.load({'nome': None, 'latitude': None})
+    assert payload.nome is UNSET and payload.latitude is UNSET
+
+@pytest.mark.parametrize('body, message', [
+    ({}, 'ID do usuário é obrigatório'),
+    ({'user_id': None}, 'ID do usuário é obrigatório'),
+    ({'user_id': 'abc'}, 'ID do usuário inválido'),
+    ({'user_id': USER + '0'}, 'ID do usuário inválido'),
+    ({'user_id': 123}, 'ID do usuário inválido'),
+    ({'user_id': USER, 'celular': 'x' * 16}, 'celular inválido'),
+    ([USER], 'O corpo da requisição deve ser um objeto JSON'),
+    (None, 'O corpo da requisição deve ser um objeto JSON'),
+])
+def test_update_user_rejects(body, message):
+    with pytest.raises(ValidationError) as error:
+        schemas.UPDATE_USER.load(body)
+    assert error.value.message == message
+    assert error.value.status == 400
+
+def test_ids_accept_compact_forms():
+    for value in (USER, USER.upper(), USER.replace('-', '')):
+        assert schemas.UPDATE_USER.load({'user_id': value}).user_id == value
+
+def test_malformed_path_id_is_not_found():
+    with pytest.raises(ValidationError) as error:
+        schemas.USER_ID.load({'user_id': 'nao-e-um-id'})
+    assert error.value.status == 404
+    assert error.value.message == 'Usuário não encontrado'
+
+def test_integer_rejects_bool():
+    with pytest.raises(ValidationError):
+        schemas.PROFILING.load({'segundos': True})
+    assert schemas.PROFILING.load({'segundos': '5'}).segundos == 5
+
+def test_update_user_route(app, client, user_id):
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        user.celular = '11999999999'
+        user.carteira_sus = '123'
+        db.session.commit()
+
+    assert client.get(f'/api/auth/user/{user_id}').get_json()['user']['celular'] == '11999999999'
+
+    # Ausente mantém o valor; null apaga
+    response = client.put('/api/auth/update-user', json={'user_id': user_id, 'celular': None})
+    assert response.status_code == 200
+
+    profile = client.get(f'/api/auth/user/{user_id}').get_json()['user']
+    assert profile['celular'] is None
+    assert profile['carteira_sus'] == '123'
+    assert profile['nome_completo'] == 'Paciente'
+
+@pytest.mark.parametrize('method, path, body, status', [
+    ('get', '/api/auth/user/nao-e-um-id', None, 404),
+    ('get', f'/api/auth/user/{uuid.uuid4()}', None, 404),
+    ('get', '/api/appointments/user/123', None, 404),
+    ('put', '/api/appointments/cancel/123', None, 404),
+    ('put', f'/api/appointments/cancel/{uuid.uuid4()}', None, 404),
+    ('put', '/api/auth/update-user', {'user_id': 'abc'}, 400),
+    ('put', '/api/auth/update-user', {'user_id': str(uuid.uuid4())}, 404),
+    ('post', '/api/appointments/create', {
+        'user_id': 'abc', 'ubs_id': USER, 'service_id': USER, 'data_agendamento': '2030-01-01', 'turno': 'Manhã'
+    }, 400),
+])
+def test_malformed_and_unknown_ids(client, method, path, body, status):
+    response = getattr(client, method)(path, json=body)
+    assert response.status_code == status, response.get_json()
+
+@pytest.mark.parametrize('dialect', [sqlite.dialect(), postgresql.dialect()])
+def test_compact_id_round_trip(dialect):
+    column = CompactId()
+    for value in (USER, USER.upper(), USER.replace('-', ''), uuid.UUID(USER), uuid.UUID(USER).bytes):
+        assert column.process_result_value(column.process_bind_param(value, dialect), dialect) == USER
+
+@pytest.mark.parametrize('value', ['', 'abc', USER[:-1], USER + '0', 'z' * 32, 'g' + USER[1:]])
+def test_compact_id_invalid_binds_null(value):
+    assert CompactId().process_bind_param(value, sqlite.dialect()) is None
+
+def test_compact_id_invalid_finds_nothing(app, user_id):
+    with app.app_context():
+        assert db.session.get(User, user_id).id == user_id
+        assert User.query.filter_by(id='nao-e-um-id').first() is None
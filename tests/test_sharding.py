@@ -0,0 +1,93 @@
+import uuid
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+
+from conftest import DIAS, day
+from src.models.database import db, CityShard, Slot
+from src.utils.sharding import route_ubs, using
+from test_booking import book
+
+def _shard_counts(app, user_id, keys):
+    """Agendamentos do usuário em cada shard, lidos direto de cada banco"""
+    counts = {}
+    with app.app_context():
+        engines = app.extensions['sqlalchemy'].engines
+        for key in keys:
+            with engines[key].connect() as conn:
+                counts[key] = conn.execute(
+                    sa.text('SELECT COUNT(*) FROM appointments WHERE user_id = :user_id'),
+                    {'user_id': uuid.UUID(user_id).bytes}
+                ).scalar()
+    return counts
+
+def _listing(client, admin_headers, **args):
+    params = {'data_inicio': date.today().isoformat(), 'data_fim': day(DIAS[-1]), **args}
+    response = client.get('/api/admin/appointments', query_string=params, headers=admin_headers)
+    assert response.status_code == 200, response.get_json()
+    return {item['id']: item for item in response.get_json()['appointments']}
+
+def test_cities_on_different_shards(app, catalog, sharded):
+    with app.app_context():
+        shards = {
+            row.cidade_id: row.shard
+            for row in CityShard.query.filter(CityShard.cidade_id.in_(catalog['cities']))
+        }
+    assert sorted(shards.values()) == sorted(sharded)
+
+def test_create_cancel_and_list_across_shards(app, client, admin_headers, catalog, user_id):
+    service_id = catalog['services'][1]
+    created = []
+    for ubs_id, offset in zip(catalog['ubs'], DIAS):
+        response = book(client, user_id, ubs_id, service_id, offset, 'Tarde')
+        assert response.status_code == 200, response.get_json()
+        created.append(response.get_json()['appointment_id'])
+
+    # O usuário vê os agendamentos das duas cidades
+    response = client.get(f'/api/appointments/user/{user_id}')
+    assert response.status_code == 200
+    assert {item['id'] for item in response.get_json()['appointments']} == set(created)
+
+    # Sem ubs_id a listagem administrativa junta os shards; com ubs_id, só o da UBS
+    assert set(created) <= set(_listing(client, admin_headers))
+    only_second = _listing(client, admin_headers, ubs_id=catalog['ubs'][1])
+    assert created[1] in only_second and created[0] not in only_second
+
+    response = client.put(f'/api/appointments/cancel/{created[1]}')
+    assert response.status_code == 200, response.get_json()
+
+    listing = _listing(client, admin_headers)
+    assert listing[created[0]]['status'] == 'Confirmado'
+    assert listing[created[1]]['status'] == 'Cancelado'
+
+    statuses = {item['id']: item['status'] for item in client.get(f'/api/appointments/user/{user_id}').get_json()['appointments']}
+    assert statuses == {created[0]: 'Confirmado', created[1]: 'Cancelado'}
+
+    # A vaga volta no slot do shard da segunda UBS
+    with app.app_context():
+        route_ubs(catalog['ubs'][1])
+        slot = Slot.query.filter_by(
+            ubs_id=catalog['ubs'][1], service_id=service_id,
+            data=date.today() + timedelta(days=DIAS[1]), turno='Tarde'
+        ).one()
+        assert slot.quantidade_disponivel == slot.quantidade_total
+
+def test_appointments_stored_in_city_shard(app, client, catalog, user_id, sharded):
+    service_id = catalog['services'][0]
+    for ubs_id, offset in zip(catalog['ubs'], DIAS[2:]):
+        assert book(client, user_id, ubs_id, service_id, offset).status_code == 200
+
+    assert _shard_counts(app, user_id, sharded) == {key: 1 for key in sharded}
+
+    # Cada shard só tem os slots das UBS das próprias cidades
+    with app.app_context():
+        for key in sharded:
+            with using(key):
+                ubs_ids = {row.ubs_id for row in db.session.execute(sa.select(Slot.ubs_id).distinct())}
+            assert len(ubs_ids) == 1 and ubs_ids <= set(catalog['ubs'])
+
+def test_listing_requires_admin_and_period(client, admin_headers, catalog):
+    assert client.get('/api/admin/appointments').status_code == 401
+    response = client.get('/api/admin/appointments', headers=admin_headers)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Informe data_inicio e data_fim'